@@ -1,7 +1,11 @@
 import tkinter as tk
-from tkinter import filedialog, messagebox, ttk
+from tkinter import filedialog, messagebox, simpledialog, ttk
 import os
-import subprocess
+import time
+from procwatch import ProcessSupervisor, WarmPool, prefetch, tk_notifier
+from romheader import read_header
+from romlibrary import RomLibrary
+from thumbcache import ThumbnailCache
 
 class SNESEmulator:
     def __init__(self, root):
@@ -20,7 +24,14 @@ class SNESEmulator:
         self.current_rom = None
         self.is_running = False
         self.emulator_path = None
-        self.emulator_process = None
+        self.supervisor = ProcessSupervisor(tk_notifier(root))  # External emulator instances
+        self.warm_pool = None  # Prestarted emulator waiting for a ROM
+        self.prewarm = tk.BooleanVar(value=False)
+        self.load_command = ""  # Line the emulator reads on stdin to load {rom}
+        self.start_pressed = 0.0
+        self.library = RomLibrary()  # Indexed ROM folders and the Recent ROMs list
+        self.library_window = None
+        self.thumbnails = ThumbnailCache(notify=self.supervisor.notify)  # Library previews
         
         self.create_menu()
         self.create_main_frame()
@@ -35,7 +46,9 @@ class SNESEmulator:
         menubar = tk.Menu(self.root)
         file_menu = tk.Menu(menubar, tearoff=0)
         file_menu.add_command(label="Open ROM...", command=self.open_rom)
-        file_menu.add_command(label="Recent ROMs", command=self.not_implemented)
+        self.recent_menu = tk.Menu(file_menu, tearoff=0, postcommand=self.update_recent_menu)
+        file_menu.add_cascade(label="Recent ROMs", menu=self.recent_menu)
+        file_menu.add_command(label="ROM Library...", command=self.show_library)
         file_menu.add_separator()
         file_menu.add_command(label="Exit", command=self.root.quit)
         menubar.add_cascade(label="File", menu=file_menu)
@@ -48,6 +61,9 @@ class SNESEmulator:
         
         settings_menu = tk.Menu(menubar, tearoff=0)
         settings_menu.add_command(label="Set Emulator Path...", command=self.set_emulator_path)
+        settings_menu.add_checkbutton(label="Prewarm Emulator", variable=self.prewarm,
+                                      command=self.update_warm_pool)
+        settings_menu.add_command(label="Set Load Command...", command=self.set_load_command)
         menubar.add_cascade(label="Settings", menu=settings_menu)
         
         help_menu = tk.Menu(menubar, tearoff=0)
@@ -131,10 +147,35 @@ class SNESEmulator:
         )
         if emulator_path:
             self.emulator_path = emulator_path
+            prefetch(emulator_path)  # Page the binary in before the first Start
+            self.update_warm_pool()
             messagebox.showinfo("Emulator Path Set", f"Emulator path set to: {emulator_path}")
         else:
             messagebox.showwarning("No File Selected", "No emulator executable selected.")
     
+    def set_load_command(self):
+        """Set the stdin command a prewarmed emulator uses to load a ROM"""
+        command = simpledialog.askstring(
+            "Load Command",
+            "Line the emulator reads on stdin to load a ROM ({rom} is the ROM path):",
+            initialvalue=self.load_command or "load {rom}", parent=self.root)
+        if command is not None:
+            self.load_command = command.strip()
+            self.update_warm_pool()
+    
+    def update_warm_pool(self):
+        """Start or stop the prewarmed emulator to match the settings"""
+        if self.warm_pool:
+            self.warm_pool.close()
+            self.warm_pool = None
+        if not self.prewarm.get():
+            return
+        if not (self.emulator_path and self.load_command):
+            self.prewarm.set(False)
+            messagebox.showinfo("Prewarm Emulator", "Prewarming needs an emulator path and a load command for emulators that accept one on stdin.")
+            return
+        self.warm_pool = WarmPool(self.supervisor, [self.emulator_path], self.load_command + "\n")
+    
     def open_rom(self):
         """Open a ROM file"""
         filetypes = [
@@ -148,15 +189,138 @@ class SNESEmulator:
         )
         
         if filename and os.path.isfile(filename) and (filename.lower().endswith('.sfc') or filename.lower().endswith('.smc')):
-            self.current_rom = filename
-            rom_name = os.path.basename(filename)
-            self.rom_label.config(text=f"ROM: {rom_name}")
-            self.status_label.config(text=f"Loaded: {rom_name}")
-            self.is_running = False
-            self.reset_emulation()
+            self.load_rom(filename)
         else:
             messagebox.showerror("Invalid File", "Please select a valid .sfc or .smc file.")
     
+    def load_rom(self, filename):
+        """Select a ROM (from the file dialog, Recent ROMs or the library)"""
+        if not os.path.isfile(filename):
+            messagebox.showerror("Missing File", f"ROM not found: {filename}")
+            return
+        self.current_rom = filename
+        rom_name = os.path.basename(filename)
+        try:
+            header = read_header(filename)  # A few small reads, not the whole ROM
+        except OSError:
+            header = None
+        if header and header["title"]:
+            self.rom_label.config(text=f"ROM: {header['title']} ({header['mapping']}, {header['region']})")
+        else:
+            self.rom_label.config(text=f"ROM: {rom_name}")
+        self.status_label.config(text=f"Loaded: {rom_name}")
+        prefetch(filename)  # Read the ROM into the page cache while the user gets to Start
+        self.library.add_recent(filename)
+        self.is_running = False
+        self.reset_emulation()
+    
+    def update_recent_menu(self):
+        """Rebuild the Recent ROMs submenu when it opens"""
+        self.recent_menu.delete(0, tk.END)
+        recent = self.library.recent()
+        for path in recent:
+            self.recent_menu.add_command(label=os.path.basename(path), command=lambda p=path: self.load_rom(p))
+        if not recent:
+            self.recent_menu.add_command(label="(none)", state=tk.DISABLED)
+    
+    def show_library(self):
+        """Browse the indexed ROM folders"""
+        if self.library_window and self.library_window.winfo_exists():
+            self.library_window.lift()
+            return
+        window = self.library_window = tk.Toplevel(self.root, bg=self.bg_color)
+        window.title("ROM Library")
+        self.thumbnails.recheck_missing()  # Emulators may have saved previews since
+        window.geometry("660x420")
+        search = tk.StringVar()
+        entry = tk.Entry(window, textvariable=search)
+        entry.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
+        preview = tk.Label(window, text="No preview", width=16, bg="black", fg=self.text_color)
+        preview.pack(side=tk.RIGHT, anchor=tk.N, padx=5)
+        scrollbar = tk.Scrollbar(window)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        listbox = tk.Listbox(window, bg="black", fg=self.text_color, activestyle="none")
+        listbox.pack(fill=tk.BOTH, expand=True, padx=5)
+        status = tk.Label(window, text="", bg=self.accent_color, fg=self.text_color, anchor=tk.W, padx=5)
+        status.pack(side=tk.BOTTOM, fill=tk.X)
+        paths = []
+        
+        def refresh(*args):
+            roms = self.library.roms(search.get().strip())
+            paths[:] = [path for path, title in roms]
+            listbox.delete(0, tk.END)
+            listbox.insert(tk.END, *(f"{title} ({os.path.basename(path)})" if title else os.path.basename(path)
+                                     for path, title in roms))
+            status.config(text=f"{len(paths)} ROMs in {len(self.library.directories())} folders")
+        
+        def listed():
+            if window.winfo_exists():
+                refresh()
+                status.config(text="Hashing...")
+        
+        def scanned(result):
+            if window.winfo_exists():
+                found, hashed, removed = result
+                refresh()
+                status.config(text=f"{found} ROMs, {hashed} new or changed, {removed} removed")
+        
+        def rescan():
+            if self.library.scan_async(done=lambda result: self.supervisor.notify(lambda: scanned(result)),
+                                       listed=lambda: self.supervisor.notify(listed)):
+                status.config(text="Scanning...")
+        
+        def add_folder():
+            directory = filedialog.askdirectory(title="Add ROM Folder", parent=window)
+            if directory:
+                self.library.add_directory(directory)
+                rescan()
+        
+        def show_preview(path, thumbnail):
+            if not window.winfo_exists():
+                return
+            selection = listbox.curselection()
+            if not selection or paths[selection[0]] != path:
+                return  # Selection moved on while it loaded
+            if thumbnail is None:
+                preview.config(image="", text="No preview")
+                preview.image = None
+                return
+            width, height, rgb = thumbnail
+            preview.image = tk.PhotoImage(data=b"P6 %d %d 255\n" % (width, height) + rgb, format="PPM")
+            preview.config(image=preview.image, text="")
+        
+        def selected(event=None):
+            selection = listbox.curselection()
+            if selection:
+                path = paths[selection[0]]
+                thumbnail = self.thumbnails.get(path, show_preview)
+                if thumbnail is not None:
+                    show_preview(path, thumbnail)
+        
+        def scrolled(first, last):
+            scrollbar.set(first, last)
+            # Warm the cache for the rows in view so selecting them is instant
+            top = listbox.nearest(0)
+            bottom = listbox.nearest(listbox.winfo_height())
+            self.thumbnails.prefetch(paths[top:bottom + 1])
+        
+        def open_selected(event=None):
+            selection = listbox.curselection()
+            if selection:
+                self.load_rom(paths[selection[0]])
+        
+        buttons = tk.Frame(window, bg=self.bg_color)
+        buttons.pack(side=tk.BOTTOM, fill=tk.X, pady=5)
+        for text, command in (("Open", open_selected), ("Add Folder...", add_folder), ("Rescan", rescan)):
+            tk.Button(buttons, text=text, command=command, bg=self.button_color, fg=self.text_color).pack(side=tk.LEFT, padx=5)
+        search.trace_add("write", refresh)
+        listbox.bind("<Double-Button-1>", open_selected)
+        listbox.bind("<<ListboxSelect>>", selected)
+        listbox.config(yscrollcommand=scrolled)
+        scrollbar.config(command=listbox.yview)
+        refresh()
+        rescan()  # Unchanged files cost only a stat
+    
     def start_emulation(self):
         """Start emulation by launching external emulator"""
         if not self.current_rom:
@@ -167,29 +331,44 @@ class SNESEmulator:
             messagebox.showwarning("Emulator Not Set", "Please set the emulator path in Settings > Set Emulator Path...")
             return
         
-        try:
-            self.emulator_process = subprocess.Popen([self.emulator_path, self.current_rom])
-            self.is_running = True
-            self.status_label.config(text=f"Running: {os.path.basename(self.current_rom)} (external)")
-            self.fps_label.config(text="FPS: N/A")
-            self.check_emulator_status()
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to launch emulator: {str(e)}")
-    
-    def check_emulator_status(self):
-        """Periodically check if the emulator process is still running"""
-        if self.is_running and self.emulator_process.poll() is None:
-            self.root.after(100, self.check_emulator_status)
+        rom_name = os.path.basename(self.current_rom)
+        self.start_pressed = time.perf_counter()
+        handlers = {"name": rom_name, "on_exit": self.emulator_exited,
+                    "on_output": self.emulator_started}
+        child = self.warm_pool.acquire(self.current_rom, **handlers) if self.warm_pool else None
+        mode = "prewarmed" if child else "external"
+        if child is None:
+            try:
+                self.supervisor.launch([self.emulator_path, self.current_rom], **handlers)
+            except OSError as e:
+                messagebox.showerror("Error", f"Failed to launch emulator: {str(e)}")
+                return
+        self.is_running = True
+        count = len(self.supervisor.running())
+        instances = f", {count} instances" if count > 1 else ""
+        self.status_label.config(text=f"Running: {rom_name} ({mode}{instances})")
+        self.fps_label.config(text="FPS: N/A")
+    
+    def emulator_started(self, child):
+        """Called on the Tk thread at the emulator's first output (our proxy for its first frame)"""
+        latency = (child.first_output - self.start_pressed) * 1000
+        self.status_label.config(text=f"Running: {child.name} (first output {latency:.0f} ms after Start)")
+    
+    def emulator_exited(self, child):
+        """Called on the Tk thread when an emulator process ends"""
+        self.is_running = bool(self.supervisor.running())
+        if child.returncode and not child.stopping:
+            detail = f": {child.stderr[-1]}" if child.stderr else ""
+            self.status_label.config(text=f"Emulator exited with code {child.returncode}{detail}")
         else:
-            self.is_running = False
-            self.status_label.config(text=f"Emulation stopped: {os.path.basename(self.current_rom)}")
+            self.status_label.config(text=f"Emulation stopped: {child.name}")
+        if not self.is_running:
             self.fps_label.config(text="FPS: --")
     
     def reset_emulation(self, event=None):
         """Reset emulation"""
         self.is_running = False
-        if self.emulator_process and self.emulator_process.poll() is None:
-            self.emulator_process.terminate()
+        self.supervisor.stop_all()  # Terminate, then kill stragglers in the background
         self.canvas.delete("all")
         if self.current_rom:
             rom_name = os.path.basename(self.current_rom)
@@ -225,3 +404,6 @@ if __name__ == "__main__":
     root = tk.Tk()
     app = SNESEmulator(root)
     root.mainloop()
+    if app.warm_pool:
+        app.warm_pool.close()
+    app.supervisor.stop_all(wait=True)  # Their output pipes end with this process
@@ -0,0 +1,1480 @@
+import struct
+from array import array
+
+from memory import PAGE_SHIFT, PagedMemory
+
+try:
+    import numpy as np
+except ImportError:  # Fall back to the per-sample mixer
+    np = None
+
+# SNES audio processing unit: SPC700 CPU + S-DSP sharing 64KB of APU RAM.
+#
+# The APU runs on its own clock. Instead of interleaving it instruction by
+# instruction with the main CPU, it is caught up lazily: whenever the main
+# CPU touches an APU port ($2140-$2143), and at the end of each frame, the
+# SPC700 runs until its clock matches the main CPU's timestamp. The DSP is
+# in turn caught up to the SPC700 only when its registers are accessed or
+# when the frame's samples are collected.
+
+MASTER_CLOCK = 21477272  # NTSC master clock (Hz)
+APU_CLOCK = 1024000  # SPC700 clock (Hz)
+DSP_CYCLES_PER_SAMPLE = 32  # 1.024 MHz / 32 = 32 kHz output
+
+IPL_ROM = bytes([
+    0xCD, 0xEF, 0xBD, 0xE8, 0x00, 0xC6, 0x1D, 0xD0, 0xFC, 0x8F, 0xAA, 0xF4, 0x8F, 0xBB, 0xF5, 0x78,
+    0xCC, 0xF4, 0xD0, 0xFB, 0x2F, 0x19, 0xEB, 0xF4, 0xD0, 0xFC, 0x7E, 0xF4, 0xD0, 0x0B, 0xE4, 0xF5,
+    0xCB, 0xF4, 0xD7, 0x00, 0xFC, 0xD0, 0xF3, 0xAB, 0x01, 0x10, 0xEF, 0x7E, 0xF4, 0x10, 0xEB, 0xBA,
+    0xF6, 0xDA, 0x00, 0xBA, 0xF4, 0xC4, 0xF4, 0xDD, 0x5D, 0xD0, 0xDB, 0x1F, 0x00, 0x00, 0xC0, 0xFF,
+])
+
+# Base cycle counts per opcode; taken branches add 2.
+CYCLES = bytes([
+    2, 8, 4, 5, 3, 4, 3, 6, 2, 6, 5, 4, 5, 4, 6, 8,
+    2, 8, 4, 5, 4, 5, 5, 6, 5, 5, 6, 5, 2, 2, 4, 6,
+    2, 8, 4, 5, 3, 4, 3, 6, 2, 6, 5, 4, 5, 4, 5, 4,
+    2, 8, 4, 5, 4, 5, 5, 6, 5, 5, 6, 5, 2, 2, 3, 8,
+    2, 8, 4, 5, 3, 4, 3, 6, 2, 6, 4, 4, 5, 4, 6, 6,
+    2, 8, 4, 5, 4, 5, 5, 6, 5, 5, 4, 5, 2, 2, 4, 3,
+    2, 8, 4, 5, 3, 4, 3, 6, 2, 6, 4, 4, 5, 4, 5, 5,
+    2, 8, 4, 5, 4, 5, 5, 6, 5, 5, 5, 5, 2, 2, 3, 6,
+    2, 8, 4, 5, 3, 4, 3, 6, 2, 6, 5, 4, 5, 2, 4, 5,
+    2, 8, 4, 5, 4, 5, 5, 6, 5, 5, 5, 5, 2, 2, 12, 5,
+    3, 8, 4, 5, 3, 4, 3, 6, 2, 6, 4, 4, 5, 2, 4, 4,
+    2, 8, 4, 5, 4, 5, 5, 6, 5, 5, 5, 5, 2, 2, 3, 4,
+    3, 8, 4, 5, 4, 5, 4, 7, 2, 5, 6, 4, 5, 2, 4, 9,
+    2, 8, 4, 5, 5, 6, 6, 7, 4, 5, 5, 5, 2, 2, 6, 3,
+    2, 8, 4, 5, 3, 4, 3, 6, 2, 4, 5, 3, 4, 3, 4, 3,
+    2, 8, 4, 5, 4, 5, 5, 6, 3, 4, 5, 4, 2, 2, 4, 3,
+])
+
+
+class Timer:
+    """One of the three SPC700 timers, advanced lazily from the SPC clock."""
+
+    def __init__(self, period):
+        self.period = period  # SPC cycles per stage-1 tick (128 or 16)
+        self.enabled = False
+        self.target = 0
+        self.stage2 = 0
+        self.output = 0
+        self.last = 0  # SPC cycle the timer was last synced to
+
+    def sync(self, now):
+        ticks = (now - self.last) // self.period
+        self.last += ticks * self.period
+        if not self.enabled or not ticks:
+            return
+        target = self.target or 256
+        total = self.stage2 + ticks
+        self.output = (self.output + total // target) & 0x0F
+        self.stage2 = total % target
+
+    def read(self, now):
+        self.sync(now)
+        value = self.output
+        self.output = 0
+        return value
+
+
+class SPC700:
+    """Sony SPC700 audio CPU with its memory-mapped I/O ($F0-$FF)."""
+
+    def __init__(self, dsp):
+        self.dsp = dsp
+        self.brr_pages = dsp.brr_cache.pages  # Pages holding cached BRR samples
+        self.ram = bytearray(0x10000)
+        self.ram_pages = PagedMemory(self.ram)
+        self.ram_dirty = self.ram_pages.dirty
+        self.timers = [Timer(128), Timer(128), Timer(16)]
+        self.ops = self._build_ops()
+        self.power_on()
+
+    # -- state ---------------------------------------------------------
+
+    def power_on(self):
+        self.ram[:] = bytes(0x10000)
+        self.ram_pages.touch_all()
+        self.dsp.brr_cache.clear()
+        self.cycles = 0
+        self.reset()
+
+    def reset(self):
+        self.a = self.x = self.y = 0
+        self.sp = 0xEF
+        self.n = self.v = self.p = self.b = self.h = self.i = self.z = self.c = 0
+        self.cpu_in = bytearray(4)  # Written by the main CPU, read at $F4-$F7
+        self.cpu_out = bytearray(4)  # Written at $F4-$F7, read by the main CPU
+        self.ipl_enabled = True
+        self.dsp_addr = 0
+        self.stopped = False
+        self.writes = 0  # Bumped on every store; used for idle-loop detection
+        self.timer_reads = 0
+        self.dsp_reads = 0  # DSP state (ENDX, OUTX, ENVX) moves on its own too
+        self.idle_signature = None
+        for timer in self.timers:
+            timer.enabled = False
+            timer.stage2 = timer.output = timer.target = 0
+            timer.last = self.cycles
+        self.pc = IPL_ROM[0x3E] | (IPL_ROM[0x3F] << 8)
+
+    def get_psw(self):
+        return ((0x80 if self.n else 0) | (0x40 if self.v else 0) | (0x20 if self.p else 0) |
+                (0x10 if self.b else 0) | (0x08 if self.h else 0) | (0x04 if self.i else 0) |
+                (0x02 if self.z else 0) | (0x01 if self.c else 0))
+
+    def set_psw(self, value):
+        self.n = value & 0x80
+        self.v = value & 0x40
+        self.p = value & 0x20
+        self.b = value & 0x10
+        self.h = value & 0x08
+        self.i = value & 0x04
+        self.z = value & 0x02
+        self.c = value & 0x01
+
+    # -- bus -----------------------------------------------------------
+
+    def read(self, addr):
+        if addr < 0xF0 or 0x100 <= addr < 0xFFC0:
+            return self.ram[addr]
+        if addr >= 0xFFC0:
+            return IPL_ROM[addr - 0xFFC0] if self.ipl_enabled else self.ram[addr]
+        if addr == 0xF3:
+            self.dsp_reads += 1
+            return self.dsp.read(self.dsp_addr & 0x7F, self.cycles)
+        if 0xF4 <= addr <= 0xF7:
+            return self.cpu_in[addr - 0xF4]
+        if addr >= 0xFD:
+            self.timer_reads += 1
+            return self.timers[addr - 0xFD].read(self.cycles)
+        if addr == 0xF2:
+            return self.dsp_addr
+        if addr in (0xF8, 0xF9):
+            return self.ram[addr]
+        return 0  # $F0, $F1 and $FA-$FC are write-only
+
+    def write(self, addr, value):
+        self.writes += 1
+        self.ram[addr] = value
+        self.ram_dirty[addr >> PAGE_SHIFT] = 1
+        if self.brr_pages[addr >> 8]:
+            self.dsp.brr_cache.invalidate(addr)
+        if 0xF0 <= addr <= 0xFF:
+            self._write_io(addr, value)
+
+    def _write_io(self, addr, value):
+        if addr == 0xF1:
+            for n, timer in enumerate(self.timers):
+                timer.sync(self.cycles)
+                enable = bool(value & (1 << n))
+                if enable and not timer.enabled:
+                    timer.stage2 = timer.output = 0
+                timer.enabled = enable
+            if value & 0x10:
+                self.cpu_in[0] = self.cpu_in[1] = 0
+            if value & 0x20:
+                self.cpu_in[2] = self.cpu_in[3] = 0
+            self.ipl_enabled = bool(value & 0x80)
+        elif addr == 0xF2:
+            self.dsp_addr = value
+        elif addr == 0xF3:
+            if self.dsp_addr < 0x80:
+                self.dsp.write(self.dsp_addr, value, self.cycles)
+        elif 0xF4 <= addr <= 0xF7:
+            self.cpu_out[addr - 0xF4] = value
+        elif 0xFA <= addr <= 0xFC:
+            timer = self.timers[addr - 0xFA]
+            timer.sync(self.cycles)
+            timer.target = value
+
+    def fetch(self):
+        value = self.read(self.pc)
+        self.pc = (self.pc + 1) & 0xFFFF
+        return value
+
+    def fetch16(self):
+        lo = self.fetch()
+        return lo | (self.fetch() << 8)
+
+    def push(self, value):
+        self.write(0x100 | self.sp, value)
+        self.sp = (self.sp - 1) & 0xFF
+
+    def pop(self):
+        self.sp = (self.sp + 1) & 0xFF
+        return self.read(0x100 | self.sp)
+
+    # -- addressing modes ----------------------------------------------
+
+    def dp_base(self):
+        return 0x100 if self.p else 0
+
+    def a_dp(self):
+        return self.dp_base() | self.fetch()
+
+    def a_dpx(self):
+        return self.dp_base() | ((self.fetch() + self.x) & 0xFF)
+
+    def a_dpy(self):
+        return self.dp_base() | ((self.fetch() + self.y) & 0xFF)
+
+    def a_abs(self):
+        return self.fetch16()
+
+    def a_absx(self):
+        return (self.fetch16() + self.x) & 0xFFFF
+
+    def a_absy(self):
+        return (self.fetch16() + self.y) & 0xFFFF
+
+    def a_indx(self):
+        return self.dp_base() | self.x
+
+    def a_indy(self):
+        return self.dp_base() | self.y
+
+    def read_dp16(self, addr):
+        base = addr & 0xFF00
+        return self.read(addr) | (self.read(base | ((addr + 1) & 0xFF)) << 8)
+
+    def write_dp16(self, addr, value):
+        base = addr & 0xFF00
+        self.write(addr, value & 0xFF)
+        self.write(base | ((addr + 1) & 0xFF), value >> 8)
+
+    def a_idpx(self):
+        return self.read_dp16(self.a_dpx())
+
+    def a_idpy(self):
+        return (self.read_dp16(self.a_dp()) + self.y) & 0xFFFF
+
+    def a_membit(self):
+        word = self.fetch16()
+        return word & 0x1FFF, word >> 13
+
+    # -- ALU -----------------------------------------------------------
+
+    def setnz(self, value):
+        self.n = value & 0x80
+        self.z = not value
+        return value
+
+    def op_or(self, a, b):
+        return self.setnz(a | b)
+
+    def op_and(self, a, b):
+        return self.setnz(a & b)
+
+    def op_eor(self, a, b):
+        return self.setnz(a ^ b)
+
+    def op_cmp(self, a, b):
+        t = a - b
+        self.c = t >= 0
+        self.setnz(t & 0xFF)
+        return None
+
+    def op_adc(self, a, b):
+        r = a + b + (1 if self.c else 0)
+        self.v = ~(a ^ b) & (a ^ r) & 0x80
+        self.h = (a ^ b ^ r) & 0x10
+        self.c = r > 0xFF
+        return self.setnz(r & 0xFF)
+
+    def op_sbc(self, a, b):
+        return self.op_adc(a, b ^ 0xFF)
+
+    def op_asl(self, value):
+        self.c = value & 0x80
+        return self.setnz((value << 1) & 0xFF)
+
+    def op_rol(self, value):
+        carry = 1 if self.c else 0
+        self.c = value & 0x80
+        return self.setnz(((value << 1) | carry) & 0xFF)
+
+    def op_lsr(self, value):
+        self.c = value & 0x01
+        return self.setnz(value >> 1)
+
+    def op_ror(self, value):
+        carry = 0x80 if self.c else 0
+        self.c = value & 0x01
+        return self.setnz((value >> 1) | carry)
+
+    def op_inc(self, value):
+        return self.setnz((value + 1) & 0xFF)
+
+    def op_dec(self, value):
+        return self.setnz((value - 1) & 0xFF)
+
+    def setnz16(self, value):
+        self.n = value & 0x8000
+        self.z = not value
+
+    def get_ya(self):
+        return (self.y << 8) | self.a
+
+    def set_ya(self, value):
+        self.a = value & 0xFF
+        self.y = (value >> 8) & 0xFF
+        self.setnz16(value & 0xFFFF)
+
+    def branch(self, taken):
+        offset = self.fetch()
+        if taken:
+            target = (self.pc + offset - (0x100 if offset & 0x80 else 0)) & 0xFFFF
+            if offset & 0x80:
+                self._check_idle(target)
+            self.pc = target
+            return 2
+        return 0
+
+    def _check_idle(self, target):
+        # A backward branch that comes round with no stores, no timer or DSP
+        # reads and identical registers can only be waiting on the main CPU
+        # ports, which cannot change until the APU is next synced. Flag it so
+        # run() can skip straight to the target cycle.
+        signature = (target, self.writes, self.timer_reads, self.dsp_reads, self.a, self.x,
+                     self.y, self.sp, self.get_psw())
+        if signature == self.idle_signature:
+            self.stopped = "idle"
+        self.idle_signature = signature
+
+    # -- opcode table --------------------------------------------------
+
+    def _build_ops(self):
+        ops = [None] * 256
+        alu = [self.op_or, self.op_and, self.op_eor, self.op_cmp, self.op_adc, self.op_sbc]
+
+        def reg_op(fn, mode):
+            def op():
+                result = fn(self.a, self.read(mode()))
+                if result is not None:
+                    self.a = result
+            return op
+
+        def imm_op(fn):
+            def op():
+                result = fn(self.a, self.fetch())
+                if result is not None:
+                    self.a = result
+            return op
+
+        def dp_dp_op(fn):
+            def op():
+                src = self.read(self.a_dp())
+                dst = self.a_dp()
+                result = fn(self.read(dst), src)
+                if result is not None:
+                    self.write(dst, result)
+            return op
+
+        def dp_imm_op(fn):
+            def op():
+                imm = self.fetch()
+                dst = self.a_dp()
+                result = fn(self.read(dst), imm)
+                if result is not None:
+                    self.write(dst, result)
+            return op
+
+        def ind_ind_op(fn):
+            def op():
+                src = self.read(self.a_indy())
+                dst = self.a_indx()
+                result = fn(self.read(dst), src)
+                if result is not None:
+                    self.write(dst, result)
+            return op
+
+        for row, fn in enumerate(alu):
+            base = row * 0x20
+            ops[base + 0x04] = reg_op(fn, self.a_dp)
+            ops[base + 0x05] = reg_op(fn, self.a_abs)
+            ops[base + 0x06] = reg_op(fn, self.a_indx)
+            ops[base + 0x07] = reg_op(fn, self.a_idpx)
+            ops[base + 0x08] = imm_op(fn)
+            ops[base + 0x09] = dp_dp_op(fn)
+            ops[base + 0x14] = reg_op(fn, self.a_dpx)
+            ops[base + 0x15] = reg_op(fn, self.a_absx)
+            ops[base + 0x16] = reg_op(fn, self.a_absy)
+            ops[base + 0x17] = reg_op(fn, self.a_idpy)
+            ops[base + 0x18] = dp_imm_op(fn)
+            ops[base + 0x19] = ind_ind_op(fn)
+
+        # MOV A -> memory (no flags)
+        def store(reg, mode):
+            def op():
+                self.write(mode(), getattr(self, reg))
+            return op
+
+        def load(reg, mode):
+            def op():
+                setattr(self, reg, self.setnz(self.read(mode())))
+            return op
+
+        def load_imm(reg):
+            def op():
+                setattr(self, reg, self.setnz(self.fetch()))
+            return op
+
+        for opcode, mode in ((0xC4, self.a_dp), (0xD4, self.a_dpx), (0xC5, self.a_abs),
+                             (0xD5, self.a_absx), (0xC6, self.a_indx), (0xD6, self.a_absy),
+                             (0xC7, self.a_idpx), (0xD7, self.a_idpy)):
+            ops[opcode] = store("a", mode)
+            ops[opcode + 0x20] = load("a", mode)
+        ops[0xE8] = load_imm("a")
+        ops[0xCD] = load_imm("x")
+        ops[0x8D] = load_imm("y")
+        ops[0xF8] = load("x", self.a_dp)
+        ops[0xF9] = load("x", self.a_dpy)
+        ops[0xE9] = load("x", self.a_abs)
+        ops[0xEB] = load("y", self.a_dp)
+        ops[0xFB] = load("y", self.a_dpx)
+        ops[0xEC] = load("y", self.a_abs)
+        ops[0xD8] = store("x", self.a_dp)
+        ops[0xD9] = store("x", self.a_dpy)
+        ops[0xC9] = store("x", self.a_abs)
+        ops[0xCB] = store("y", self.a_dp)
+        ops[0xDB] = store("y", self.a_dpx)
+        ops[0xCC] = store("y", self.a_abs)
+
+        def transfer(dst, src, flags=True):
+            def op():
+                value = getattr(self, src)
+                setattr(self, dst, self.setnz(value) if flags else value)
+            return op
+
+        ops[0x5D] = transfer("x", "a")
+        ops[0x7D] = transfer("a", "x")
+        ops[0xDD] = transfer("a", "y")
+        ops[0xFD] = transfer("y", "a")
+        ops[0x9D] = transfer("x", "sp")
+        ops[0xBD] = transfer("sp", "x", flags=False)
+
+        def mov_dp_dp():
+            src = self.read(self.a_dp())
+            self.write(self.a_dp(), src)
+        ops[0xFA] = mov_dp_dp
+
+        def mov_dp_imm():
+            imm = self.fetch()
+            self.write(self.a_dp(), imm)
+        ops[0x8F] = mov_dp_imm
+
+        def mov_xinc_a():
+            self.write(self.a_indx(), self.a)
+            self.x = (self.x + 1) & 0xFF
+        ops[0xAF] = mov_xinc_a
+
+        def mov_a_xinc():
+            self.a = self.setnz(self.read(self.a_indx()))
+            self.x = (self.x + 1) & 0xFF
+        ops[0xBF] = mov_a_xinc
+
+        # Compare X/Y
+        def cmp_reg(reg, mode):
+            def op():
+                self.op_cmp(getattr(self, reg), self.read(mode()))
+            return op
+
+        def cmp_reg_imm(reg):
+            def op():
+                self.op_cmp(getattr(self, reg), self.fetch())
+            return op
+
+        ops[0xC8] = cmp_reg_imm("x")
+        ops[0x1E] = cmp_reg("x", self.a_abs)
+        ops[0x3E] = cmp_reg("x", self.a_dp)
+        ops[0xAD] = cmp_reg_imm("y")
+        ops[0x5E] = cmp_reg("y", self.a_abs)
+        ops[0x7E] = cmp_reg("y", self.a_dp)
+
+        # Read-modify-write: shifts, rotates, INC/DEC
+        def rmw(fn, mode):
+            def op():
+                addr = mode()
+                self.write(addr, fn(self.read(addr)))
+            return op
+
+        def rmw_reg(fn, reg):
+            def op():
+                setattr(self, reg, fn(getattr(self, reg)))
+            return op
+
+        for row, fn in enumerate((self.op_asl, self.op_rol, self.op_lsr, self.op_ror)):
+            base = row * 0x20
+            ops[base + 0x0B] = rmw(fn, self.a_dp)
+            ops[base + 0x1B] = rmw(fn, self.a_dpx)
+            ops[base + 0x0C] = rmw(fn, self.a_abs)
+            ops[base + 0x1C] = rmw_reg(fn, "a")
+        ops[0x8B] = rmw(self.op_dec, self.a_dp)
+        ops[0x9B] = rmw(self.op_dec, self.a_dpx)
+        ops[0x8C] = rmw(self.op_dec, self.a_abs)
+        ops[0xAB] = rmw(self.op_inc, self.a_dp)
+        ops[0xBB] = rmw(self.op_inc, self.a_dpx)
+        ops[0xAC] = rmw(self.op_inc, self.a_abs)
+        ops[0x9C] = rmw_reg(self.op_dec, "a")
+        ops[0xBC] = rmw_reg(self.op_inc, "a")
+        ops[0x1D] = rmw_reg(self.op_dec, "x")
+        ops[0x3D] = rmw_reg(self.op_inc, "x")
+        ops[0xDC] = rmw_reg(self.op_dec, "y")
+        ops[0xFC] = rmw_reg(self.op_inc, "y")
+
+        # 16-bit operations
+        def incw():
+            addr = self.a_dp()
+            value = (self.read_dp16(addr) + 1) & 0xFFFF
+            self.write_dp16(addr, value)
+            self.setnz16(value)
+        ops[0x3A] = incw
+
+        def decw():
+            addr = self.a_dp()
+            value = (self.read_dp16(addr) - 1) & 0xFFFF
+            self.write_dp16(addr, value)
+            self.setnz16(value)
+        ops[0x1A] = decw
+
+        def addw():
+            ya = self.get_ya()
+            value = self.read_dp16(self.a_dp())
+            result = ya + value
+            self.c = result > 0xFFFF
+            self.h = ((ya & 0x0FFF) + (value & 0x0FFF)) > 0x0FFF
+            self.v = ~(ya ^ value) & (ya ^ result) & 0x8000
+            self.set_ya(result & 0xFFFF)
+        ops[0x7A] = addw
+
+        def subw():
+            ya = self.get_ya()
+            value = self.read_dp16(self.a_dp())
+            result = ya - value
+            self.c = result >= 0
+            self.h = (ya & 0x0FFF) >= (value & 0x0FFF)
+            self.v = (ya ^ value) & (ya ^ result) & 0x8000
+            self.set_ya(result & 0xFFFF)
+        ops[0x9A] = subw
+
+        def cmpw():
+            result = self.get_ya() - self.read_dp16(self.a_dp())
+            self.c = result >= 0
+            self.setnz16(result & 0xFFFF)
+        ops[0x5A] = cmpw
+
+        def movw_ya_dp():
+            self.set_ya(self.read_dp16(self.a_dp()))
+        ops[0xBA] = movw_ya_dp
+
+        def movw_dp_ya():
+            self.write_dp16(self.a_dp(), self.get_ya())
+        ops[0xDA] = movw_dp_ya
+
+        # Multiply / divide / decimal adjust
+        def mul():
+            self.set_ya(self.y * self.a)
+            self.setnz(self.y)
+        ops[0xCF] = mul
+
+        def div():
+            ya = self.get_ya()
+            x = self.x
+            self.h = (self.y & 0x0F) >= (x & 0x0F)
+            self.v = self.y >= x
+            if self.y < (x << 1):
+                self.a = (ya // x) & 0xFF
+                self.y = (ya % x) & 0xFF
+            else:
+                self.a = (255 - (ya - (x << 9)) // (256 - x)) & 0xFF
+                self.y = (x + (ya - (x << 9)) % (256 - x)) & 0xFF
+            self.setnz(self.a)
+        ops[0x9E] = div
+
+        def daa():
+            a = self.a
+            if self.c or a > 0x99:
+                a += 0x60
+                self.c = 1
+            if self.h or (a & 0x0F) > 9:
+                a += 6
+            self.a = self.setnz(a & 0xFF)
+        ops[0xDF] = daa
+
+        def das():
+            a = self.a
+            if not self.c or a > 0x99:
+                a -= 0x60
+                self.c = 0
+            if not self.h or (a & 0x0F) > 9:
+                a -= 6
+            self.a = self.setnz(a & 0xFF)
+        ops[0xBE] = das
+
+        def xcn():
+            self.a = self.setnz(((self.a >> 4) | (self.a << 4)) & 0xFF)
+        ops[0x9F] = xcn
+
+        # Branches
+        flag_branches = {0x10: ("n", False), 0x30: ("n", True), 0x50: ("v", False),
+                         0x70: ("v", True), 0x90: ("c", False), 0xB0: ("c", True),
+                         0xD0: ("z", False), 0xF0: ("z", True)}
+
+        def flag_branch(flag, when):
+            def op():
+                return self.branch(bool(getattr(self, flag)) == when)
+            return op
+
+        for opcode, (flag, when) in flag_branches.items():
+            ops[opcode] = flag_branch(flag, when)
+        ops[0x2F] = lambda: self.branch(True)
+
+        def bit_branch(bit, when):
+            def op():
+                value = self.read(self.a_dp())
+                return self.branch(bool(value & (1 << bit)) == when)
+            return op
+
+        def set_bit(bit, on):
+            def op():
+                addr = self.a_dp()
+                value = self.read(addr)
+                self.write(addr, value | (1 << bit) if on else value & ~(1 << bit))
+            return op
+
+        for bit in range(8):
+            ops[0x03 + bit * 0x20] = bit_branch(bit, True)
+            ops[0x13 + bit * 0x20] = bit_branch(bit, False)
+            ops[0x02 + bit * 0x20] = set_bit(bit, True)
+            ops[0x12 + bit * 0x20] = set_bit(bit, False)
+
+        def cbne(mode):
+            def op():
+                value = self.read(mode())
+                return self.branch(self.a != value)
+            return op
+        ops[0x2E] = cbne(self.a_dp)
+        ops[0xDE] = cbne(self.a_dpx)
+
+        def dbnz_dp():
+            addr = self.a_dp()
+            value = (self.read(addr) - 1) & 0xFF
+            self.write(addr, value)
+            return self.branch(value != 0)
+        ops[0x6E] = dbnz_dp
+
+        def dbnz_y():
+            self.y = (self.y - 1) & 0xFF
+            return self.branch(self.y != 0)
+        ops[0xFE] = dbnz_y
+
+        # Absolute bit operations
+        def tset1():
+            addr = self.a_abs()
+            value = self.read(addr)
+            self.setnz((self.a - value) & 0xFF)
+            self.write(addr, value | self.a)
+        ops[0x0E] = tset1
+
+        def tclr1():
+            addr = self.a_abs()
+            value = self.read(addr)
+            self.setnz((self.a - value) & 0xFF)
+            self.write(addr, value & ~self.a & 0xFF)
+        ops[0x4E] = tclr1
+
+        def membit_op(kind):
+            def op():
+                addr, bit = self.a_membit()
+                value = (self.read(addr) >> bit) & 1
+                if kind == "or1":
+                    self.c = self.c or value
+                elif kind == "or1n":
+                    self.c = self.c or not value
+                elif kind == "and1":
+                    self.c = self.c and value
+                elif kind == "and1n":
+                    self.c = self.c and not value
+                elif kind == "eor1":
+                    self.c = bool(self.c) != bool(value)
+                elif kind == "mov1c":
+                    self.c = value
+                elif kind == "mov1m":
+                    byte = self.read(addr)
+                    self.write(addr, byte | (1 << bit) if self.c else byte & ~(1 << bit))
+                elif kind == "not1":
+                    self.write(addr, self.read(addr) ^ (1 << bit))
+            return op
+
+        for opcode, kind in ((0x0A, "or1"), (0x2A, "or1n"), (0x4A, "and1"), (0x6A, "and1n"),
+                             (0x8A, "eor1"), (0xAA, "mov1c"), (0xCA, "mov1m"), (0xEA, "not1")):
+            ops[opcode] = membit_op(kind)
+
+        # Flow control
+        def jmp_abs():
+            self.pc = self.fetch16()
+        ops[0x5F] = jmp_abs
+
+        def jmp_absx():
+            addr = self.a_absx()
+            self.pc = self.read(addr) | (self.read((addr + 1) & 0xFFFF) << 8)
+        ops[0x1F] = jmp_absx
+
+        def call(target):
+            self.push(self.pc >> 8)
+            self.push(self.pc & 0xFF)
+            self.pc = target
+
+        ops[0x3F] = lambda: call(self.fetch16())
+        ops[0x4F] = lambda: call(0xFF00 | self.fetch())
+
+        def tcall(n):
+            def op():
+                vector = 0xFFDE - n * 2
+                call(self.read(vector) | (self.read(vector + 1) << 8))
+            return op
+
+        for n in range(16):
+            ops[0x01 + n * 0x10] = tcall(n)
+
+        def ret():
+            lo = self.pop()
+            self.pc = lo | (self.pop() << 8)
+        ops[0x6F] = ret
+
+        def reti():
+            self.set_psw(self.pop())
+            ret()
+        ops[0x7F] = reti
+
+        def brk():
+            self.push(self.pc >> 8)
+            self.push(self.pc & 0xFF)
+            self.push(self.get_psw())
+            self.b = 1
+            self.i = 0
+            self.pc = self.read(0xFFDE) | (self.read(0xFFDF) << 8)
+        ops[0x0F] = brk
+
+        # Stack
+        def push_reg(reg):
+            def op():
+                self.push(self.get_psw() if reg == "psw" else getattr(self, reg))
+            return op
+
+        def pop_reg(reg):
+            def op():
+                value = self.pop()
+                if reg == "psw":
+                    self.set_psw(value)
+                else:
+                    setattr(self, reg, value)
+            return op
+
+        for opcode, reg in ((0x0D, "psw"), (0x2D, "a"), (0x4D, "x"), (0x6D, "y")):
+            ops[opcode] = push_reg(reg)
+            ops[opcode + 0x81] = pop_reg(reg)
+
+        # Flags
+        def set_flag(flag, value):
+            def op():
+                setattr(self, flag, value)
+            return op
+
+        ops[0x20] = set_flag("p", 0)
+        ops[0x40] = set_flag("p", 1)
+        ops[0x60] = set_flag("c", 0)
+        ops[0x80] = set_flag("c", 1)
+        ops[0xA0] = set_flag("i", 1)
+        ops[0xC0] = set_flag("i", 0)
+
+        def clrv():
+            self.v = 0
+            self.h = 0
+        ops[0xE0] = clrv
+
+        def notc():
+            self.c = not self.c
+        ops[0xED] = notc
+
+        def halt():
+            self.stopped = True
+        ops[0xEF] = halt
+        ops[0xFF] = halt
+        ops[0x00] = lambda: None
+        return ops
+
+    # -- execution -----------------------------------------------------
+
+    def run(self, target):
+        """Execute instructions until the SPC clock reaches target."""
+        ops = self.ops
+        while self.cycles < target:
+            if self.stopped:
+                if self.stopped == "idle":
+                    self.stopped = False
+                    self.idle_signature = None
+                self.cycles = target
+                break
+            opcode = self.read(self.pc)
+            self.pc = (self.pc + 1) & 0xFFFF
+            extra = ops[opcode]()
+            self.cycles += CYCLES[opcode] + (extra or 0)
+
+    def wake(self):
+        """Main CPU activity ends an idle wait (but not SLEEP/STOP)."""
+        if self.stopped == "idle":
+            self.stopped = False
+        self.idle_signature = None
+
+
+# -- S-DSP --------------------------------------------------------------
+
+# Samples between envelope steps for each 5-bit rate (0 = never)
+ENVELOPE_RATES = [0, 2048, 1536, 1280, 1024, 768, 640, 512, 384, 320, 256, 192, 160, 128,
+                  96, 80, 64, 48, 40, 32, 24, 20, 16, 12, 10, 8, 6, 5, 4, 3, 2, 1]
+
+ATTACK, DECAY, SUSTAIN, RELEASE = range(4)
+
+# Longest BRR chain decoded for one sample (18 KB of RAM, ~1 s at the base
+# pitch). A chain with no end flag that long is zeroed or garbage RAM at
+# key-on; it is played as a one-shot instead of being followed round all
+# of RAM, which would tie the cached sample to every page.
+MAX_BRR_BLOCKS = 0x800
+
+# Global DSP register addresses
+MVOLL, MVOLR, KON, KOFF, FLG, ENDX, NON, PMON, DIR = 0x0C, 0x1C, 0x4C, 0x5C, 0x6C, 0x7C, 0x3D, 0x2D, 0x5D
+
+
+def decode_brr_block(ram, addr, p1, p2):
+    """Decode one 9-byte BRR block into 16 samples; returns (samples, p1, p2)."""
+    header = ram[addr]
+    shift = header >> 4
+    filt = (header >> 2) & 3
+    out = [0] * 16
+    for i in range(16):
+        byte = ram[(addr + 1 + (i >> 1)) & 0xFFFF]
+        nibble = (byte >> 4) if not i & 1 else (byte & 0x0F)
+        if nibble >= 8:
+            nibble -= 16
+        if shift <= 12:
+            s = (nibble << shift) >> 1
+        else:
+            s = -2048 if nibble < 0 else 0
+        if filt == 1:
+            s += p1 + ((-p1) >> 4)
+        elif filt == 2:
+            s += (p1 << 1) + ((-(p1 + (p1 << 1))) >> 5) - p2 + (p2 >> 4)
+        elif filt == 3:
+            s += (p1 << 1) + ((-(p1 + (p1 << 2) + (p1 << 3))) >> 6) - p2 + (((p2 << 1) + p2) >> 4)
+        s = max(-32768, min(32767, s))
+        s = ((s << 1) & 0xFFFF)
+        s = (s - 0x10000 if s & 0x8000 else s) >> 1  # 15-bit wrap like the hardware
+        out[i] = s
+        p2, p1 = p1, s
+    return out, p1, p2
+
+
+class BRRSample:
+    """A fully decoded BRR sample: the one-shot head followed by its loop."""
+
+    def __init__(self, ram, start, loop):
+        self.start = start
+        self.first_page = start >> 8
+        head, p1, p2, end_header, last_addr = self._decode_chain(ram, start, 0, 0)
+        self.head_length = len(head)
+        self.last_page = last_addr >> 8
+        if end_header & 3 == 3:  # End block with the loop flag (not a capped chain)
+            body, _, _, _, last_addr = self._decode_chain(ram, loop, p1, p2)
+            self.loop_start = len(head)
+            self.loop_length = len(body)
+            head.extend(body)
+            self.first_page = min(self.first_page, loop >> 8)
+            self.last_page = max(self.last_page, last_addr >> 8)
+        else:
+            self.loop_start = None
+            self.loop_length = 0
+        self.data = np.array(head, dtype=np.int32)
+
+    @staticmethod
+    def _decode_chain(ram, addr, p1, p2):
+        # Loop filter state is carried in from the end of the head, so the
+        # cached loop is exact for the common case of a filter-0 loop block.
+        samples = []
+        for _ in range(MAX_BRR_BLOCKS):
+            block, p1, p2 = decode_brr_block(ram, addr, p1, p2)
+            samples.extend(block)
+            header = ram[addr]
+            if header & 1:
+                break
+            addr = (addr + 9) & 0xFFFF
+        return samples, p1, p2, header, (addr + 8) & 0xFFFF
+
+    def wrap(self, index):
+        """Map raw sample indices past the end onto the loop (NumPy arrays)."""
+        if self.loop_start is None or not self.loop_length:
+            return index
+        over = index >= len(self.data)
+        if over.any():
+            index = np.where(over, self.loop_start +
+                             (index - self.loop_start) % self.loop_length, index)
+        return index
+
+
+class BRRCache:
+    """Decoded BRR samples keyed by their sample-directory (start, loop) address.
+
+    pages counts cached samples per 256-byte APU RAM page; the SPC700 checks
+    it on every store so writes that overwrite sample data drop the entry.
+    """
+
+    def __init__(self):
+        self.samples = {}
+        self.pages = [0] * 256
+
+    def get(self, ram, start, loop):
+        key = (start, loop)
+        sample = self.samples.get(key)
+        if sample is None:
+            sample = BRRSample(ram, start, loop)
+            self.samples[key] = sample
+            for page in self._pages(sample):
+                self.pages[page] += 1
+        return sample
+
+    @staticmethod
+    def _pages(sample):
+        if sample.last_page >= sample.first_page:
+            return range(sample.first_page, sample.last_page + 1)
+        # Sample wraps around the top of RAM
+        return list(range(sample.first_page, 256)) + list(range(sample.last_page + 1))
+
+    def invalidate(self, addr):
+        page = addr >> 8
+        for key, sample in list(self.samples.items()):
+            if page in self._pages(sample):
+                del self.samples[key]
+                sample.stale = True
+                for p in self._pages(sample):
+                    self.pages[p] -= 1
+
+    def clear(self):
+        for sample in self.samples.values():
+            sample.stale = True
+        self.samples.clear()
+        self.pages[:] = [0] * 256
+
+
+class Voice:
+    """Playback state for one of the eight DSP voices."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.active = False
+        self.block_addr = 0
+        self.loop_addr = 0
+        self.buffer = [0] * 16
+        self.p1 = self.p2 = 0
+        self.position = 0  # 4.12 fixed-point index into buffer
+        self.last = 0  # Previous decoded sample (for interpolation)
+        self.envelope = 0
+        self.env_mode = RELEASE
+        self.env_counter = 0
+        self.output = 0
+        # Vectorized mixer state: 4.12 position into the cached decoded sample
+        self.start_addr = 0
+        self.sample = None
+        self.sample_pos = 0
+
+
+class DSP:
+    """Sony S-DSP: eight BRR voices with ADSR/GAIN envelopes mixed to 32 kHz stereo.
+
+    Echo and the FIR filter are not emulated yet; the echo registers are
+    stored but do not affect output.
+    """
+
+    def __init__(self, ram):
+        self.ram = ram
+        self.regs = bytearray(128)
+        self.voices = [Voice() for _ in range(8)]
+        self.samples = array("h")
+        self.cycles = 0  # SPC cycle the DSP has rendered up to
+        self.noise = 0x4000
+        self.sample_count = 0
+        self.brr_cache = BRRCache()
+
+    def reset(self):
+        self.regs[:] = bytes(128)
+        self.regs[FLG] = 0xE0
+        for voice in self.voices:
+            voice.reset()
+        self.noise = 0x4000
+        del self.samples[:]
+
+    def read(self, addr, now):
+        self.catch_up(now)
+        return self.regs[addr]
+
+    def write(self, addr, value, now):
+        self.catch_up(now)
+        if addr == ENDX:
+            value = 0  # Any write clears ENDX
+        self.regs[addr] = value
+        if addr == KON:
+            for v in range(8):
+                if value & (1 << v):
+                    self.key_on(v)
+        elif addr == KOFF:
+            for v in range(8):
+                if value & (1 << v):
+                    self.voices[v].env_mode = RELEASE
+
+    def catch_up(self, now):
+        """Render every sample due between the DSP clock and SPC cycle now."""
+        count = (now - self.cycles) // DSP_CYCLES_PER_SAMPLE
+        if count > 0:
+            self.cycles += count * DSP_CYCLES_PER_SAMPLE
+            self.render(count)
+
+    def take_samples(self):
+        samples, self.samples = self.samples, array("h")
+        return samples
+
+    def key_on(self, v):
+        voice = self.voices[v]
+        entry = (self.regs[DIR] << 8) + self.regs[(v << 4) | 4] * 4
+        ram = self.ram
+        voice.block_addr = ram[entry & 0xFFFF] | (ram[(entry + 1) & 0xFFFF] << 8)
+        voice.loop_addr = ram[(entry + 2) & 0xFFFF] | (ram[(entry + 3) & 0xFFFF] << 8)
+        voice.p1 = voice.p2 = voice.last = 0
+        voice.buffer, voice.p1, voice.p2 = decode_brr_block(ram, voice.block_addr, 0, 0)
+        voice.position = 0
+        voice.start_addr = voice.block_addr
+        voice.sample = None
+        voice.sample_pos = 0
+        voice.envelope = 0
+        voice.env_mode = ATTACK
+        voice.env_counter = 0
+        voice.active = True
+        self.regs[ENDX] &= ~(1 << v) & 0xFF
+
+    def advance_block(self, v, voice):
+        header = self.ram[voice.block_addr]
+        if header & 1:
+            self.regs[ENDX] |= 1 << v
+            if not header & 2:
+                voice.env_mode = RELEASE
+                voice.envelope = 0
+                voice.active = False
+                return
+            voice.block_addr = voice.loop_addr
+        else:
+            voice.block_addr = (voice.block_addr + 9) & 0xFFFF
+        voice.buffer, voice.p1, voice.p2 = decode_brr_block(self.ram, voice.block_addr,
+                                                            voice.p1, voice.p2)
+
+    def step_envelope(self, v, voice):
+        regs = self.regs
+        base = v << 4
+        adsr1 = regs[base | 5]
+        env = voice.envelope
+        if voice.env_mode == RELEASE:
+            env -= 8
+        elif adsr1 & 0x80:
+            adsr2 = regs[base | 6]
+            if voice.env_mode == ATTACK:
+                rate = ((adsr1 & 0x0F) << 1) + 1
+                step = 1024 if rate == 31 else 32
+            elif voice.env_mode == DECAY:
+                rate = (((adsr1 >> 4) & 7) << 1) + 16
+                step = -(((env - 1) >> 8) + 1)
+            else:
+                rate = adsr2 & 0x1F
+                step = -(((env - 1) >> 8) + 1)
+            if not self._rate_tick(voice, rate):
+                return
+            env += step
+            if voice.env_mode == ATTACK and env >= 0x7E0:
+                voice.env_mode = DECAY
+            elif voice.env_mode == DECAY and (env >> 8) == (adsr2 >> 5):
+                voice.env_mode = SUSTAIN
+        else:
+            gain = regs[base | 7]
+            if not gain & 0x80:
+                env = (gain & 0x7F) << 4
+            else:
+                if not self._rate_tick(voice, gain & 0x1F):
+                    return
+                mode = (gain >> 5) & 3
+                if mode == 0:
+                    env -= 32
+                elif mode == 1:
+                    env -= ((env - 1) >> 8) + 1
+                elif mode == 2:
+                    env += 32
+                else:
+                    env += 32 if env < 0x600 else 8
+        voice.envelope = max(0, min(0x7FF, env))
+        if voice.env_mode == RELEASE and not voice.envelope:
+            voice.active = False
+
+    def _rate_tick(self, voice, rate):
+        period = ENVELOPE_RATES[rate]
+        if not period:
+            return False
+        voice.env_counter += 1
+        if voice.env_counter >= period:
+            voice.env_counter = 0
+            return True
+        return False
+
+    def render(self, count):
+        """Produce count stereo samples into self.samples."""
+        if np is not None:
+            self.render_chunk(count)
+        else:
+            self.render_samples(count)
+
+    def envelope_chunk(self, v, voice, count):
+        """Per-sample envelope for the next count samples.
+
+        Runs the same state machine as step_envelope, but only iterates on
+        rate ticks and fills the samples between them in bulk.
+        """
+        regs = self.regs
+        base = v << 4
+        out = np.empty(count, dtype=np.int32)
+        done = 0
+        while done < count:
+            env = voice.envelope
+            if voice.env_mode == RELEASE:
+                ramp = env - 8 * np.arange(1, count - done + 1, dtype=np.int32)
+                np.maximum(ramp, 0, out=ramp)
+                out[done:] = ramp
+                voice.envelope = int(ramp[-1])
+                if not voice.envelope:
+                    voice.active = False
+                return out
+            adsr1 = regs[base | 5]
+            adsr2 = regs[base | 6]
+            if adsr1 & 0x80:
+                if voice.env_mode == ATTACK:
+                    rate = ((adsr1 & 0x0F) << 1) + 1
+                elif voice.env_mode == DECAY:
+                    rate = (((adsr1 >> 4) & 7) << 1) + 16
+                else:
+                    rate = adsr2 & 0x1F
+            else:
+                gain = regs[base | 7]
+                if not gain & 0x80:
+                    voice.envelope = (gain & 0x7F) << 4
+                    out[done:] = voice.envelope
+                    return out
+                rate = gain & 0x1F
+            period = ENVELOPE_RATES[rate]
+            if not period:
+                out[done:] = env
+                return out
+            # Hold the current level until the next tick, then take one step
+            until_tick = max(1, period - voice.env_counter)
+            hold = min(until_tick - 1, count - done)
+            out[done:done + hold] = env
+            done += hold
+            voice.env_counter += hold
+            if done >= count:
+                return out
+            self.step_envelope(v, voice)
+            out[done] = voice.envelope
+            done += 1
+        return out
+
+    def noise_chunk(self, count, noise_rate):
+        """Noise generator output for the next count samples."""
+        out = np.empty(count, dtype=np.int32)
+        noise = self.noise
+        sample_count = self.sample_count
+        for k in range(count):
+            sample_count += 1
+            if noise_rate and sample_count % noise_rate == 0:
+                noise = (((noise << 13) ^ (noise << 14)) & 0x4000) ^ (noise >> 1)
+            out[k] = ((noise << 1) & 0xFFFF) - (0x10000 if noise & 0x4000 else 0)
+        self.noise = noise
+        return out
+
+    def render_chunk(self, count):
+        """Mix all eight voices for count samples at once with NumPy.
+
+        Register writes catch the DSP up before they land, so pitch, volume
+        and envelope settings are constant across every chunk.
+        """
+        regs = self.regs
+        flg = regs[FLG]
+        noise_rate = ENVELOPE_RATES[flg & 0x1F]
+        noise = None
+        left = np.zeros(count, dtype=np.int32)
+        right = np.zeros(count, dtype=np.int32)
+        prev_output = np.zeros(count, dtype=np.int32)
+        steps = np.arange(count, dtype=np.int64)
+        for v, voice in enumerate(self.voices):
+            if not voice.active:
+                voice.output = 0
+                prev_output = np.zeros(count, dtype=np.int32)
+                continue
+            base = v << 4
+            sample = voice.sample
+            if sample is None or getattr(sample, "stale", False):
+                sample = voice.sample = self.brr_cache.get(self.ram, voice.start_addr,
+                                                           voice.loop_addr)
+            pitch = (regs[base | 2] | (regs[base | 3] << 8)) & 0x3FFF
+            if regs[PMON] & (1 << v) and v:
+                pitches = (pitch + (((prev_output >> 5) * pitch) >> 10)) & 0x7FFF
+                positions = voice.sample_pos + np.concatenate(([0], np.cumsum(pitches[:-1],
+                                                                              dtype=np.int64)))
+                advance = int(pitches.sum())
+            else:
+                positions = voice.sample_pos + steps * pitch
+                advance = pitch * count
+            raw = positions >> 12
+            frac = (positions & 0xFFF).astype(np.int32)
+            length = len(sample.data)
+            if raw[-1] >= sample.head_length:
+                regs[ENDX] |= 1 << v
+            if regs[NON] & (1 << v):
+                if noise is None:
+                    noise = self.noise_chunk(count, noise_rate)
+                wave = noise
+            else:
+                current_index = sample.wrap(raw)
+                previous_index = sample.wrap(raw - 1)
+                ended = current_index >= length
+                data = sample.data
+                current = data[np.minimum(current_index, length - 1)]
+                previous = np.where(previous_index >= 0,
+                                    data[np.clip(previous_index, 0, length - 1)], 0)
+                wave = previous + (((current - previous) * frac) >> 12)
+                if sample.loop_start is None and ended.any():
+                    wave = np.where(ended, 0, wave)
+            envelope = self.envelope_chunk(v, voice, count)
+            if sample.loop_start is None and raw[-1] >= length:
+                # One-shot sample ran off its end block: the voice stops
+                stop = int(np.argmax(raw >= length))
+                envelope[stop:] = 0
+                voice.envelope = 0
+                voice.env_mode = RELEASE
+                voice.active = False
+            output = (wave * envelope) >> 11
+            prev_output = output
+            voice.output = int(output[-1])
+            regs[base | 8] = voice.envelope >> 4
+            regs[base | 9] = (voice.output >> 8) & 0xFF
+            vol_l = regs[base] - 256 if regs[base] & 0x80 else regs[base]
+            vol_r = regs[base | 1] - 256 if regs[base | 1] & 0x80 else regs[base | 1]
+            left += (output * vol_l) >> 7
+            right += (output * vol_r) >> 7
+            position = voice.sample_pos + advance
+            if sample.loop_start is not None and (position >> 12) >= length:
+                index = int(sample.wrap(np.array([position >> 12]))[0])
+                position = (index << 12) | (position & 0xFFF)
+            voice.sample_pos = position
+        self.sample_count += count
+        stereo = np.empty(count * 2, dtype=np.int16)
+        if flg & 0x40:
+            stereo[:] = 0
+        else:
+            mvol_l = regs[MVOLL] - 256 if regs[MVOLL] & 0x80 else regs[MVOLL]
+            mvol_r = regs[MVOLR] - 256 if regs[MVOLR] & 0x80 else regs[MVOLR]
+            stereo[0::2] = np.clip((left * mvol_l) >> 7, -32768, 32767)
+            stereo[1::2] = np.clip((right * mvol_r) >> 7, -32768, 32767)
+        self.samples.frombytes(stereo.tobytes())
+
+    def render_samples(self, count):
+        """Produce count stereo samples into self.samples, one at a time."""
+        regs = self.regs
+        voices = self.voices
+        out = self.samples
+        flg = regs[FLG]
+        muted = flg & 0x40
+        noise_rate = ENVELOPE_RATES[flg & 0x1F]
+        for _ in range(count):
+            self.sample_count += 1
+            if noise_rate and self.sample_count % noise_rate == 0:
+                feedback = (self.noise << 13) ^ (self.noise << 14)
+                self.noise = (feedback & 0x4000) ^ (self.noise >> 1)
+            left = right = 0
+            prev_output = 0
+            for v in range(8):
+                voice = voices[v]
+                if not voice.active:
+                    voice.output = prev_output = 0
+                    continue
+                base = v << 4
+                pitch = (regs[base | 2] | (regs[base | 3] << 8)) & 0x3FFF
+                if regs[PMON] & (1 << v) and v:
+                    pitch = (pitch + ((prev_output >> 5) * pitch >> 10)) & 0x7FFF
+                if regs[NON] & (1 << v):
+                    sample = ((self.noise << 1) & 0xFFFF) - (0x10000 if self.noise & 0x4000 else 0)
+                else:
+                    index = voice.position >> 12
+                    frac = voice.position & 0xFFF
+                    current = voice.buffer[index]
+                    previous = voice.buffer[index - 1] if index else voice.last
+                    sample = previous + (((current - previous) * frac) >> 12)
+                self.step_envelope(v, voice)
+                sample = (sample * voice.envelope) >> 11
+                voice.output = prev_output = sample
+                regs[base | 8] = voice.envelope >> 4
+                regs[base | 9] = (sample >> 8) & 0xFF
+                vol_l = regs[base] - 256 if regs[base] & 0x80 else regs[base]
+                vol_r = regs[base | 1] - 256 if regs[base | 1] & 0x80 else regs[base | 1]
+                left += (sample * vol_l) >> 7
+                right += (sample * vol_r) >> 7
+                voice.position += pitch
+                while voice.position >= 0x10000 and voice.active:
+                    voice.position -= 0x10000
+                    voice.last = voice.buffer[15]
+                    self.advance_block(v, voice)
+            if muted:
+                out.append(0)
+                out.append(0)
+                continue
+            mvol_l = regs[MVOLL] - 256 if regs[MVOLL] & 0x80 else regs[MVOLL]
+            mvol_r = regs[MVOLR] - 256 if regs[MVOLR] & 0x80 else regs[MVOLR]
+            out.append(max(-32768, min(32767, (left * mvol_l) >> 7)))
+            out.append(max(-32768, min(32767, (right * mvol_r) >> 7)))
+
+
+# -- APU ----------------------------------------------------------------
+
+class APU:
+    """SPC700 + DSP on their own timeline, caught up on demand by the main CPU."""
+
+    def __init__(self):
+        self.dsp = DSP(None)
+        self.spc = SPC700(self.dsp)
+        self.dsp.ram = self.spc.ram
+        self.master = 0  # Main-CPU master cycles the APU has been synced to
+        self.power_on()
+
+    def power_on(self):
+        self.spc.power_on()
+        self.dsp.reset()
+        self.dsp.cycles = self.spc.cycles
+        self.master = 0
+
+    def reset(self):
+        self.spc.reset()
+        self.dsp.reset()
+        self.dsp.cycles = self.spc.cycles
+
+    def sync(self, master):
+        """Catch the SPC700 up to the given main-CPU master-clock timestamp."""
+        if master > self.master:
+            self.master = master
+            self.spc.run(master * APU_CLOCK // MASTER_CLOCK)
+
+    def read_port(self, port, master):
+        self.sync(master)
+        return self.spc.cpu_out[port & 3]
+
+    def write_port(self, port, value, master):
+        self.sync(master)
+        self.spc.cpu_in[port & 3] = value
+        self.spc.wake()
+
+    def end_frame(self, master):
+        """Sync to the end of the frame and return its stereo samples."""
+        self.sync(master)
+        self.dsp.catch_up(self.spc.cycles)
+        return self.dsp.take_samples()
+
+    _SPC = struct.Struct("<BBBBHBBqq4s4sB")
+    _TIMER = struct.Struct("<?BBBq")
+    _DSP = struct.Struct("<qIH")
+    _VOICE = struct.Struct("<?HHhhiiHBHHq")
+
+    def state_chunks(self):
+        """Savestate chunks: SPC700 registers and timers, DSP, and APU RAM.
+
+        ARAM is returned as a memoryview so the writer copies it only once.
+        """
+        spc = self.spc
+        flags = (1 if spc.stopped is True else 0) | (2 if spc.ipl_enabled else 0)
+        spc_state = bytearray(self._SPC.size + 3 * self._TIMER.size)
+        self._SPC.pack_into(spc_state, 0, spc.a, spc.x, spc.y, spc.sp, spc.pc, spc.get_psw(),
+                            flags, spc.cycles, self.master, bytes(spc.cpu_in),
+                            bytes(spc.cpu_out), spc.dsp_addr)
+        offset = self._SPC.size
+        for timer in spc.timers:
+            self._TIMER.pack_into(spc_state, offset, timer.enabled, timer.target,
+                                  timer.stage2, timer.output, timer.last)
+            offset += self._TIMER.size
+        dsp = self.dsp
+        dsp_state = bytearray(self._DSP.size + 128 + 8 * (self._VOICE.size + 32))
+        self._DSP.pack_into(dsp_state, 0, dsp.cycles, dsp.sample_count, dsp.noise)
+        offset = self._DSP.size
+        dsp_state[offset:offset + 128] = dsp.regs
+        offset += 128
+        for voice in dsp.voices:
+            self._VOICE.pack_into(dsp_state, offset, voice.active, voice.block_addr,
+                                  voice.loop_addr, voice.p1, voice.p2, voice.position,
+                                  voice.last, voice.envelope, voice.env_mode,
+                                  voice.env_counter, voice.start_addr, voice.sample_pos)
+            offset += self._VOICE.size
+            dsp_state[offset:offset + 32] = array("h", voice.buffer).tobytes()
+            offset += 32
+        return [(b"SPC ", spc_state), (b"DSP ", dsp_state), (b"ARAM", memoryview(spc.ram))]
+
+    def snapshot_chunks(self):
+        """Like state_chunks(), but ARAM is a copy-on-write tuple of pages."""
+        chunks = self.state_chunks()
+        chunks[-1] = (b"ARAM", self.spc.ram_pages.snapshot())
+        return chunks
+
+    def load_state_chunks(self, chunks):
+        """Restore from the chunk payloads produced by state_chunks()."""
+        spc = self.spc
+        view = chunks[b"SPC "]
+        (spc.a, spc.x, spc.y, spc.sp, spc.pc, psw, flags, spc.cycles, self.master,
+         cpu_in, cpu_out, spc.dsp_addr) = self._SPC.unpack_from(view, 0)
+        offset = self._SPC.size
+        spc.set_psw(psw)
+        spc.stopped = bool(flags & 1)
+        spc.ipl_enabled = bool(flags & 2)
+        spc.cpu_in[:] = cpu_in
+        spc.cpu_out[:] = cpu_out
+        spc.idle_signature = None
+        for timer in spc.timers:
+            (timer.enabled, timer.target, timer.stage2, timer.output,
+             timer.last) = self._TIMER.unpack_from(view, offset)
+            offset += self._TIMER.size
+        dsp = self.dsp
+        view = chunks[b"DSP "]
+        dsp.cycles, dsp.sample_count, dsp.noise = self._DSP.unpack_from(view, 0)
+        offset = self._DSP.size
+        dsp.regs[:] = view[offset:offset + 128]
+        offset += 128
+        for voice in dsp.voices:
+            (voice.active, voice.block_addr, voice.loop_addr, voice.p1, voice.p2,
+             voice.position, voice.last, voice.envelope, voice.env_mode,
+             voice.env_counter, voice.start_addr,
+             voice.sample_pos) = self._VOICE.unpack_from(view, offset)
+            offset += self._VOICE.size
+            voice.buffer = array("h", bytes(view[offset:offset + 32])).tolist()
+            voice.sample = None
+            offset += 32
+        aram = chunks[b"ARAM"]
+        if isinstance(aram, tuple):
+            # Page snapshot: only rewritten pages can invalidate cached samples
+            for page in spc.ram_pages.restore(aram):
+                for addr in range(page << PAGE_SHIFT, (page + 1) << PAGE_SHIFT, 0x100):
+                    if spc.brr_pages[addr >> 8]:
+                        dsp.brr_cache.invalidate(addr)
+        else:
+            spc.ram[:] = aram
+            spc.ram_pages.touch_all()
+            dsp.brr_cache.clear()
+        del dsp.samples[:]
@@ -0,0 +1,251 @@
+import io
+import sys
+import threading
+import wave
+from array import array
+
+SAMPLE_RATE = 32000  # Native S-DSP output rate
+CHANNELS = 2
+
+
+class AudioRing:
+    """Single-producer/single-consumer ring of interleaved int16 samples.
+
+    The emulation thread only moves the write index and the output thread only
+    moves the read index, so neither side ever takes a lock. When the ring is
+    full the newest samples are dropped instead of blocking the producer.
+    """
+
+    def __init__(self, capacity=SAMPLE_RATE * CHANNELS // 4):
+        self.capacity = capacity
+        self.buffer = array("h", bytes(capacity * 2))
+        self.read_pos = 0
+        self.write_pos = 0
+        self.dropped = 0
+
+    def available(self):
+        return self.write_pos - self.read_pos
+
+    def free(self):
+        return self.capacity - self.available()
+
+    def write(self, samples):
+        """Append as many samples as fit; returns how many were written."""
+        count = min(len(samples), self.free())
+        self.dropped += len(samples) - count
+        start = self.write_pos % self.capacity
+        first = min(count, self.capacity - start)
+        self.buffer[start:start + first] = samples[:first]
+        if count > first:
+            self.buffer[:count - first] = samples[first:count]
+        self.write_pos += count
+        return count
+
+    def read(self, count):
+        """Remove up to count samples and return them as an array."""
+        count = min(count, self.available())
+        start = self.read_pos % self.capacity
+        first = min(count, self.capacity - start)
+        out = self.buffer[start:start + first]
+        if count > first:
+            out += self.buffer[:count - first]
+        self.read_pos += count
+        return out
+
+
+class Resampler:
+    """Linear-interpolating stereo resampler with a continuously adjustable ratio.
+
+    ratio is output samples per input sample; values within a fraction of a
+    percent of 1.0 stretch or squeeze audio without an audible pitch change.
+    """
+
+    def __init__(self, channels=CHANNELS):
+        self.channels = channels
+        self.ratio = 1.0
+        self.position = 0.0  # Fractional read position carried between calls
+        self.last = [0] * channels  # Final input frame of the previous call
+
+    def process(self, samples):
+        channels = self.channels
+        frames = len(samples) // channels
+        if not frames:
+            return array("h")
+        if self.ratio == 1.0 and not self.position:
+            self.last = list(samples[-channels:])
+            return samples
+        step = 1.0 / self.ratio
+        out = array("h")
+        pos = self.position
+        last = self.last
+        # Position -1 refers to the last frame of the previous call
+        while pos < frames - 1:
+            index = int(pos) if pos >= 0 else -1
+            frac = pos - index
+            for ch in range(channels):
+                a = samples[index * channels + ch] if index >= 0 else last[ch]
+                b = samples[(index + 1) * channels + ch]
+                out.append(int(a + (b - a) * frac))
+            pos += step
+        self.position = pos - frames
+        self.last = list(samples[-channels:])
+        return out
+
+
+class NullSink:
+    """Discard audio; paces nothing. Useful for headless benchmarking."""
+
+    realtime = False
+
+    def write(self, samples):
+        pass
+
+    def close(self):
+        pass
+
+
+class WavSink:
+    """Write audio to a WAV file."""
+
+    realtime = False
+
+    def __init__(self, path, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+        self.wav = wave.open(path, "wb")
+        self.wav.setnchannels(channels)
+        self.wav.setsampwidth(2)
+        self.wav.setframerate(sample_rate)
+
+    def write(self, samples):
+        if sys.byteorder == "big":
+            samples = array("h", samples)
+            samples.byteswap()
+        self.wav.writeframes(samples.tobytes())
+
+    def close(self):
+        self.wav.close()
+
+
+class WinsoundSink:
+    """Play chunks through winsound.PlaySound (Windows only).
+
+    PlaySound blocks until the chunk finishes, which is fine here because it
+    only ever runs on the audio output thread.
+    """
+
+    realtime = True
+
+    def __init__(self, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+        import winsound
+        self.winsound = winsound
+        self.sample_rate = sample_rate
+        self.channels = channels
+
+    def write(self, samples):
+        blob = io.BytesIO()
+        with wave.open(blob, "wb") as wav:
+            wav.setnchannels(self.channels)
+            wav.setsampwidth(2)
+            wav.setframerate(self.sample_rate)
+            wav.writeframes(samples.tobytes())
+        self.winsound.PlaySound(blob.getvalue(), self.winsound.SND_MEMORY)
+
+    def close(self):
+        pass
+
+
+def default_sink():
+    """Pick a sink that works on this platform."""
+    if sys.platform == "win32":
+        try:
+            return WinsoundSink()
+        except ImportError:
+            pass
+    return NullSink()
+
+
+class AudioOutput:
+    """Drain an AudioRing into a sink on a background thread."""
+
+    def __init__(self, sink=None, ring=None, chunk_frames=SAMPLE_RATE // 30,
+                 max_rate_delta=0.005):
+        self.sink = sink if sink is not None else default_sink()
+        self.ring = ring if ring is not None else AudioRing()
+        self.chunk = chunk_frames * CHANNELS
+        self.underruns = 0
+        self.resampler = Resampler()
+        self.rate_control = False  # Enable with pace_from_audio()
+        self.max_rate_delta = max_rate_delta
+        self.target_fill = 0.5  # Fraction of the ring to keep queued
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="audio-output", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Flush what is queued and stop the output thread."""
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        self.sink.close()
+
+    def pace_from_audio(self, enabled=True):
+        """Let the buffer fill level drive frame pacing and resampling.
+
+        Only realtime sinks drain at a fixed rate, so this is a no-op for
+        file and null sinks.
+        """
+        self.rate_control = enabled and self.sink.realtime
+        self.resampler.ratio = 1.0
+        return self.rate_control
+
+    def fill_level(self):
+        return self.ring.available() / self.ring.capacity
+
+    def wants_frame(self):
+        """True while the ring is below its target fill (audio-paced mode)."""
+        return self.fill_level() < self.target_fill
+
+    def _update_ratio(self):
+        # Produce slightly more samples when the ring is below target and
+        # slightly fewer when above, within +/- max_rate_delta.
+        error = (self.target_fill - self.fill_level()) / self.target_fill
+        error = max(-1.0, min(1.0, error))
+        self.resampler.ratio = 1.0 + self.max_rate_delta * error
+
+    def push(self, samples):
+        """Queue samples from the emulation thread. Never blocks."""
+        if self.rate_control:
+            self._update_ratio()
+            samples = self.resampler.process(samples)
+        written = self.ring.write(samples)
+        if self.ring.available() >= self.chunk:
+            self._wake.set()
+        return written
+
+    def _run(self):
+        chunk_seconds = self.chunk / CHANNELS / SAMPLE_RATE
+        while True:
+            if self.ring.available() < self.chunk and not self._stop.is_set():
+                self._wake.wait(chunk_seconds)
+                self._wake.clear()
+            if self._stop.is_set():
+                samples = self.ring.read(self.ring.available())
+                if samples:
+                    self.sink.write(samples)
+                return
+            if self.ring.available() >= self.chunk:
+                self.sink.write(self.ring.read(self.chunk))
+            elif self.sink.realtime:
+                # Starved: play what we have padded with silence so the
+                # device keeps its cadence instead of going quiet and clicking.
+                self.underruns += 1
+                samples = self.ring.read(self.ring.available())
+                samples.extend(array("h", bytes(2 * (self.chunk - len(samples)))))
+                self.sink.write(samples)
@@ -0,0 +1,180 @@
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+from array import array
+from fractions import Fraction
+
+from audio import CHANNELS, SAMPLE_RATE, WavSink
+
+# Background video capture
+#
+# FrameCapture copies each presented frame (and its audio) into a bounded
+# queue; a writer thread, or a process with process=True, turns them into
+# a Y4M file, raw RGB24 video or a PNG sequence, with the audio in a WAV
+# file next to it. The emulation side never waits: when the queue is full
+# the frame is dropped and counted, its audio is kept, and the writer
+# repeats the previous picture in its place so video and audio stay in
+# sync. Pixel conversion happens on the writer side, so recording costs
+# the emulator one copy per frame.
+#
+# Output size is fixed by the first frame; later frames of another size
+# are scaled to it (nearest neighbour).
+#
+#   capture = FrameCapture("run.y4m", fps=60)
+#   capture.add_pixels(256, 224, core.frame_buffer, core.audio_samples)
+#   capture.close()   # run.y4m + run.wav
+
+FORMATS = ("y4m", "raw", "png")
+DEFAULT_QUEUE = 120  # Frames buffered before dropping (2 s at 60 fps)
+_NATIVE_XRGB = "BGRX" if sys.byteorder == "little" else "XRGB"  # array("I") of 0xRRGGBB
+
+
+def capture_format(path):
+    """Output format for a path: .y4m, .rgb/.raw, or anything else as a PNG directory."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".y4m":
+        return "y4m"
+    if ext in (".rgb", ".raw"):
+        return "raw"
+    return "png"
+
+
+class _Writer:
+    """Writer side: converts queued frames and writes them out."""
+
+    def __init__(self, path, fmt, fps, sample_rate, channels):
+        self.path, self.fmt, self.fps = path, fmt, fps
+        self.size = None
+        self.last = None  # Encoded previous frame, repeated for drops
+        self.index = 0
+        self.out = None
+        if fmt == "png":
+            os.makedirs(path, exist_ok=True)
+            wav_path = os.path.join(path, "audio.wav")
+        else:
+            self.out = open(path, "wb")
+            wav_path = os.path.splitext(path)[0] + ".wav"
+        self.wav_path = wav_path
+        self.sample_rate, self.channels = sample_rate, channels
+        self.wav = None  # Created with the first audio
+
+    def _image(self, width, height, mode, data):
+        from PIL import Image
+        image = Image.frombuffer("RGB", (width, height), data, "raw", mode, 0, 1)
+        if self.size is None:
+            self.size = (width, height)
+            if self.fmt == "y4m":
+                rate = Fraction(self.fps).limit_denominator(1001)
+                self.out.write(f"YUV4MPEG2 W{width} H{height} F{rate.numerator}:"
+                               f"{rate.denominator} Ip A1:1 C444\n".encode())
+        elif image.size != self.size:
+            image = image.resize(self.size, Image.NEAREST)
+        return image
+
+    def _encode(self, image):
+        if self.fmt == "y4m":
+            return b"FRAME\n" + b"".join(band.tobytes() for band in image.convert("YCbCr").split())
+        if self.fmt == "raw":
+            return image.tobytes()
+        import io
+        png = io.BytesIO()
+        image.save(png, "PNG", compress_level=1)
+        return png.getvalue()
+
+    def _emit(self, encoded):
+        if self.fmt == "png":
+            self.index += 1
+            with open(os.path.join(self.path, f"frame_{self.index:06d}.png"), "wb") as f:
+                f.write(encoded)
+        else:
+            self.out.write(encoded)
+
+    def write(self, width, height, mode, data, repeats, audio):
+        """Write one queued item; data is None for the final one (drops and audio only)."""
+        if repeats and self.last is not None:
+            for _ in range(repeats):  # Dropped frames: hold the previous picture
+                self._emit(self.last)
+        if data is not None:
+            self.last = self._encode(self._image(width, height, mode, data))
+            self._emit(self.last)
+        if audio:
+            if self.wav is None:
+                self.wav = WavSink(self.wav_path, self.sample_rate, self.channels)
+            self.wav.write(array("h", audio))
+
+    def close(self):
+        if self.out is not None:
+            self.out.close()
+        if self.wav is not None:
+            self.wav.close()
+
+
+def _write_frames(frames, path, fmt, fps, sample_rate, channels):
+    """Writer thread or process: drain the queue until the item without a frame."""
+    writer = _Writer(path, fmt, fps, sample_rate, channels)
+    try:
+        while True:
+            item = frames.get()
+            writer.write(*item)
+            if item[3] is None:
+                break
+    finally:
+        writer.close()
+
+
+class FrameCapture:
+    """Record presented frames without ever blocking the emulator."""
+
+    def __init__(self, path, fmt=None, fps=60.0, sample_rate=SAMPLE_RATE, channels=CHANNELS,
+                 queue_size=DEFAULT_QUEUE, process=False):
+        self.path = path
+        self.fmt = fmt or capture_format(path)
+        if self.fmt not in FORMATS:
+            raise ValueError(f"Unknown capture format {self.fmt!r}")
+        self.frames = 0  # Frames queued
+        self.dropped = 0  # Frames dropped because the writer fell behind
+        self._repeats = 0
+        self._audio = bytearray()  # Audio of dropped frames, sent with the next one
+        if self.fmt == "png":  # Fail here rather than on the writer side
+            os.makedirs(path, exist_ok=True)
+        else:
+            open(path, "wb").close()
+        args = (path, self.fmt, fps, sample_rate, channels)
+        if process:
+            self.queue = multiprocessing.Queue(queue_size)
+            self.worker = multiprocessing.Process(target=_write_frames, args=(self.queue,) + args,
+                                                  name="frame-capture", daemon=True)
+        else:
+            self.queue = queue.Queue(queue_size)
+            self.worker = threading.Thread(target=_write_frames, args=(self.queue,) + args,
+                                           name="frame-capture", daemon=True)
+        self.worker.start()
+
+    def add_frame(self, width, height, data, mode="RGB", audio=None):
+        """Queue a frame (bytes in a PIL raw mode) and the audio that went with it."""
+        audio = audio.tobytes() if isinstance(audio, array) else bytes(audio or b"")
+        if self._audio:
+            audio = bytes(self._audio) + audio
+        try:
+            self.queue.put_nowait((width, height, mode, bytes(data), self._repeats, audio))
+        except queue.Full:
+            self.dropped += 1
+            self._repeats += 1
+            self._audio[:] = audio
+            return False
+        self.frames += 1
+        self._repeats = 0
+        self._audio.clear()
+        return True
+
+    def add_pixels(self, width, height, pixels, audio=None):
+        """Queue a frame given as 0xRRGGBB ints (Snes9xCore.frame_buffer)."""
+        return self.add_frame(width, height, array("I", pixels).tobytes(), _NATIVE_XRGB, audio)
+
+    def close(self):
+        """Write out everything queued and finish the files."""
+        self.queue.put((0, 0, None, None, self._repeats, bytes(self._audio)))
+        self.worker.join()
+        return self.frames, self.dropped
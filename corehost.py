@@ -0,0 +1,297 @@
+import multiprocessing
+from array import array
+from multiprocessing import shared_memory
+
+from libretro import BUTTON_IDS, Core, LibretroError
+from pixels import np
+
+# Out-of-process libretro core
+#
+# RemoteCore runs a libretro.Core in a child process so a crashing core
+# cannot take the Tk UI down with it, and emulation runs in parallel with
+# presentation instead of sharing the GIL. Frames and audio are exchanged
+# through two shared-memory slots each; the pipe only carries small control
+# messages. run() collects the frame the child finished since the previous
+# call, then immediately starts the next one in the other slot, so the
+# child emulates frame N+1 while the UI draws frame N (one frame of
+# latency). The child converts frames to packed RGB24, so the UI side
+# never touches the core's pixel format. Serialized states travel through
+# a third block, created by the child at the core's serialize size. For
+# rewind, request_snapshot() has the child serialize right after the next
+# frame it runs and send the state with that frame's reply, so recording
+# history never stalls the pipeline on a round trip.
+
+MAX_WIDTH, MAX_HEIGHT = 512, 478  # SNES hi-res interlaced
+VIDEO_SLOT = MAX_WIDTH * MAX_HEIGHT * 3
+AUDIO_SLOT_FRAMES = 4096  # Stereo sample frames per video frame, with headroom
+AUDIO_SLOT = AUDIO_SLOT_FRAMES * 4
+REPLY_TIMEOUT = 10.0  # Seconds before a silent child counts as hung
+# Spawn, not fork: the UI process already runs writer, audio and thumbnail
+# threads (whose locks a forked child could inherit held) and Tk state.
+_CONTEXT = multiprocessing.get_context("spawn")
+
+
+def _store_frame(core, video, slot):
+    """Write the core's current frame into a video slot as RGB24; returns (width, height)."""
+    width, height = core.frame_width, core.frame_height
+    frame = core.get_video_frame()
+    if frame is None or width > MAX_WIDTH or height > MAX_HEIGHT:
+        return 0, 0
+    if np is not None:
+        out = np.ndarray((height, width, 3), dtype=np.uint8, buffer=video.buf,
+                         offset=slot * VIDEO_SLOT)
+        core.converter.convert(frame, width, height, core.pitch, core.pixel_format, out=out)
+    else:
+        from PIL import Image
+        rgb = Image.frombuffer("RGB", (width, height), frame, "raw", core.rawmode,
+                               core.pitch, 1).tobytes()
+        start = slot * VIDEO_SLOT
+        video.buf[start:start + len(rgb)] = rgb
+    return width, height
+
+
+def _store_audio(core, audio, slot):
+    samples = core.audio_samples
+    count = min(len(samples), AUDIO_SLOT_FRAMES * 2)
+    start = slot * AUDIO_SLOT
+    audio.buf[start:start + count * 2] = memoryview(samples).cast("B")[:count * 2]
+    return count
+
+
+def _host_main(core_path, conn, video_name, audio_name):
+    """Child process: serve control messages until told to close."""
+    video = shared_memory.SharedMemory(name=video_name)
+    audio = shared_memory.SharedMemory(name=audio_name)
+    state = None
+    core = None
+
+    def state_block(size):
+        nonlocal state
+        if state is None or state.size < size:
+            if state is not None:
+                state.close()
+                state.unlink()
+            state = shared_memory.SharedMemory(create=True, size=size)
+        return state
+    try:
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                return  # Parent closed the pipe (e.g. after a failed open)
+            command = message[0]
+            try:
+                if command == "open":
+                    core = Core(core_path)
+                    conn.send(("ok",))
+                elif command == "load":
+                    core.load_game(message[1])
+                    conn.send(("ok", core.fps, core.sample_rate, core.rom_crc, core.rom_size))
+                elif command == "run":
+                    _, buttons, slot, snapshot = message
+                    core.buttons[:] = buttons
+                    core.run()
+                    width, height = _store_frame(core, video, slot)
+                    samples = _store_audio(core, audio, slot)
+                    serialized = None
+                    if snapshot:
+                        try:
+                            serialized = core.serialize()
+                        except LibretroError:
+                            serialized = b""  # Unsupported; reported by take_snapshot()
+                    conn.send(("frame", slot, width, height, samples, serialized))
+                elif command == "serialize":
+                    view = core.serialize_view()
+                    block = state_block(len(view))
+                    block.buf[:len(view)] = view
+                    conn.send(("state", block.name, len(view)))
+                elif command == "reserve":
+                    conn.send(("state", state_block(message[1]).name, message[1]))
+                elif command == "unserialize":
+                    core.unserialize(state.buf[:message[1]])
+                    conn.send(("ok",))
+                elif command == "reset":
+                    core.reset()
+                    conn.send(("ok",))
+                elif command == "close":
+                    if core:
+                        core.close()
+                    conn.send(("ok",))
+                    return
+            except (LibretroError, OSError) as e:
+                conn.send(("error", str(e)))
+    finally:
+        video.close()
+        audio.close()
+        if state is not None:
+            state.close()
+            state.unlink()
+
+
+class RemoteCore:
+    """Drop-in replacement for libretro.Core that hosts the core in a child process."""
+
+    rawmode = "RGB"  # Frames arrive converted
+    converter = None
+    _ROM_ID = Core._ROM_ID
+
+    # Same chunk layout as an in-process core, on top of the methods below
+    state_chunks = Core.state_chunks
+    snapshot = Core.snapshot
+    load_state_chunks = Core.load_state_chunks
+    restore = Core.restore
+
+    def __init__(self, path):
+        self.frame_width, self.frame_height = 256, 224
+        self.pitch = self.frame_width * 3
+        self.frame = None
+        self.audio_samples = array("h")
+        self.fps, self.sample_rate = 60.0, 32040.0
+        self.buttons = [0] * 16
+        self._pending = False
+        self._slot = 0
+        self._want_snapshot = False  # Serialize after the next dispatched frame
+        self._snapshot = None  # State delivered with a finished frame
+        self.rom_crc = self.rom_size = 0
+        self.state = None  # Child-owned block for serialized states
+        self.video = shared_memory.SharedMemory(create=True, size=VIDEO_SLOT * 2)
+        self.audio = shared_memory.SharedMemory(create=True, size=AUDIO_SLOT * 2)
+        self.conn, child_conn = _CONTEXT.Pipe()
+        self.process = _CONTEXT.Process(
+            target=_host_main, args=(path, child_conn, self.video.name, self.audio.name),
+            name="libretro-core", daemon=True)
+        self.process.start()
+        child_conn.close()
+        try:
+            self._request(("open",))
+        except LibretroError:
+            self._release()
+            raise
+
+    def _reply(self):
+        try:
+            if not self.conn.poll(REPLY_TIMEOUT):
+                raise LibretroError("Core process stopped responding")
+            reply = self.conn.recv()
+        except (EOFError, OSError):
+            raise LibretroError(f"Core process exited (code {self.process.exitcode})") from None
+        if reply[0] == "error":
+            raise LibretroError(reply[1])
+        return reply
+
+    def _request(self, message):
+        self._finish_frame()
+        try:
+            self.conn.send(message)
+        except OSError:
+            raise LibretroError("Core process exited") from None
+        return self._reply()
+
+    def _finish_frame(self):
+        """Collect the frame the child is working on, if any."""
+        if not self._pending:
+            return
+        self._pending = False
+        _, slot, width, height, samples, state = self._reply()
+        if state is not None:
+            self._snapshot = state
+        if width:
+            self.frame_width, self.frame_height = width, height
+            self.pitch = width * 3
+            start = slot * VIDEO_SLOT
+            self.frame = self.video.buf[start:start + width * height * 3]
+        start = slot * AUDIO_SLOT
+        self.audio_samples = array("h", bytes(self.audio.buf[start:start + samples * 2]))
+
+    def load_game(self, rom_path):
+        _, self.fps, self.sample_rate, self.rom_crc, self.rom_size = \
+            self._request(("load", rom_path))
+
+    def _attach_state(self, name):
+        if self.state is None or self.state.name != name:
+            if self.state is not None:
+                try:
+                    self.state.close()
+                except BufferError:
+                    pass  # Still viewed by a caller; the mapping goes with the view
+            self.state = shared_memory.SharedMemory(name=name)
+
+    def serialize_view(self):
+        """The state in shared memory; the view is valid until the next call."""
+        _, name, size = self._request(("serialize",))
+        self._attach_state(name)
+        return self.state.buf[:size]
+
+    def serialize(self):
+        return bytes(self.serialize_view())
+
+    def unserialize(self, data):
+        size = len(data)
+        _, name, _ = self._request(("reserve", size))
+        self._attach_state(name)
+        self.state.buf[:size] = data
+        self._request(("unserialize", size))
+        self._snapshot = None  # Taken before this state was loaded
+
+    def run(self):
+        self._finish_frame()
+        self._slot ^= 1  # The child writes one slot while the UI reads the other
+        try:
+            self.conn.send(("run", self.buttons, self._slot, self._want_snapshot))
+        except OSError:
+            raise LibretroError("Core process exited") from None
+        self._pending = True
+        self._want_snapshot = False
+
+    def request_snapshot(self):
+        """Have the child serialize right after the next frame run() starts."""
+        self._want_snapshot = True
+
+    def take_snapshot(self):
+        """The state requested with request_snapshot() once its frame is collected, else None."""
+        state, self._snapshot = self._snapshot, None
+        if state is None:
+            return None
+        if not state:
+            raise LibretroError("Core does not support save states")
+        return [(b"ROMI", self._ROM_ID.pack(self.rom_crc, self.rom_size)), (b"RETR", state)]
+
+    def get_video_frame(self):
+        """The last finished frame as RGB24 in shared memory, or None."""
+        return self.frame
+
+    def reset(self):
+        self._request(("reset",))
+        self._snapshot = None
+
+    def set_input_state(self, button, state):
+        retro_id = BUTTON_IDS.get(button)
+        if retro_id is not None:
+            self.buttons[retro_id] = 1 if state else 0
+
+    def close(self):
+        """Shut the child down (flushing its save RAM) and free shared memory."""
+        if self.process.is_alive():
+            try:
+                self._request(("close",))
+            except LibretroError:
+                pass
+            self.process.join(REPLY_TIMEOUT)
+        if self.process.is_alive():
+            self.process.terminate()
+        self._release()
+
+    def _release(self):
+        self.frame = None
+        self.conn.close()
+        if self.state is not None:
+            try:
+                self.state.close()
+            except BufferError:
+                pass
+        for block in (self.video, self.audio):
+            try:
+                block.close()
+            except BufferError:
+                pass  # A caller still holds a frame view; the mapping goes with it
+            block.unlink()
@@ -0,0 +1,141 @@
+import json
+import os
+import sys
+import threading
+
+from savestate import write_atomic
+
+# Persistent libretro core registry
+#
+# Finding snes9x_libretro used to mean stat-ing it in every PATH entry and
+# RetroArch folder on each launch. The registry remembers every
+# *_libretro core it has seen in a small JSON cache, and a lookup costs one
+# stat to confirm the cached file still has the same mtime and size. The
+# full directory scan only runs on a cache miss, on a background thread,
+# so cold start doesn't depend on how long PATH is.
+
+if sys.platform == "win32":
+    CORE_EXTENSION = ".dll"
+elif sys.platform == "darwin":
+    CORE_EXTENSION = ".dylib"
+else:
+    CORE_EXTENSION = ".so"
+
+CORE_SUFFIX = "_libretro" + CORE_EXTENSION
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".emusnes", "cores.json")
+BUNDLED_CORES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cores")
+
+
+def core_filename(name):
+    """File name of a core on this platform, e.g. snes9x -> snes9x_libretro.so."""
+    return name + CORE_SUFFIX
+
+
+def search_dirs():
+    """Directories that may hold libretro cores, most specific first."""
+    home = os.path.expanduser("~")
+    dirs = [BUNDLED_CORES]
+    if sys.platform == "win32":
+        dirs += [
+            r"C:\RetroArch-Win64\cores",  # Winget default installation path
+            os.path.join(os.environ.get("PROGRAMFILES", "C:\\Program Files"), "RetroArch", "cores"),
+            os.path.join(os.environ.get("APPDATA", os.path.join(home, "AppData", "Roaming")),
+                         "RetroArch", "cores"),
+            os.path.join(os.environ.get("PROGRAMFILES(X86)", "C:\\Program Files (x86)"),
+                         "RetroArch", "cores"),
+        ]
+    elif sys.platform == "darwin":
+        dirs += [os.path.join(home, "Library", "Application Support", "RetroArch", "cores")]
+    else:
+        dirs += [
+            os.path.join(home, ".config", "retroarch", "cores"),
+            "/usr/lib/libretro",
+            "/usr/lib/x86_64-linux-gnu/libretro",
+            "/usr/local/lib/libretro",
+        ]
+    dirs += [path for path in os.environ.get("PATH", "").split(os.pathsep) if path]
+    return dirs
+
+
+class CoreRegistry:
+    """Cached map of core name -> library path, validated by mtime and size."""
+
+    def __init__(self, cache_path=DEFAULT_CACHE):
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        self._scan_thread = None
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                self.cores = json.load(f)
+        except (OSError, ValueError):
+            self.cores = {}
+
+    def _save(self):
+        try:
+            write_atomic(self.cache_path, json.dumps(self.cores, indent=1).encode("utf-8"))
+        except OSError:
+            pass  # The cache is an optimization; a read-only home just means rescans
+
+    @staticmethod
+    def _entry(path):
+        st = os.stat(path)
+        return {"path": path, "mtime": st.st_mtime, "size": st.st_size}
+
+    def find(self, name):
+        """Path of a cached core if it is unchanged on disk, else None."""
+        with self._lock:
+            entry = self.cores.get(name)
+        if entry is None:
+            return None
+        try:
+            if self._entry(entry["path"]) == entry:
+                return entry["path"]
+        except OSError:
+            pass
+        with self._lock:
+            self.cores.pop(name, None)
+        return None
+
+    def add(self, path):
+        """Register a core picked by hand; returns its name."""
+        filename = os.path.basename(path)
+        name = filename[:-len(CORE_SUFFIX)] if filename.endswith(CORE_SUFFIX) else \
+            os.path.splitext(filename)[0]
+        with self._lock:
+            self.cores[name] = self._entry(path)
+            self._save()
+        return name
+
+    def scan(self):
+        """Walk the search directories and record every core found."""
+        found = {}
+        for directory in search_dirs():
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.name.endswith(CORE_SUFFIX) and entry.is_file():
+                            name = entry.name[:-len(CORE_SUFFIX)]
+                            if name not in found:  # Earlier directories win
+                                st = entry.stat()
+                                found[name] = {"path": entry.path, "mtime": st.st_mtime,
+                                               "size": st.st_size}
+            except OSError:
+                continue
+        with self._lock:
+            self.cores.update(found)
+            self._save()
+        return found
+
+    def scan_async(self):
+        """Start a background scan unless one is already running."""
+        if self._scan_thread is None or not self._scan_thread.is_alive():
+            self._scan_thread = threading.Thread(target=self.scan, name="core-scan", daemon=True)
+            self._scan_thread.start()
+
+    def lookup(self, name, wait=True):
+        """Cached path, or the result of the background scan (waiting for it if asked)."""
+        path = self.find(name)
+        if path is None and self._scan_thread is not None and wait:
+            self._scan_thread.join()
+            path = self.find(name)
+        return path
@@ -1,41 +1,13 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
 import os
-import sys
 from PIL import Image, ImageTk
-import ctypes  # For loading the core dynamically
+from libretro import Core, LibretroError, frame_image
+from corehost import RemoteCore
+from statecontrols import StateControls
+from coreregistry import BUNDLED_CORES, CoreRegistry, core_filename
 
-# Placeholder for the Libretro Core class (in a real setup, this would interface with the core)
-class Core:
-    def __init__(self, path):
-        try:
-            self.lib = ctypes.CDLL(path)
-            # Simulate core initialization (replace with real Libretro API calls)
-            self.frame_width, self.frame_height = 256, 224
-        except OSError as e:
-            raise Exception(f"Failed to load core: {e}")
-    
-    def load_game(self, rom_path):
-        # Simulate loading a ROM (replace with real API)
-        pass
-    
-    def run(self):
-        # Simulate running one frame (replace with real API)
-        pass
-    
-    def get_video_frame(self):
-        # Simulate returning frame data (replace with real API)
-        return b'\x00' * (self.frame_width * self.frame_height * 3)  # Dummy RGB data
-    
-    def reset(self):
-        # Simulate reset (replace with real API)
-        pass
-    
-    def set_input_state(self, button, state):
-        # Simulate input handling (replace with real API)
-        pass
-
-class SNESEmulator:
+class SNESEmulator(StateControls):
     def __init__(self, root):
         self.root = root
         self.root.title("EMUSNESV0.1")
@@ -53,9 +25,11 @@ class SNESEmulator:
         self.current_rom = None
         self.is_running = False
         self.core = None
+        self.core_registry = CoreRegistry()
         self.core_path = self.get_bundled_core_path()  # Automatically find the core
         
         # Set up the UI
+        self.init_state_controls()
         self.create_menu()
         self.create_main_frame()
         self.create_status_bar()
@@ -67,24 +41,14 @@ class SNESEmulator:
         self.root.bind("<KeyRelease>", self.handle_input)
 
     def get_bundled_core_path(self):
-        """Find the bundled Libretro core based on the platform."""
-        base_path = os.path.dirname(os.path.abspath(__file__))
-        core_dir = os.path.join(base_path, "cores")
-        
-        if sys.platform == "win32":
-            core_file = "snes9x_libretro.dll"
-        elif sys.platform == "linux":
-            core_file = "snes9x_libretro.so"
-        elif sys.platform == "darwin":
-            core_file = "snes9x_libretro.dylib"
-        else:
-            messagebox.showerror("Error", "This platform isn’t supported yet.")
-            return None
-        
-        core_path = os.path.join(core_dir, core_file)
+        """Find the bundled Libretro core, using the core registry's cached entry when valid."""
+        core_path = self.core_registry.find("snes9x")
+        if core_path:
+            return core_path
+        core_path = os.path.join(BUNDLED_CORES, core_filename("snes9x"))
         if not os.path.exists(core_path):
-            messagebox.showerror("Error", f"Core file missing at: {core_path}")
-            return None
+            return None  # start_emulation reports the missing core
+        self.core_registry.add(core_path)
         return core_path
 
     def create_menu(self):
@@ -94,6 +58,9 @@ class SNESEmulator:
         
         file_menu = tk.Menu(menubar, tearoff=0)
         file_menu.add_command(label="Open ROM...", command=self.open_rom)
+        self.add_state_menu(file_menu)
+        self.isolate_core = tk.BooleanVar(value=False)
+        file_menu.add_checkbutton(label="Run Core in Separate Process", variable=self.isolate_core)
         file_menu.add_separator()
         file_menu.add_command(label="Exit", command=self.root.quit)
         menubar.add_cascade(label="File", menu=file_menu)
@@ -151,6 +118,9 @@ class SNESEmulator:
             self.rom_label.config(text=f"ROM: {rom_name}")
             self.status_label.config(text=f"Loaded: {rom_name}")
             self.is_running = False
+            if self.core:
+                self.save_preview()  # Of the game being left
+                self.core.close()
             self.core = None
             self.reset_emulation()
 
@@ -165,7 +135,7 @@ class SNESEmulator:
         
         try:
             if not self.core:
-                self.core = Core(self.core_path)
+                self.core = (RemoteCore if self.isolate_core.get() else Core)(self.core_path)
                 self.core.load_game(self.current_rom)
             self.is_running = True
             self.status_label.config(text=f"Running: {os.path.basename(self.current_rom)}")
@@ -177,10 +147,23 @@ class SNESEmulator:
         """Run the game loop."""
         if not self.is_running or not self.core:
             return
-        self.core.run()
+        try:
+            self.rewind_step()
+            self.core.run()
+            self.record_rewind()
+        except LibretroError as e:
+            # Only an isolated core can fail here without taking the UI down
+            self.is_running = False
+            self.save_preview()  # Of the game being left
+            self.core.close()
+            self.core = None
+            self.status_label.config(text="Core crashed")
+            messagebox.showerror("Core Error", f"The core stopped: {e}")
+            return
         frame_data = self.core.get_video_frame()
         if frame_data:
-            img = Image.frombytes("RGB", (self.core.frame_width, self.core.frame_height), frame_data)
+            img = frame_image(self.core, frame_data)
+            self.keep_preview(img)
             img = img.resize((512, 240), Image.NEAREST)
             self.photo = ImageTk.PhotoImage(img)
             self.canvas.delete("all")
@@ -191,10 +174,12 @@ class SNESEmulator:
         """Pause the game."""
         if self.is_running:
             self.is_running = False
+            self.save_preview()
             self.status_label.config(text="Paused")
 
     def reset_emulation(self, event=None):
         """Reset the emulator."""
+        self.save_preview()
         self.is_running = False
         if self.core:
             self.core.reset()
@@ -227,3 +212,8 @@ if __name__ == "__main__":
     root = tk.Tk()
     app = SNESEmulator(root)
     root.mainloop()
+    app.save_preview()
+    app.thumbnails.flush()
+    app.state_writer.flush()  # Don't lose a state still being written
+    if app.core:
+        app.core.close()
@@ -3,7 +3,10 @@ from tkinter import filedialog, messagebox
 import os
 import sys
 from PIL import Image, ImageTk, ImageDraw  # Added ImageDraw for text rendering
-import ctypes  # For loading the core dynamically
+from libretro import Core, LibretroError, frame_image
+from corehost import RemoteCore
+from statecontrols import StateControls
+from coreregistry import CORE_EXTENSION, CoreRegistry
 
 # Custom SNES Core as a fallback when Libretro core is unavailable
 class CustomSNESCore:
@@ -36,37 +39,10 @@ class CustomSNESCore:
         # Placeholder: No input handling in this basic fallback
         pass
 
-# Libretro Core class (unchanged)
-class Core:
-    def __init__(self, path):
-        try:
-            self.lib = ctypes.CDLL(path)
-            # Simulate core initialization (replace with real Libretro API calls)
-            self.frame_width, self.frame_height = 256, 224
-        except OSError as e:
-            raise Exception(f"Failed to load core: {e}")
-    
-    def load_game(self, rom_path):
-        # Simulate loading a ROM (replace with real API)
-        pass
-    
-    def run(self):
-        # Simulate running one frame (replace with real API)
-        pass
-    
-    def get_video_frame(self):
-        # Simulate returning frame data (replace with real API)
-        return b'\x00' * (self.frame_width * self.frame_height * 3)  # Dummy RGB data
-    
-    def reset(self):
-        # Simulate reset (replace with real API)
-        pass
-    
-    def set_input_state(self, button, state):
-        # Simulate input handling (replace with real API)
-        pass
+    def close(self):
+        pass  # Nothing to persist in fallback mode
 
-class SNESEmulator:
+class SNESEmulator(StateControls):
     def __init__(self, root):
         self.root = root
         self.root.title("EMUSNESV0.1")
@@ -88,6 +64,7 @@ class SNESEmulator:
         self.core_type = None  # Track whether using Libretro or Custom core
         
         # Set up the UI
+        self.init_state_controls()
         self.create_menu()
         self.create_main_frame()
         self.create_status_bar()
@@ -99,42 +76,33 @@ class SNESEmulator:
         self.root.bind("<KeyRelease>", self.handle_input)
 
         # Find the core path after UI setup
+        self.core_registry = CoreRegistry()
         self.core_path = self.find_core_path()
 
     def find_core_path(self):
-        """Search for snes9x_libretro.dll or prompt user."""
-        core_file = "snes9x_libretro.dll"
-        search_paths = [
-            os.path.join(os.path.dirname(os.path.abspath(__file__)), "cores"),
-            os.path.join(os.environ.get("PROGRAMFILES", "C:\\Program Files"), "RetroArch", "cores"),
-            os.path.join(os.environ.get("APPDATA", os.path.expanduser("~\\AppData\\Roaming")), "RetroArch", "cores"),
-            os.path.join(os.environ.get("PROGRAMFILES(X86)", "C:\\Program Files (x86)"), "RetroArch", "cores"),
-        ]
-
-        # Add paths from %PATH%
-        path_env = os.environ.get("PATH", "").split(os.pathsep)
-        search_paths.extend(path_env)
-
-        # Search for the DLL
-        for path in search_paths:
-            try:
-                core_path = os.path.join(path, core_file)
-                if os.path.exists(core_path):
-                    return core_path
-            except (OSError, TypeError):
-                continue
+        """Look up snes9x_libretro in the core registry; scan in the background on a miss."""
+        core_path = self.core_registry.find("snes9x")
+        if core_path is None:
+            self.core_registry.scan_async()
+        return core_path
 
+    def resolve_core_path(self):
+        """Wait for a pending registry scan, then fall back to asking the user."""
+        core_path = self.core_registry.lookup("snes9x")
+        if core_path:
+            return core_path
         # Prompt user if not found
         messagebox.showwarning("Core Not Found", 
             "Couldn’t find snes9x_libretro.dll. Please select it manually.\n\n"
             "Tip: Place it in a 'cores' folder next to this script or in RetroArch’s cores directory.")
         core_path = filedialog.askopenfilename(
             title="Select snes9x_libretro.dll",
-            filetypes=[("DLL files", "*.dll"), ("All files", "*.*")]
+            filetypes=[("Libretro cores", "*" + CORE_EXTENSION), ("All files", "*.*")]
         )
         if not core_path:
             # No error here; we'll handle fallback in start_emulation
             return None
+        self.core_registry.add(core_path)
         return core_path
 
     def create_menu(self):
@@ -144,6 +112,9 @@ class SNESEmulator:
         
         file_menu = tk.Menu(menubar, tearoff=0)
         file_menu.add_command(label="Open ROM...", command=self.open_rom)
+        self.add_state_menu(file_menu)
+        self.isolate_core = tk.BooleanVar(value=False)
+        file_menu.add_checkbutton(label="Run Core in Separate Process", variable=self.isolate_core)
         file_menu.add_separator()
         file_menu.add_command(label="Exit", command=self.root.quit)
         menubar.add_cascade(label="File", menu=file_menu)
@@ -198,6 +169,9 @@ class SNESEmulator:
             self.rom_label.config(text=f"ROM: {rom_name}")
             self.status_label.config(text=f"Loaded: {rom_name}")
             self.is_running = False
+            if self.core:
+                self.save_preview()  # Of the game being left
+                self.core.close()
             self.core = None
             self.reset_emulation()
         else:
@@ -208,24 +182,35 @@ class SNESEmulator:
         if not self.current_rom:
             messagebox.showinfo("No ROM", "Load a ROM first!")
             return
+        if not self.core_path:
+            self.core_path = self.resolve_core_path()
         
-        # Determine which core to use
-        if self.core_path is None:
-            self.core = CustomSNESCore()
-            self.core_type = "Custom Core"
-            messagebox.showinfo("Using Custom Core", 
-                "Could not find snes9x_libretro.dll. Using custom core as fallback.")
-        else:
-            try:
-                self.core = Core(self.core_path)
-                self.core_type = "Libretro Core"
-            except Exception as e:
-                messagebox.showwarning("Core Load Failed", 
-                    f"Failed to load core: {e}. Using custom core instead.")
+        # The core (and the game it has loaded) lives until another ROM is
+        # opened or it crashes, so Start after Pause or Load State resumes it
+        if not self.core:
+            if self.core_path is None:
                 self.core = CustomSNESCore()
                 self.core_type = "Custom Core"
+                messagebox.showinfo("Using Custom Core", 
+                    "Could not find snes9x_libretro.dll. Using custom core as fallback.")
+            else:
+                try:
+                    self.core = (RemoteCore if self.isolate_core.get() else Core)(self.core_path)
+                    self.core_type = "Libretro Core"
+                except Exception as e:
+                    messagebox.showwarning("Core Load Failed", 
+                        f"Failed to load core: {e}. Using custom core instead.")
+                    self.core = CustomSNESCore()
+                    self.core_type = "Custom Core"
         
-        self.core.load_game(self.current_rom)
+            try:
+                self.core.load_game(self.current_rom)
+            except (LibretroError, OSError) as e:
+                self.core.close()
+                self.core = None
+                self.status_label.config(text="Game failed to load")
+                messagebox.showerror("Load Failed", f"The core could not load the game: {e}")
+                return
         self.is_running = True
         self.status_label.config(text=f"Running: {os.path.basename(self.current_rom)} ({self.core_type})")
         self.emulation_loop()
@@ -234,10 +219,23 @@ class SNESEmulator:
         """Run the game loop."""
         if not self.is_running or not self.core:
             return
-        self.core.run()
+        try:
+            self.rewind_step()
+            self.core.run()
+            self.record_rewind()
+        except LibretroError as e:
+            # Only an isolated core can fail here without taking the UI down
+            self.is_running = False
+            self.save_preview()  # Of the game being left
+            self.core.close()
+            self.core = None
+            self.status_label.config(text="Core crashed")
+            messagebox.showerror("Core Error", f"The core stopped: {e}")
+            return
         frame_data = self.core.get_video_frame()
         if frame_data:
-            img = Image.frombytes("RGB", (self.core.frame_width, self.core.frame_height), frame_data)
+            img = frame_image(self.core, frame_data)
+            self.keep_preview(img)
             img = img.resize((512, 240), Image.NEAREST)
             self.photo = ImageTk.PhotoImage(img)
             self.canvas.delete("all")
@@ -248,10 +246,12 @@ class SNESEmulator:
         """Pause the game."""
         if self.is_running:
             self.is_running = False
+            self.save_preview()
             self.status_label.config(text=f"Paused: {os.path.basename(self.current_rom)} ({self.core_type})")
 
     def reset_emulation(self, event=None):
         """Reset the emulator."""
+        self.save_preview()
         self.is_running = False
         if self.core:
             self.core.reset()
@@ -286,3 +286,8 @@ if __name__ == "__main__":
     root = tk.Tk()
     app = SNESEmulator(root)
     root.mainloop()
+    app.save_preview()
+    app.thumbnails.flush()
+    app.state_writer.flush()  # Don't lose a state still being written
+    if app.core:
+        app.core.close()
@@ -3,8 +3,11 @@ from tkinter import filedialog, messagebox
 import os
 import sys
 from PIL import Image, ImageTk, ImageDraw
-import ctypes
 import time
+from libretro import Core, LibretroError, frame_image
+from corehost import RemoteCore
+from statecontrols import StateControls
+from coreregistry import CoreRegistry
 
 # Enhanced Custom SNES Core with interactive vibes
 class CustomSNESCore:
@@ -53,31 +56,10 @@ class CustomSNESCore:
         self.player_x = max(0, min(self.player_x, self.frame_width - 20))
         self.player_y = max(0, min(self.player_y, self.frame_height - 20))
 
-# Libretro Core (still a placeholder)
-class Core:
-    def __init__(self, path):
-        try:
-            self.lib = ctypes.CDLL(path)
-            self.frame_width, self.frame_height = 256, 224
-        except OSError as e:
-            raise Exception(f"Failed to load core: {e}")
-    
-    def load_game(self, rom_path):
-        pass
-    
-    def run(self):
-        pass
-    
-    def get_video_frame(self):
-        return b'\x00' * (self.frame_width * self.frame_height * 3)
-    
-    def reset(self):
-        pass
-    
-    def set_input_state(self, button, state):
-        pass
+    def close(self):
+        pass  # Nothing to persist in fallback mode
 
-class SNESEmulator:
+class SNESEmulator(StateControls):
     def __init__(self, root):
         self.root = root
         self.root.title("EMUSNESV0.1 - VIBE EDITION")
@@ -96,6 +78,7 @@ class SNESEmulator:
         self.core_path = None
         self.core_type = None
         
+        self.init_state_controls()
         self.create_menu()
         self.create_main_frame()
         self.create_status_bar()
@@ -105,35 +88,26 @@ class SNESEmulator:
         self.root.bind("<KeyPress>", self.handle_input)
         self.root.bind("<KeyRelease>", self.handle_input)
 
+        self.core_registry = CoreRegistry()
         self.core_path = self.find_core_path()
 
     def find_core_path(self):
-        core_file = "snes9x_libretro.dll"
-        search_paths = [
-            r"C:\RetroArch-Win64\cores",  # Winget default installation path
-            os.path.join(os.path.dirname(os.path.abspath(__file__)), "cores"),
-            os.path.join(os.environ.get("PROGRAMFILES", "C:\\Program Files"), "RetroArch", "cores"),
-            os.path.join(os.environ.get("APPDATA", os.path.expanduser("~\\AppData\\Roaming")), "RetroArch", "cores"),
-            os.path.join(os.environ.get("PROGRAMFILES(X86)", "C:\\Program Files (x86)"), "RetroArch", "cores"),
-        ]
-        path_env = os.environ.get("PATH", "").split(os.pathsep)
-        search_paths.extend(path_env)
-        
-        for path in search_paths:
-            try:
-                core_path = os.path.join(path, core_file)
-                if os.path.exists(core_path):
-                    return core_path
-            except (OSError, TypeError):
-                continue
-        
-        return None  # Core not found, handle in start_emulation
+        core_path = self.core_registry.find("snes9x")
+        if core_path is None:
+            self.core_registry.scan_async()
+        return core_path
+
+    def resolve_core_path(self):
+        return self.core_registry.lookup("snes9x")
 
     def create_menu(self):
         menubar = tk.Menu(self.root)
         self.root.config(menu=menubar)
         file_menu = tk.Menu(menubar, tearoff=0)
         file_menu.add_command(label="Open ROM...", command=self.open_rom)
+        self.add_state_menu(file_menu)
+        self.isolate_core = tk.BooleanVar(value=False)
+        file_menu.add_checkbutton(label="Run Core in Separate Process", variable=self.isolate_core)
         file_menu.add_separator()
         file_menu.add_command(label="Exit", command=self.root.quit)
         menubar.add_cascade(label="File", menu=file_menu)
@@ -184,6 +158,9 @@ class SNESEmulator:
             self.rom_label.config(text=f"ROM: {rom_name}")
             self.status_label.config(text=f"Loaded: {rom_name}")
             self.is_running = False
+            if self.core:
+                self.save_preview()  # Of the game being left
+                self.core.close()
             self.core = None
             self.reset_emulation()
         else:
@@ -193,24 +170,36 @@ class SNESEmulator:
         if not self.current_rom:
             messagebox.showinfo("No ROM", "Load a ROM first!")
             return
+        if not self.core_path:
+            self.core_path = self.resolve_core_path()
         
-        if self.core_path is None:
-            messagebox.showwarning("404 No Libretro", 
-                "snes9x_libretro.dll not found. Using VIBE MODE custom core.\n\n"
-                "For full SNES action, install RetroArch via Winget and ensure the core is in C:\\RetroArch-Win64\\cores.")
-            self.core = CustomSNESCore()
-            self.core_type = "Custom Core"
-        else:
-            try:
-                self.core = Core(self.core_path)
-                self.core_type = "Libretro Core"
-            except Exception as e:
-                messagebox.showwarning("Core Load Failed", 
-                    f"Failed to load core: {e}. Switching to VIBE MODE custom core!")
+        # The core (and the game it has loaded) lives until another ROM is
+        # opened or it crashes, so Start after Pause or Load State resumes it
+        if not self.core:
+            if self.core_path is None:
+                messagebox.showwarning("404 No Libretro", 
+                    "snes9x_libretro.dll not found. Using VIBE MODE custom core.\n\n"
+                    "For full SNES action, install RetroArch via Winget and ensure the core is in C:\\RetroArch-Win64\\cores.")
                 self.core = CustomSNESCore()
                 self.core_type = "Custom Core"
+            else:
+                try:
+                    self.core = (RemoteCore if self.isolate_core.get() else Core)(self.core_path)
+                    self.core_type = "Libretro Core"
+                except Exception as e:
+                    messagebox.showwarning("Core Load Failed", 
+                        f"Failed to load core: {e}. Switching to VIBE MODE custom core!")
+                    self.core = CustomSNESCore()
+                    self.core_type = "Custom Core"
         
-        self.core.load_game(self.current_rom)
+            try:
+                self.core.load_game(self.current_rom)
+            except (LibretroError, OSError) as e:
+                self.core.close()
+                self.core = None
+                self.status_label.config(text="Game failed to load")
+                messagebox.showerror("Load Failed", f"The core could not load the game: {e}")
+                return
         self.is_running = True
         self.status_label.config(text=f"Running: {os.path.basename(self.current_rom)} ({self.core_type})")
         self.emulation_loop()
@@ -218,10 +207,23 @@ class SNESEmulator:
     def emulation_loop(self):
         if not self.is_running or not self.core:
             return
-        self.core.run()
+        try:
+            self.rewind_step()
+            self.core.run()
+            self.record_rewind()
+        except LibretroError as e:
+            # Only an isolated core can fail here without taking the UI down
+            self.is_running = False
+            self.save_preview()  # Of the game being left
+            self.core.close()
+            self.core = None
+            self.status_label.config(text="Core crashed")
+            messagebox.showerror("Core Error", f"The core stopped: {e}")
+            return
         frame_data = self.core.get_video_frame()
         if frame_data:
-            img = Image.frombytes("RGB", (self.core.frame_width, self.frame_height), frame_data)
+            img = frame_image(self.core, frame_data)
+            self.keep_preview(img)
             img = img.resize((512, 240), Image.NEAREST)
             self.photo = ImageTk.PhotoImage(img)
             self.canvas.delete("all")
@@ -231,9 +233,11 @@ class SNESEmulator:
     def pause_emulation(self):
         if self.is_running:
             self.is_running = False
+            self.save_preview()
             self.status_label.config(text=f"Paused: {os.path.basename(self.current_rom)} ({self.core_type})")
 
     def reset_emulation(self, event=None):
+        self.save_preview()
         self.is_running = False
         if self.core:
             self.core.reset()
@@ -269,3 +273,8 @@ if __name__ == "__main__":
     root = tk.Tk()
     app = SNESEmulator(root)
     root.mainloop()
+    app.save_preview()
+    app.thumbnails.flush()
+    app.state_writer.flush()  # Don't lose a state still being written
+    if app.core:
+        app.core.close()
@@ -0,0 +1,386 @@
+import ctypes
+import os
+import struct
+import zlib
+from array import array
+
+from pixels import (FrameConverter, PIXEL_FORMATS, RETRO_PIXEL_FORMAT_0RGB1555,
+                    np)
+from savestate import SaveStateError
+from sram import BatteryRAM, sram_path
+
+# ctypes binding for libretro cores (e.g. snes9x_libretro)
+#
+# The front end registers environment, video, audio and input callbacks,
+# then drives the core with retro_run() once per frame. The video callback
+# does not copy: it wraps the core's framebuffer pointer in a memoryview
+# (pitch bytes per row) that stays valid until the next retro_run(), and
+# the front end decodes it straight into its display image. A NULL frame
+# means "same as last frame" (GET_CAN_DUPE), so the previous view is kept.
+#
+# States use retro_serialize into one ctypes buffer allocated per loaded
+# game and reused for every call, wrapped as savestate chunks so save
+# slots, the background writer and rewind treat libretro cores exactly
+# like the Python cores.
+
+RETRO_API_VERSION = 1
+
+RETRO_DEVICE_JOYPAD = 1
+RETRO_MEMORY_SAVE_RAM = 0
+
+RETRO_ENVIRONMENT_SET_PERFORMANCE_LEVEL = 8
+RETRO_ENVIRONMENT_GET_CAN_DUPE = 3
+RETRO_ENVIRONMENT_GET_SYSTEM_DIRECTORY = 9
+RETRO_ENVIRONMENT_SET_PIXEL_FORMAT = 10
+RETRO_ENVIRONMENT_SET_INPUT_DESCRIPTORS = 11
+RETRO_ENVIRONMENT_GET_VARIABLE = 15
+RETRO_ENVIRONMENT_GET_VARIABLE_UPDATE = 17
+RETRO_ENVIRONMENT_GET_SAVE_DIRECTORY = 31
+
+# Front-end button numbers (see the Tk key maps) -> RETRO_DEVICE_ID_JOYPAD_*
+BUTTON_IDS = {
+    0: 8,   # A
+    1: 0,   # B
+    2: 9,   # X
+    3: 1,   # Y
+    4: 10,  # L
+    5: 11,  # R
+    8: 3,   # Start
+    9: 2,   # Select
+    12: 4,  # Up
+    13: 5,  # Down
+    14: 6,  # Left
+    15: 7,  # Right
+}
+
+
+class retro_system_info(ctypes.Structure):
+    _fields_ = [("library_name", ctypes.c_char_p),
+                ("library_version", ctypes.c_char_p),
+                ("valid_extensions", ctypes.c_char_p),
+                ("need_fullpath", ctypes.c_bool),
+                ("block_extract", ctypes.c_bool)]
+
+
+class retro_game_geometry(ctypes.Structure):
+    _fields_ = [("base_width", ctypes.c_uint),
+                ("base_height", ctypes.c_uint),
+                ("max_width", ctypes.c_uint),
+                ("max_height", ctypes.c_uint),
+                ("aspect_ratio", ctypes.c_float)]
+
+
+class retro_system_timing(ctypes.Structure):
+    _fields_ = [("fps", ctypes.c_double),
+                ("sample_rate", ctypes.c_double)]
+
+
+class retro_system_av_info(ctypes.Structure):
+    _fields_ = [("geometry", retro_game_geometry),
+                ("timing", retro_system_timing)]
+
+
+class retro_game_info(ctypes.Structure):
+    _fields_ = [("path", ctypes.c_char_p),
+                ("data", ctypes.c_void_p),
+                ("size", ctypes.c_size_t),
+                ("meta", ctypes.c_char_p)]
+
+
+class retro_variable(ctypes.Structure):
+    _fields_ = [("key", ctypes.c_char_p),
+                ("value", ctypes.c_char_p)]
+
+
+retro_environment_t = ctypes.CFUNCTYPE(ctypes.c_bool, ctypes.c_uint, ctypes.c_void_p)
+retro_video_refresh_t = ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.c_uint, ctypes.c_uint,
+                                         ctypes.c_size_t)
+retro_audio_sample_t = ctypes.CFUNCTYPE(None, ctypes.c_int16, ctypes.c_int16)
+retro_audio_sample_batch_t = ctypes.CFUNCTYPE(ctypes.c_size_t, ctypes.c_void_p, ctypes.c_size_t)
+retro_input_poll_t = ctypes.CFUNCTYPE(None)
+retro_input_state_t = ctypes.CFUNCTYPE(ctypes.c_int16, ctypes.c_uint, ctypes.c_uint,
+                                       ctypes.c_uint, ctypes.c_uint)
+
+
+class LibretroError(Exception):
+    pass
+
+
+class Core:
+    """A libretro core loaded with ctypes, driven one frame per run()."""
+
+    def __init__(self, path, system_dir=None, save_dir=None):
+        try:
+            self.lib = ctypes.CDLL(path)
+        except OSError as e:
+            raise LibretroError(f"Failed to load core: {e}") from None
+        self._declare()
+        if self.lib.retro_api_version() != RETRO_API_VERSION:
+            raise LibretroError("Core uses an unsupported libretro API version")
+        self.frame_width, self.frame_height = 256, 224
+        self.pitch = 0
+        self.pixel_format = RETRO_PIXEL_FORMAT_0RGB1555  # libretro default
+        self.rawmode, self.bytes_per_pixel = PIXEL_FORMATS[self.pixel_format]
+        self.frame = None  # memoryview over the core's last framebuffer
+        self.converter = FrameConverter() if np is not None else None
+        self.audio_samples = array("h")  # Interleaved stereo output of the last frame
+        self.fps, self.sample_rate = 60.0, 32040.0
+        self.buttons = [0] * 16  # Indexed by RETRO_DEVICE_ID_JOYPAD_*
+        self.system_dir = (system_dir or os.path.dirname(os.path.abspath(path))).encode()
+        self.save_dir = save_dir.encode() if save_dir else self.system_dir
+        self.game_loaded = False
+        self._game_data = None  # Keeps ROM bytes alive while the core uses them
+        self.sram = None
+        self.frames = 0
+        self.rom_crc = self.rom_size = 0
+        self._state = None  # Reused retro_serialize buffer, sized per game
+        self._state_view = None
+
+        # Keep references: ctypes callbacks are freed with their Python objects
+        self._callbacks = (
+            retro_environment_t(self._environment),
+            retro_video_refresh_t(self._video_refresh),
+            retro_audio_sample_t(self._audio_sample),
+            retro_audio_sample_batch_t(self._audio_sample_batch),
+            retro_input_poll_t(self._input_poll),
+            retro_input_state_t(self._input_state),
+        )
+        environment, video, audio, audio_batch, input_poll, input_state = self._callbacks
+        self.lib.retro_set_environment(environment)
+        self.lib.retro_init()
+        self.lib.retro_set_video_refresh(video)
+        self.lib.retro_set_audio_sample(audio)
+        self.lib.retro_set_audio_sample_batch(audio_batch)
+        self.lib.retro_set_input_poll(input_poll)
+        self.lib.retro_set_input_state(input_state)
+
+    def _declare(self):
+        lib = self.lib
+        lib.retro_api_version.restype = ctypes.c_uint
+        lib.retro_set_environment.argtypes = [retro_environment_t]
+        lib.retro_set_video_refresh.argtypes = [retro_video_refresh_t]
+        lib.retro_set_audio_sample.argtypes = [retro_audio_sample_t]
+        lib.retro_set_audio_sample_batch.argtypes = [retro_audio_sample_batch_t]
+        lib.retro_set_input_poll.argtypes = [retro_input_poll_t]
+        lib.retro_set_input_state.argtypes = [retro_input_state_t]
+        lib.retro_get_system_info.argtypes = [ctypes.POINTER(retro_system_info)]
+        lib.retro_get_system_av_info.argtypes = [ctypes.POINTER(retro_system_av_info)]
+        lib.retro_load_game.argtypes = [ctypes.POINTER(retro_game_info)]
+        lib.retro_load_game.restype = ctypes.c_bool
+        lib.retro_get_memory_data.argtypes = [ctypes.c_uint]
+        lib.retro_get_memory_data.restype = ctypes.c_void_p
+        lib.retro_get_memory_size.argtypes = [ctypes.c_uint]
+        lib.retro_get_memory_size.restype = ctypes.c_size_t
+        lib.retro_serialize_size.restype = ctypes.c_size_t
+        lib.retro_serialize.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+        lib.retro_serialize.restype = ctypes.c_bool
+        lib.retro_unserialize.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+        lib.retro_unserialize.restype = ctypes.c_bool
+
+    # Callbacks (called from inside retro_run)
+
+    def _environment(self, cmd, data):
+        if cmd == RETRO_ENVIRONMENT_GET_CAN_DUPE:
+            ctypes.cast(data, ctypes.POINTER(ctypes.c_bool))[0] = True
+            return True
+        if cmd == RETRO_ENVIRONMENT_SET_PIXEL_FORMAT:
+            fmt = ctypes.cast(data, ctypes.POINTER(ctypes.c_int))[0]
+            if fmt not in PIXEL_FORMATS:
+                return False
+            self.pixel_format = fmt
+            self.rawmode, self.bytes_per_pixel = PIXEL_FORMATS[fmt]
+            return True
+        if cmd in (RETRO_ENVIRONMENT_GET_SYSTEM_DIRECTORY, RETRO_ENVIRONMENT_GET_SAVE_DIRECTORY):
+            path = self.system_dir if cmd == RETRO_ENVIRONMENT_GET_SYSTEM_DIRECTORY else self.save_dir
+            ctypes.cast(data, ctypes.POINTER(ctypes.c_char_p))[0] = path
+            return True
+        if cmd == RETRO_ENVIRONMENT_GET_VARIABLE:
+            ctypes.cast(data, ctypes.POINTER(retro_variable))[0].value = None  # Core defaults
+            return False
+        if cmd == RETRO_ENVIRONMENT_GET_VARIABLE_UPDATE:
+            ctypes.cast(data, ctypes.POINTER(ctypes.c_bool))[0] = False
+            return True
+        if cmd in (RETRO_ENVIRONMENT_SET_PERFORMANCE_LEVEL, RETRO_ENVIRONMENT_SET_INPUT_DESCRIPTORS):
+            return True
+        return False
+
+    def _video_refresh(self, data, width, height, pitch):
+        if not data:
+            return  # Duped frame: the previous view is still current
+        self.frame_width, self.frame_height, self.pitch = width, height, pitch
+        self.frame = memoryview((ctypes.c_ubyte * (pitch * height)).from_address(data)).cast("B")
+
+    def _audio_sample(self, left, right):
+        self.audio_samples.append(left)
+        self.audio_samples.append(right)
+
+    def _audio_sample_batch(self, data, frames):
+        self.audio_samples.frombytes((ctypes.c_ubyte * (frames * 4)).from_address(data))
+        return frames
+
+    def _input_poll(self):
+        pass  # Button state is updated directly from Tk key events
+
+    def _input_state(self, port, device, index, button):
+        if port == 0 and device == RETRO_DEVICE_JOYPAD and button < 16:
+            return self.buttons[button]
+        return 0
+
+    # Front-end API (same shape as the Python cores)
+
+    def load_game(self, rom_path, rom_data=None, battery=True):
+        """Load a game; rom_data may be a writable mapping of the file to pass in place.
+
+        With battery False the .srm is neither read nor written: save RAM
+        starts blank and lives in memory only.
+        """
+        info = retro_system_info()
+        self.lib.retro_get_system_info(ctypes.byref(info))
+        game = retro_game_info(path=os.fsencode(rom_path))
+        data = rom_data
+        if data is None:
+            with open(rom_path, "rb") as f:
+                data = f.read()
+        self.rom_crc, self.rom_size = zlib.crc32(data), len(data)
+        if not info.need_fullpath:
+            if isinstance(data, bytes):
+                self._game_data = data
+                game.data = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p)
+            else:  # e.g. a copy-on-write mmap; keeps its pages shared
+                self._game_data = (ctypes.c_char * len(data)).from_buffer(data)
+                game.data = ctypes.addressof(self._game_data)
+            game.size = len(data)
+        if not self.lib.retro_load_game(ctypes.byref(game)):
+            raise LibretroError(f"Core could not load {os.path.basename(rom_path)}")
+        self.game_loaded = True
+        av_info = retro_system_av_info()
+        self.lib.retro_get_system_av_info(ctypes.byref(av_info))
+        self.frame_width = av_info.geometry.base_width
+        self.frame_height = av_info.geometry.base_height
+        self.fps, self.sample_rate = av_info.timing.fps, av_info.timing.sample_rate
+        buffer = self.get_save_ram()
+        self.sram = BatteryRAM(sram_path(rom_path) if battery else None,
+                               len(buffer) if buffer is not None else 0)
+        if buffer is not None and len(buffer):
+            buffer[:] = self.sram.data  # Hand the .srm contents to the core
+            self.sram.poll(buffer)
+        self._state = self._state_view = None
+
+    def serialize_size(self):
+        return self.lib.retro_serialize_size()
+
+    def serialize_view(self):
+        """Serialize into the reused buffer; the view is valid until the next call."""
+        size = self.lib.retro_serialize_size()
+        if not size:
+            raise LibretroError("Core does not support save states")
+        if self._state is None or len(self._state) < size:
+            self._state = (ctypes.c_ubyte * size)()
+            self._state_view = memoryview(self._state).cast("B")
+        if not self.lib.retro_serialize(self._state, size):
+            raise LibretroError("Core failed to serialize its state")
+        return self._state_view[:size]
+
+    def serialize(self):
+        """Current state as bytes (one copy out of the reused buffer)."""
+        return bytes(self.serialize_view())
+
+    def unserialize(self, data):
+        """Restore a serialize() result; data may be any buffer."""
+        size = len(data)
+        if self._state is None or len(self._state) < size:
+            self._state = (ctypes.c_ubyte * size)()
+            self._state_view = memoryview(self._state).cast("B")
+        self._state_view[:size] = data
+        if not self.lib.retro_unserialize(self._state, size):
+            raise LibretroError("Core rejected the state")
+
+    _ROM_ID = struct.Struct("<II")
+
+    def state_chunks(self):
+        """Savestate chunks: ROM identity plus the core's serialized state (not copied)."""
+        return [(b"ROMI", self._ROM_ID.pack(self.rom_crc, self.rom_size)),
+                (b"RETR", self.serialize_view())]
+
+    def snapshot(self):
+        """Immutable state for rewind and the background state writer."""
+        return [(b"ROMI", self._ROM_ID.pack(self.rom_crc, self.rom_size)),
+                (b"RETR", self.serialize())]
+
+    def load_state_chunks(self, chunks):
+        if self._ROM_ID.unpack(chunks[b"ROMI"]) != (self.rom_crc, self.rom_size):
+            raise SaveStateError("State was saved with a different ROM")
+        try:
+            self.unserialize(chunks[b"RETR"])
+        except LibretroError as e:
+            raise SaveStateError(str(e)) from None
+
+    def restore(self, snapshot):
+        self.load_state_chunks(dict(snapshot))
+
+    def run(self):
+        del self.audio_samples[:]
+        self.lib.retro_run()
+        self.sync_sram()
+
+    def get_video_frame(self):
+        """The last frame as a zero-copy memoryview (see rawmode and pitch), or None."""
+        return self.frame
+
+    def reset(self):
+        self.lib.retro_reset()
+
+    def set_input_state(self, button, state):
+        retro_id = BUTTON_IDS.get(button)
+        if retro_id is not None:
+            self.buttons[retro_id] = 1 if state else 0
+
+    def get_save_ram(self):
+        """The core's battery RAM as a writable memoryview, or None if it has none."""
+        size = self.lib.retro_get_memory_size(RETRO_MEMORY_SAVE_RAM)
+        address = self.lib.retro_get_memory_data(RETRO_MEMORY_SAVE_RAM)
+        if not size or not address:
+            return None
+        return memoryview((ctypes.c_ubyte * size).from_address(address)).cast("B")
+
+    def sync_sram(self):
+        # Poll the core's save RAM once a second; BatteryRAM flushes once writes go idle
+        self.frames += 1
+        if self.sram and self.frames % 60 == 0:
+            buffer = self.get_save_ram()
+            if buffer is not None:
+                self.sram.poll(buffer)
+            self.sram.tick()
+
+    def close(self):
+        """Flush save RAM, unload the game and shut the core down."""
+        if self.sram:
+            buffer = self.get_save_ram()
+            if buffer is not None:
+                self.sram.poll(buffer)
+            self.sram.flush()
+            self.sram = None
+        if self.game_loaded:
+            self.lib.retro_unload_game()
+            self.game_loaded = False
+            self._game_data = None
+        self.lib.retro_deinit()
+        self.frame = None
+
+
+def frame_image(core, frame):
+    """Decode a get_video_frame() result from any core into a PIL RGB image.
+
+    Python cores return packed RGB bytes. Libretro frames are converted with
+    the core's FrameConverter when NumPy is available, otherwise PIL's raw
+    decoder reads them in place using the pitch.
+    """
+    from PIL import Image
+    size = (core.frame_width, core.frame_height)
+    converter = getattr(core, "converter", None)
+    if converter is not None:
+        frame = converter.convert(frame, core.frame_width, core.frame_height, core.pitch,
+                                  core.pixel_format)
+    elif hasattr(core, "rawmode"):
+        return Image.frombuffer("RGB", size, frame, "raw", core.rawmode, core.pitch, 1)
+    return Image.frombuffer("RGB", size, frame, "raw", "RGB", 0, 1)
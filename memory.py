@@ -0,0 +1,64 @@
+PAGE_SHIFT = 12
+PAGE_SIZE = 1 << PAGE_SHIFT  # 4KB
+
+
+class PagedMemory:
+    """Dirty-page tracking over a bytearray for copy-on-write snapshots.
+
+    Writers call touch() (or set dirty[addr >> PAGE_SHIFT] directly on hot
+    paths) whenever they store into data. snapshot() then copies only the
+    pages written since the previous snapshot and reuses the previous
+    snapshot's bytes objects for the rest, so consecutive snapshots share
+    every clean page by reference.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.count = (len(data) + PAGE_SIZE - 1) >> PAGE_SHIFT
+        self.dirty = bytearray(b"\x01" * self.count)
+        self.pages = [b""] * self.count
+
+    def touch(self, addr):
+        self.dirty[addr >> PAGE_SHIFT] = 1
+
+    def touch_all(self):
+        self.dirty[:] = b"\x01" * self.count
+
+    def dirty_count(self):
+        return self.count - self.dirty.count(0)
+
+    def snapshot(self):
+        """Return the memory contents as an immutable tuple of page bytes."""
+        data = self.data
+        dirty = self.dirty
+        pages = self.pages
+        index = dirty.find(1)
+        while index != -1:
+            start = index << PAGE_SHIFT
+            pages[index] = bytes(data[start:start + PAGE_SIZE])
+            dirty[index] = 0
+            index = dirty.find(1, index + 1)
+        return tuple(pages)
+
+    def restore(self, pages):
+        """Load a snapshot, copying only pages that differ from the current
+        contents. Returns the indices of the pages that were rewritten."""
+        data = self.data
+        current = self.pages
+        dirty = self.dirty
+        changed = []
+        for index, page in enumerate(pages):
+            if page is not current[index] or dirty[index]:
+                start = index << PAGE_SHIFT
+                data[start:start + len(page)] = page
+                current[index] = page
+                dirty[index] = 0
+                changed.append(index)
+        return changed
+
+
+def chunk_size(payload):
+    """Byte length of a state chunk payload (a buffer or a tuple of pages)."""
+    if isinstance(payload, tuple):
+        return sum(len(page) for page in payload)
+    return len(payload)
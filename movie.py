@@ -0,0 +1,175 @@
+import bisect
+import io
+import struct
+import sys
+import zlib
+from array import array
+
+from savestate import write_atomic
+
+# Compact input movie format
+#
+#   header     magic, version, anchor kind, keyframe interval, frame count
+#   anchor     zlib-compressed core state the movie starts from
+#   inputs     one little-endian uint16 controller bitmask per frame
+#   keyframes  (frame, length, zlib state) records every `interval` frames
+#   index      keyframe count followed by (frame, file offset) pairs
+#   footer     file offset of the index
+#
+# Keyframes let a player seek to frame N by restoring the nearest earlier
+# state and replaying only the remaining inputs.
+
+MOVIE_MAGIC = b"S9XM"
+MOVIE_VERSION = 1
+ANCHOR_POWER_ON = 0
+ANCHOR_SAVESTATE = 1
+
+_HEADER = struct.Struct("<4sHHII")
+_BLOCK = struct.Struct("<II")
+_INDEX_ENTRY = struct.Struct("<IQ")
+_FOOTER = struct.Struct("<Q")
+
+
+class MovieError(Exception):
+    pass
+
+
+class MovieRecorder:
+    """Record per-frame controller bitmasks with periodic keyframe states."""
+
+    def __init__(self, path, keyframe_interval=600):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.anchor_kind = ANCHOR_POWER_ON
+        self.anchor = b""
+        self.inputs = array("H")
+        self.keyframes = []  # (frame, compressed state)
+
+    @property
+    def frame_count(self):
+        return len(self.inputs)
+
+    def start(self, core, from_power_on=True):
+        """Anchor the movie at power-on or at the core's current state."""
+        if from_power_on:
+            core.power_on()
+            self.anchor_kind = ANCHOR_POWER_ON
+        else:
+            self.anchor_kind = ANCHOR_SAVESTATE
+        self.anchor = zlib.compress(core.serialize())
+        del self.inputs[:]
+        self.keyframes = []
+
+    def record_frame(self, core):
+        """Call once per frame, before core.run(), to log the frame's input."""
+        frame = len(self.inputs)
+        if frame and frame % self.keyframe_interval == 0:
+            self.keyframes.append((frame, zlib.compress(core.serialize())))
+        self.inputs.append(core.get_input_mask())
+
+    def stop(self):
+        """Write the movie to disk (atomically; raises OSError if it can't)."""
+        inputs = array("H", self.inputs)
+        if sys.byteorder == "big":
+            inputs.byteswap()
+        with io.BytesIO() as f:
+            f.write(_HEADER.pack(MOVIE_MAGIC, MOVIE_VERSION, self.anchor_kind,
+                                 self.keyframe_interval, len(inputs)))
+            f.write(_BLOCK.pack(0, len(self.anchor)))
+            f.write(self.anchor)
+            f.write(inputs.tobytes())
+            index = []
+            for frame, state in self.keyframes:
+                index.append((frame, f.tell()))
+                f.write(_BLOCK.pack(frame, len(state)))
+                f.write(state)
+            index_offset = f.tell()
+            f.write(struct.pack("<I", len(index)))
+            for entry in index:
+                f.write(_INDEX_ENTRY.pack(*entry))
+            f.write(_FOOTER.pack(index_offset))
+            write_atomic(self.path, f.getvalue())
+
+
+class MoviePlayer:
+    """Feed a recorded movie into a core, headless or from the Tk loop."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.data = memoryview(f.read())
+        magic, version, self.anchor_kind, self.keyframe_interval, count = \
+            _HEADER.unpack_from(self.data, 0)
+        if magic != MOVIE_MAGIC:
+            raise MovieError("Not a movie file")
+        if version != MOVIE_VERSION:
+            raise MovieError(f"Unsupported movie version {version}")
+        offset = _HEADER.size
+        _, anchor_len = _BLOCK.unpack_from(self.data, offset)
+        offset += _BLOCK.size
+        self.anchor = self.data[offset:offset + anchor_len]
+        offset += anchor_len
+        self.inputs = array("H")
+        self.inputs.frombytes(self.data[offset:offset + count * 2])
+        if sys.byteorder == "big":
+            self.inputs.byteswap()
+        (index_offset,) = _FOOTER.unpack_from(self.data, len(self.data) - _FOOTER.size)
+        (keyframe_count,) = struct.unpack_from("<I", self.data, index_offset)
+        self.keyframe_frames = [0]
+        self.keyframe_offsets = [None]  # frame 0 is the anchor
+        for i in range(keyframe_count):
+            frame, kf_offset = _INDEX_ENTRY.unpack_from(
+                self.data, index_offset + 4 + i * _INDEX_ENTRY.size)
+            self.keyframe_frames.append(frame)
+            self.keyframe_offsets.append(kf_offset)
+        self.frame = 0
+
+    @property
+    def frame_count(self):
+        return len(self.inputs)
+
+    @property
+    def finished(self):
+        return self.frame >= len(self.inputs)
+
+    def _keyframe_state(self, i):
+        offset = self.keyframe_offsets[i]
+        if offset is None:
+            return zlib.decompress(self.anchor)
+        _, length = _BLOCK.unpack_from(self.data, offset)
+        start = offset + _BLOCK.size
+        return zlib.decompress(self.data[start:start + length])
+
+    def start(self, core):
+        """Restore the anchor state and rewind to frame 0."""
+        core.unserialize(zlib.decompress(self.anchor))
+        self.frame = 0
+
+    def feed(self, core):
+        """Apply the current frame's input; call before core.run()."""
+        if self.finished:
+            return False
+        core.set_input_mask(self.inputs[self.frame])
+        self.frame += 1
+        return True
+
+    def seek(self, core, frame):
+        """Put the core in the state it had at the start of `frame`."""
+        frame = max(0, min(frame, len(self.inputs)))
+        i = bisect.bisect_right(self.keyframe_frames, frame) - 1
+        core.unserialize(self._keyframe_state(i))
+        self.frame = self.keyframe_frames[i]
+        was_running = core.running
+        core.running = True
+        while self.frame < frame:
+            self.feed(core)
+            core.run()
+        core.running = was_running
+
+    def play(self, core, render=False):
+        """Run the rest of the movie without Tk, yielding each frame number."""
+        core.running = True
+        while self.feed(core):
+            core.run()
+            if render:
+                core.render_frame()
+            yield self.frame
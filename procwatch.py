@@ -0,0 +1,285 @@
+import os
+import queue
+import subprocess
+import threading
+import time
+from collections import deque
+
+# Event-driven supervision of external emulator processes
+#
+# The launchers used to poll Popen.poll() every 100 ms from Tk. Here each
+# child gets a waiter thread blocked in wait() plus a reader thread per
+# output pipe, so nothing runs while a child is alive and its output can
+# never fill a pipe and stall it. When a child exits, the supervisor
+# hands an event to the UI thread; with Tk that is a virtual
+# <<ChildExited>> event, which is safe to post from other threads when Tcl
+# is threaded (otherwise it falls back to a slow poll of the event queue).
+# stop() sends terminate and escalates to kill after a grace period on a
+# background thread, so the UI never waits for a child to die.
+#
+# Launch latency is measured from launch (or hand-off from the warm pool)
+# to the child's first line of output, the closest thing to "first frame"
+# a generic external emulator exposes. WarmPool keeps emulators started
+# ahead of time, idle, for those that take a load command on stdin; for
+# the rest, prefetch() pulls the ROM and binary into the page cache so at
+# least the cold launch doesn't wait on the disk.
+
+OUTPUT_LINES = 200  # Lines of stdout/stderr kept per child
+STOP_GRACE = 3.0  # Seconds between terminate and kill
+PREFETCH_CHUNK = 1024 * 1024
+
+
+class ChildProcess:
+    """A supervised child: its Popen, recent output and exit status."""
+
+    def __init__(self, args, name, on_exit, stdin=False, on_output=None):
+        self.args = args
+        self.name = name
+        self.on_exit = on_exit
+        self.on_output = on_output  # Called once with the child at its first output after launch
+        self.stdout = deque(maxlen=OUTPUT_LINES)
+        self.stderr = deque(maxlen=OUTPUT_LINES)
+        self.stopping = False  # Exit was requested through stop()
+        self.idle = False  # Waiting in a WarmPool for a ROM
+        self.launched = time.perf_counter()
+        self.first_output = None  # perf_counter() of the first line after `launched`
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE if stdin else subprocess.DEVNULL,
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                        text=True, errors="replace", bufsize=1)
+        self.pid = self.process.pid
+        self._readers = [self._read(self.process.stdout, self.stdout),
+                         self._read(self.process.stderr, self.stderr)]
+
+    def _read(self, stream, lines):
+        def drain():
+            with stream:
+                for line in stream:
+                    lines.append(line.rstrip("\n"))
+                    if self.first_output is None:
+                        self.first_output = time.perf_counter()
+                        if self.on_output:
+                            self.on_output(self)
+        reader = threading.Thread(target=drain, name=f"{self.name}-output", daemon=True)
+        reader.start()
+        return reader
+
+    @property
+    def latency(self):
+        """Seconds from launch to first output, or None if there hasn't been any."""
+        if self.first_output is None:
+            return None
+        return self.first_output - self.launched
+
+    def send(self, text):
+        """Write to the child's stdin (only for children started with stdin=True)."""
+        self.process.stdin.write(text)
+        self.process.stdin.flush()
+
+    @property
+    def returncode(self):
+        return self.process.returncode
+
+    def running(self):
+        return self.process.returncode is None
+
+    def wait(self):
+        """Block until the child exits and its output is collected."""
+        self.process.wait()
+        for reader in self._readers:
+            reader.join()
+        return self.process.returncode
+
+
+class ProcessSupervisor:
+    """Launch and watch several children; report each exit through notify().
+
+    notify(callback) must arrange for callback() to run on the UI thread;
+    see tk_notifier(). on_exit callbacks receive the ChildProcess.
+    """
+
+    def __init__(self, notify=None):
+        self.notify = notify or (lambda callback: callback())
+        self.children = []
+        self._lock = threading.Lock()
+
+    def launch(self, args, name=None, on_exit=None, on_output=None, stdin=False):
+        """Start a child (raises OSError if it can't be started)."""
+        # on_output goes in before the reader threads start, or a quick first
+        # line could be missed
+        child = ChildProcess(args, name or f"child-{len(self.children) + 1}", on_exit, stdin,
+                             self._notifying(on_output))
+        with self._lock:
+            self.children.append(child)
+        threading.Thread(target=self._wait, args=(child,), name=f"{child.name}-waiter",
+                         daemon=True).start()
+        return child
+
+    def watch_output(self, child, on_output):
+        """Report the child's first output (from now on) through notify()."""
+        child.on_output = self._notifying(on_output)
+
+    def _notifying(self, on_output):
+        if on_output is None:
+            return None
+        return lambda child: self.notify(lambda: on_output(child))
+
+    def _wait(self, child):
+        child.wait()
+        with self._lock:
+            self.children.remove(child)
+        if child.on_exit:
+            self.notify(lambda: child.on_exit(child))
+
+    def running(self):
+        """Children that are alive and in use (prewarmed idle ones excluded)."""
+        with self._lock:
+            return [child for child in self.children if not child.idle]
+
+    def stop(self, child, grace=STOP_GRACE):
+        """Ask a child to exit, killing it if it is still alive after `grace` seconds."""
+        if not child.running():
+            return
+        child.stopping = True
+
+        def escalate():
+            try:
+                child.process.terminate()
+                child.process.wait(grace)
+            except subprocess.TimeoutExpired:
+                child.process.kill()
+            except OSError:
+                pass  # Already gone
+        threading.Thread(target=escalate, name=f"{child.name}-stop", daemon=True).start()
+
+    def stop_all(self, grace=STOP_GRACE, wait=False):
+        """Stop every child; with wait=True, return only once they have exited."""
+        children = self.running()
+        for child in children:
+            self.stop(child, grace)
+        if wait:
+            for child in children:
+                child.wait()
+
+
+def tk_notifier(root):
+    """A ProcessSupervisor notify function that runs callbacks on root's thread."""
+    import tkinter as tk
+    events = queue.Queue()
+
+    def dispatch(event=None):
+        try:
+            while True:
+                events.get_nowait()()
+        except queue.Empty:
+            pass
+
+    if root.tk.eval("info exists tcl_platform(threaded)") == "1":
+        root.bind("<<ChildExited>>", dispatch)
+
+        def notify(callback):
+            events.put(callback)
+            try:
+                root.event_generate("<<ChildExited>>", when="tail")
+            except (RuntimeError, tk.TclError):
+                pass  # Window already destroyed
+        return notify
+
+    def poll():  # Unthreaded Tcl can't take events from other threads
+        dispatch()
+        root.after(250, poll)
+    poll()
+    return events.put
+
+
+class WarmPool:
+    """Emulator processes started ahead of time, idle until given a ROM.
+
+    Only for emulators that accept a load command on stdin; load_command is
+    a format string with {rom}, e.g. "load {rom}\\n". Idle children belong to
+    the supervisor but don't report their exits.
+    """
+
+    def __init__(self, supervisor, args, load_command, size=1):
+        self.supervisor = supervisor
+        self.args = list(args)
+        self.load_command = load_command
+        self.size = size
+        self.idle = []
+        self._lock = threading.Lock()
+        self.fill()
+
+    def fill(self):
+        """Start children until `size` are idle (in the background)."""
+        def start():
+            while True:
+                with self._lock:
+                    if self.args is None or len(self.idle) >= self.size:
+                        return
+                try:
+                    child = self.supervisor.launch(self.args, name="prewarmed",
+                                                   on_exit=self._idle_exited, stdin=True)
+                except OSError:
+                    return
+                with self._lock:
+                    child.idle = True
+                    closed = self.args is None
+                    if not closed:
+                        self.idle.append(child)
+                if closed:  # close() ran while it was starting
+                    child.idle = False
+                    self.supervisor.stop(child)
+                    return
+        threading.Thread(target=start, name="warm-pool", daemon=True).start()
+
+    def _idle_exited(self, child):
+        with self._lock:
+            if child in self.idle:
+                self.idle.remove(child)
+
+    def acquire(self, rom_path, name=None, on_exit=None, on_output=None):
+        """Hand a ROM to an idle child; returns it, or None if none is ready."""
+        while True:
+            with self._lock:
+                if not self.idle:
+                    return None
+                child = self.idle.pop(0)
+                child.idle = False
+            if not child.running():
+                continue
+            child.name = name or child.name
+            child.on_exit = on_exit
+            child.launched = time.perf_counter()
+            child.first_output = None
+            self.supervisor.watch_output(child, on_output)
+            try:
+                child.send(self.load_command.format(rom=rom_path))
+            except (OSError, ValueError):
+                self.supervisor.stop(child)
+                continue  # Died while idle
+            self.fill()
+            return child
+
+    def close(self):
+        """Stop the idle children."""
+        with self._lock:
+            self.args = None
+            idle, self.idle = self.idle, []
+        for child in idle:
+            child.idle = False  # Back under stop_all()
+            self.supervisor.stop(child)
+
+
+def prefetch(*paths):
+    """Pull files into the page cache on a background thread."""
+    def read():
+        for path in paths:
+            try:
+                with open(path, "rb") as f:
+                    if hasattr(os, "posix_fadvise"):
+                        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                    else:
+                        while f.read(PREFETCH_CHUNK):
+                            pass
+            except OSError:
+                pass
+    threading.Thread(target=read, name="prefetch", daemon=True).start()
@@ -0,0 +1,173 @@
+import argparse
+import glob
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import time
+from array import array
+
+from capture import FrameCapture
+from movie import MoviePlayer, MovieError
+from sram import BatteryRAM
+
+# Golden frame-hash regression harness
+#
+# Runs every ROM in a corpus directory headless for a fixed number of frames
+# with a fixed input script, and every `interval` frames hashes the frame
+# buffer together with all audio produced so far. The hashes are compared
+# with golden/<rom>.json; the first divergent checkpoint and the change in
+# frames per second are reported. A movie named <rom>.s9xm next to the ROM
+# replaces the built-in input script. With --capture, every frame is also
+# recorded to <dir>/<rom>.y4m (+ .wav) by a writer process. Rendering
+# doesn't touch emulated state, so hashes match an uncaptured run, and the
+# fps figure is then taken from this process's CPU time minus the frame
+# hand-off, so the writer competing for a core doesn't show up as a slowdown.
+#
+#   python regress.py roms/ --update   record golden hashes
+#   python regress.py roms/            check against them
+
+ROM_PATTERNS = ("*.sfc", "*.smc")
+CORE_MODULE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "snes9x5.15.25.py")
+
+
+def load_core_class(path=CORE_MODULE, name="Snes9xCore"):
+    """Import a core class from a Tk front end without starting its GUI."""
+    spec = importlib.util.spec_from_file_location(os.path.basename(path).replace(".", "_"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, name)
+
+
+def scripted_input(frame):
+    """Deterministic input: walk in a new direction every 30 frames, tap A and B."""
+    mask = 1 << (12 + (frame // 30) % 4)  # Up, Down, Left, Right
+    if frame % 45 < 10:
+        mask |= 1 << 0  # A
+    if frame % 70 < 5:
+        mask |= 1 << 1  # B
+    return mask
+
+
+def run_rom(core_class, rom_path, frames, interval, capture_dir=None):
+    """Run a ROM headless; returns (hex digests per checkpoint, frames run, seconds)."""
+    core = core_class()
+    core.load_game(rom_path)
+    if core.sram:
+        core.sram = BatteryRAM(None, len(core.sram))  # Never read or write the player's .srm
+    core.power_on()
+    core.running = True
+    player = None
+    movie_path = os.path.splitext(rom_path)[0] + ".s9xm"
+    if os.path.isfile(movie_path):
+        player = MoviePlayer(movie_path)
+        player.start(core)
+        frames = min(frames, player.frame_count)
+    capture = None
+    if capture_dir:
+        os.makedirs(capture_dir, exist_ok=True)
+        name = os.path.splitext(os.path.basename(rom_path))[0]
+        capture = FrameCapture(os.path.join(capture_dir, name + ".y4m"), process=True)
+    audio = hashlib.blake2b(digest_size=16)
+    hashes = []
+    capture_time = 0.0
+    clock = time.process_time if capture else time.perf_counter
+    start = clock()
+    for frame in range(frames):
+        if player:
+            player.feed(core)
+        else:
+            core.set_input_mask(scripted_input(frame))
+        core.run()
+        audio.update(core.audio_samples.tobytes())
+        if capture:
+            captured = clock()
+            core.render_frame()
+            capture.add_pixels(core.frame_width, core.frame_height, core.frame_buffer,
+                               core.audio_samples)
+            capture_time += clock() - captured
+        if (frame + 1) % interval == 0:
+            if not capture:
+                core.render_frame()
+            digest = hashlib.blake2b(array("I", core.frame_buffer).tobytes(), digest_size=16)
+            digest.update(audio.digest())
+            hashes.append(digest.hexdigest())
+    seconds = clock() - start - capture_time
+    if capture:
+        _, dropped = capture.close()
+        if dropped:
+            print(f"       {os.path.basename(rom_path)}: capture repeated {dropped} frames")
+    return hashes, frames, seconds
+
+
+def golden_path(golden_dir, rom_path):
+    return os.path.join(golden_dir, os.path.basename(rom_path) + ".json")
+
+
+def check_rom(core_class, rom_path, golden_dir, frames, interval, update, capture_dir=None):
+    """Run one ROM and compare or record; returns True when it matches."""
+    name = os.path.basename(rom_path)
+    try:
+        hashes, frames, seconds = run_rom(core_class, rom_path, frames, interval, capture_dir)
+    except (OSError, MovieError) as e:
+        print(f"ERROR  {name}: {e}")
+        return False
+    fps = frames / seconds if seconds else 0.0
+    path = golden_path(golden_dir, rom_path)
+    if update:
+        os.makedirs(golden_dir, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"frames": frames, "interval": interval, "fps": round(fps, 1),
+                       "hashes": hashes}, f, indent=1)
+        print(f"UPDATE {name}: {len(hashes)} checkpoints, {fps:.1f} fps")
+        return True
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            golden = json.load(f)
+    except (OSError, ValueError):
+        print(f"MISSING {name}: no golden hashes (run with --update)")
+        return False
+    if golden["interval"] != interval:
+        print(f"ERROR  {name}: golden interval is {golden['interval']}, not {interval}")
+        return False
+    speed = f"{fps:.1f} fps ({(fps / golden['fps'] - 1) * 100:+.1f}%)" if golden["fps"] else f"{fps:.1f} fps"
+    for i, (got, want) in enumerate(zip(hashes, golden["hashes"])):
+        if got != want:
+            first = i * interval + 1
+            print(f"FAIL   {name}: diverged between frames {first} and {first + interval - 1}, {speed}")
+            return False
+    if len(hashes) != len(golden["hashes"]):
+        print(f"FAIL   {name}: {len(hashes)} checkpoints, golden has {len(golden['hashes'])}")
+        return False
+    print(f"OK     {name}: {len(hashes)} checkpoints, {speed}")
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Golden frame-hash regression suite")
+    parser.add_argument("corpus", help="directory of ROMs to run")
+    parser.add_argument("--golden", help="golden hash directory (default: <corpus>/golden)")
+    parser.add_argument("--frames", type=int, default=600, help="frames to run per ROM")
+    parser.add_argument("--interval", type=int, default=60, help="frames between hashes")
+    parser.add_argument("--update", action="store_true", help="record new golden hashes")
+    parser.add_argument("--capture", metavar="DIR", help="also record each run as Y4M + WAV")
+    args = parser.parse_args(argv)
+    roms = sorted(path for pattern in ROM_PATTERNS
+                  for path in glob.glob(os.path.join(args.corpus, pattern)))
+    if not roms:
+        print(f"No ROMs found in {args.corpus}")
+        return 1
+    golden_dir = args.golden or os.path.join(args.corpus, "golden")
+    core_class = load_core_class()
+    failed = 0
+    for rom_path in roms:
+        if not check_rom(core_class, rom_path, golden_dir, args.frames, args.interval, args.update,
+                         args.capture):
+            failed += 1
+    print(f"{len(roms) - failed}/{len(roms)} passed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+import re
+import zlib
+from collections import deque
+
+from memory import chunk_size
+
+# Rewind history
+#
+# Frames are recorded as snapshots: lists of (chunk id, payload) where the
+# payload is either bytes or, for paged RAM, a tuple of copy-on-write pages
+# (see memory.PagedMemory). Every frame is stored as the XOR against the
+# most recent keyframe, run-length coded so that only the changed spans are
+# kept; pages still shared by reference with the keyframe are skipped
+# without being compared at all. A frame that touched a few hundred bytes
+# of RAM costs a few hundred bytes. A full keyframe is taken every
+# `keyframe_interval` frames and zlib-packed once its group is complete.
+# Entries are grouped by keyframe and whole groups are evicted oldest-first
+# once the history exceeds its memory budget.
+
+# Changed spans separated by short runs of zeros are merged into one span;
+# each span costs 8 bytes of header, so splitting on tiny gaps doesn't pay.
+_SPANS = re.compile(rb"[^\x00]+(?:\x00{1,8}[^\x00]+)*")
+
+SPAN_OVERHEAD = 8  # Approximate bookkeeping cost per stored span
+
+
+def xor_bytes(a, b):
+    """XOR two equal-length byte strings."""
+    n = len(a)
+    return (int.from_bytes(a, "little") ^ int.from_bytes(b, "little")).to_bytes(n, "little")
+
+
+def encode_delta(state, keyframe):
+    """Return [(offset, xor bytes)] spans where state differs from keyframe."""
+    diff = xor_bytes(state, keyframe)
+    return [(m.start(), m.group()) for m in _SPANS.finditer(diff)]
+
+
+def apply_delta(keyframe, spans):
+    """Rebuild a state from its keyframe and delta spans."""
+    state = bytearray(keyframe)
+    for offset, data in spans:
+        end = offset + len(data)
+        state[offset:end] = xor_bytes(state[offset:end], data)
+    return state
+
+
+def _spans_cost(spans):
+    return sum(len(data) for _, data in spans) + SPAN_OVERHEAD * (len(spans) + 1)
+
+
+def encode_snapshot(snapshot, keyframe):
+    """Delta-code a snapshot against a keyframe snapshot; returns (delta, cost)."""
+    delta = []
+    cost = 0
+    for (chunk_id, payload), (_, base) in zip(snapshot, keyframe):
+        if payload is base:
+            delta.append((chunk_id, None))
+        elif isinstance(payload, tuple):
+            pages = []
+            for page, base_page in zip(payload, base):
+                if page is base_page:
+                    pages.append(None)
+                else:
+                    spans = encode_delta(page, base_page)
+                    cost += _spans_cost(spans)
+                    pages.append(spans)
+            delta.append((chunk_id, pages))
+        elif len(payload) == len(base):
+            spans = encode_delta(payload, base)
+            cost += _spans_cost(spans)
+            delta.append((chunk_id, spans))
+        else:
+            delta.append((chunk_id, bytes(payload)))
+            cost += len(payload)
+    return delta, cost
+
+
+def decode_snapshot(delta, keyframe):
+    """Rebuild the snapshot that encode_snapshot() delta-coded."""
+    snapshot = []
+    for (chunk_id, coded), (_, base) in zip(delta, keyframe):
+        if coded is None:
+            snapshot.append((chunk_id, base))
+        elif isinstance(coded, bytes):
+            snapshot.append((chunk_id, coded))
+        elif isinstance(base, tuple):
+            snapshot.append((chunk_id, tuple(
+                base_page if spans is None else bytes(apply_delta(base_page, spans))
+                for spans, base_page in zip(coded, base))))
+        else:
+            snapshot.append((chunk_id, bytes(apply_delta(base, coded))))
+    return snapshot
+
+
+def _same_layout(snapshot, keyframe):
+    return len(snapshot) == len(keyframe) and all(
+        chunk_id == base_id and isinstance(payload, tuple) == isinstance(base, tuple) and
+        (len(payload) == len(base) if isinstance(payload, tuple) else True)
+        for (chunk_id, payload), (base_id, base) in zip(snapshot, keyframe))
+
+
+def _pack(snapshot):
+    packed = []
+    for chunk_id, payload in snapshot:
+        if isinstance(payload, tuple):
+            packed.append((chunk_id, tuple(zlib.compress(page, 1) for page in payload)))
+        else:
+            packed.append((chunk_id, zlib.compress(payload, 1)))
+    return packed
+
+
+def _unpack(packed):
+    snapshot = []
+    for chunk_id, payload in packed:
+        if isinstance(payload, tuple):
+            snapshot.append((chunk_id, tuple(zlib.decompress(page) for page in payload)))
+        else:
+            snapshot.append((chunk_id, zlib.decompress(payload)))
+    return snapshot
+
+
+def as_snapshot(state):
+    """Wrap a flat state (e.g. bytes from a serializer) as a one-chunk snapshot."""
+    return [(b"DATA", bytes(state))]
+
+
+class _Group:
+    __slots__ = ("raw", "packed", "deltas", "size")
+
+    def __init__(self, keyframe):
+        self.raw = keyframe
+        self.packed = None
+        self.deltas = []
+        self.size = sum(chunk_size(payload) for _, payload in keyframe)
+
+    def keyframe(self):
+        if self.raw is None:
+            self.raw = _unpack(self.packed)
+        return self.raw
+
+    def retire(self):
+        """Pack the keyframe once the group stops receiving frames; returns the size change."""
+        if self.packed is None:
+            self.packed = _pack(self.raw)
+        self.raw = None
+        size = sum(chunk_size(payload) for _, payload in self.packed)
+        size += sum(cost for _, cost in self.deltas)
+        change = size - self.size
+        self.size = size
+        return change
+
+
+class RewindBuffer:
+    """Memory-budgeted per-frame snapshot history with delta compression."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, keyframe_interval=60):
+        self.max_bytes = max_bytes
+        self.keyframe_interval = keyframe_interval
+        self.groups = deque()
+        self.size = 0
+
+    def __len__(self):
+        return sum(1 + len(group.deltas) for group in self.groups)
+
+    def clear(self):
+        self.groups.clear()
+        self.size = 0
+
+    def push(self, snapshot):
+        """Record the snapshot of the frame just completed."""
+        group = self.groups[-1] if self.groups else None
+        if (group is None or len(group.deltas) + 1 >= self.keyframe_interval or
+                not _same_layout(snapshot, group.keyframe())):
+            if group is not None:
+                self.size += group.retire()
+            group = _Group(snapshot)
+            self.groups.append(group)
+            self.size += group.size
+        else:
+            delta, cost = encode_snapshot(snapshot, group.keyframe())
+            group.deltas.append((delta, cost))
+            group.size += cost
+            self.size += cost
+        while self.size > self.max_bytes and len(self.groups) > 1:
+            self.size -= self.groups.popleft().size
+
+    def pop(self):
+        """Remove and return the newest snapshot, or None when history is empty."""
+        if not self.groups:
+            return None
+        group = self.groups[-1]
+        if group.deltas:
+            delta, cost = group.deltas.pop()
+            group.size -= cost
+            self.size -= cost
+            return decode_snapshot(delta, group.keyframe())
+        self.groups.pop()
+        self.size -= group.size
+        return group.keyframe()
@@ -0,0 +1,100 @@
+import os
+import struct
+
+# Header-only SNES ROM metadata
+#
+# The cartridge header sits at $7FC0 (LoROM), $FFC0 (HiROM) or $40FFC0
+# (ExHiROM) in the ROM image, 512 bytes further in when a copier header
+# is present (file size = 512 mod 1024). read_header() reads just the 64
+# bytes at each candidate with pread (seek + read where pread is missing)
+# and picks the one that looks most like a real header, so listing a
+# folder never reads a ROM in full.
+#
+#   +00 title (21 bytes)  +15 map mode  +16 chipset  +17 ROM size (1KB << n)
+#   +18 SRAM size (1KB << n, 0 = none)  +19 region  +1C checksum complement
+#   +1E checksum          +3C reset vector
+
+COPIER_HEADER = 512
+HEADER_SIZE = 0x40
+CANDIDATES = (("LoROM", 0x7FC0), ("HiROM", 0xFFC0), ("ExHiROM", 0x40FFC0))
+_LAYOUT = struct.Struct("<21sBBBBBBBHH28xH2x")
+
+REGIONS = {
+    0x00: "Japan", 0x01: "North America", 0x02: "Europe", 0x03: "Sweden",
+    0x04: "Finland", 0x05: "Denmark", 0x06: "France", 0x07: "Netherlands",
+    0x08: "Spain", 0x09: "Germany", 0x0A: "Italy", 0x0B: "China",
+    0x0C: "Indonesia", 0x0D: "South Korea", 0x0E: "International",
+    0x0F: "Canada", 0x10: "Brazil", 0x11: "Australia",
+}
+
+
+def _pread(f, size, offset):
+    if hasattr(os, "pread"):
+        return os.pread(f.fileno(), size, offset)
+    f.seek(offset)
+    return f.read(size)
+
+
+def _score(mapping, fields):
+    """How much a 64-byte candidate looks like a real header."""
+    title, map_mode, _, rom_size, sram_size, region, _, _, complement, checksum, reset = fields
+    score = 0
+    if complement ^ checksum == 0xFFFF:
+        score += 4
+    if reset >= 0x8000:  # Code runs from the upper half of a bank
+        score += 2
+    if (map_mode & 0x01 == 1) == (mapping != "LoROM") and map_mode & 0xE0 == 0x20:
+        score += 2
+    if 0x07 <= rom_size <= 0x0D:
+        score += 1
+    if sram_size <= 0x08 and region in REGIONS:
+        score += 1
+    if all(0x20 <= c < 0x7F for c in title.rstrip(b"\0")):
+        score += 1
+    return score
+
+
+def read_header(path):
+    """Metadata dict from the best header candidate, or None if nothing fits."""
+    with open(path, "rb") as f:
+        return _parse(os.fstat(f.fileno()).st_size, lambda offset: _pread(f, HEADER_SIZE, offset))
+
+
+def parse_header(data):
+    """read_header() for a ROM image already in memory (bytes, mmap, ...)."""
+    return _parse(len(data), lambda offset: bytes(data[offset:offset + HEADER_SIZE]))
+
+
+def _parse(size, read):
+    skip = COPIER_HEADER if size % 1024 == COPIER_HEADER else 0
+    best = None
+    for mapping, offset in CANDIDATES:
+        if skip + offset + HEADER_SIZE > size:
+            continue
+        data = read(skip + offset)
+        if len(data) < HEADER_SIZE:
+            continue
+        fields = _LAYOUT.unpack(data)
+        score = _score(mapping, fields)
+        if best is None or score > best[0]:
+            best = (score, mapping, skip + offset, fields)
+    if best is None or best[0] < 3:
+        return None
+    score, mapping, offset, fields = best
+    title, map_mode, chipset, rom_size, sram_size, region, developer, version, \
+        complement, checksum, reset = fields
+    return {
+        "title": title.rstrip(b"\0 ").decode("ascii", "replace").strip(),
+        "mapping": mapping,
+        "map_mode": map_mode,
+        "fast_rom": bool(map_mode & 0x10),
+        "chipset": chipset,
+        "rom_size": 1024 << rom_size if rom_size < 16 else 0,
+        "sram_size": 1024 << sram_size if 0 < sram_size < 16 else 0,
+        "region": REGIONS.get(region, f"Unknown ({region:#04x})"),
+        "version": version,
+        "checksum": checksum,
+        "checksum_valid": complement ^ checksum == 0xFFFF,
+        "header_offset": offset,
+        "copier_header": bool(skip),
+    }
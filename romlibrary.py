@@ -0,0 +1,321 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from romheader import read_header
+
+# Indexed ROM library
+#
+# RomLibrary keeps a SQLite index of every ROM under the configured
+# directories, keyed by path with the size and mtime it was indexed at. A
+# scan walks the directories with os.scandir (whose entries carry their
+# stat results), compares against the index in memory, and only touches
+# files that are new or changed. Those get their internal header read
+# first (64 bytes per candidate, see romheader) so the listing is complete
+# quickly, then are hashed (CRC32 and SHA-1) on a thread pool, since both
+# hash functions release the GIL on large buffers. Results are written in
+# batches, so a rescan of tens of thousands of unchanged files is a
+# directory walk and one query. The same database backs the Recent ROMs
+# list.
+
+ROM_EXTENSIONS = (".sfc", ".smc")
+DEFAULT_DB = os.path.join(os.path.expanduser("~"), ".emusnes", "library.sqlite")
+HASH_CHUNK = 1024 * 1024
+BATCH_SIZE = 256  # Files per database transaction
+RECENT_LIMIT = 10
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS roms (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    crc32 INTEGER,
+    sha1 TEXT
+);
+CREATE TABLE IF NOT EXISTS headers (
+    path TEXT PRIMARY KEY REFERENCES roms (path) ON DELETE CASCADE,
+    title TEXT,
+    mapping TEXT,
+    region TEXT,
+    rom_size INTEGER,
+    sram_size INTEGER,
+    checksum INTEGER,
+    checksum_valid INTEGER
+);
+CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS recent (path TEXT PRIMARY KEY, opened REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS roms_crc32 ON roms (crc32);
+"""
+
+
+def hash_file(path):
+    """(CRC32, SHA-1 hex digest) of a file, read in chunks."""
+    crc = 0
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+            sha1.update(chunk)
+    return crc, sha1.hexdigest()
+
+
+def walk_roms(directory):
+    """Yield (path, size, mtime) for every ROM below a directory."""
+    pending = [directory]
+    while pending:
+        try:
+            with os.scandir(pending.pop()) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif entry.name.lower().endswith(ROM_EXTENSIONS) and entry.is_file():
+                            st = entry.stat()
+                            yield entry.path, st.st_size, st.st_mtime
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+
+class RomLibrary:
+    """SQLite-backed ROM index and recent list; safe to use from several threads."""
+
+    def __init__(self, db_path=DEFAULT_DB):
+        self.db_path = db_path
+        try:
+            self.db = self._open(db_path)
+        except (OSError, sqlite3.Error):
+            self.db = self._open(":memory:")  # Unwritable home: index for this session only
+        self._lock = threading.Lock()
+        self._scan_thread = None
+
+    @staticmethod
+    def _open(db_path):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(db_path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA foreign_keys=ON")
+        db.executescript(_SCHEMA)
+        db.commit()
+        return db
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+    def _query(self, sql, args=()):
+        with self._lock:
+            return self.db.execute(sql, args).fetchall()
+
+    def _write(self, sql, args=(), many=False):
+        with self._lock:
+            if many:
+                self.db.executemany(sql, args)
+            else:
+                self.db.execute(sql, args)
+            self.db.commit()
+
+    def directories(self):
+        return [row[0] for row in self._query("SELECT path FROM directories ORDER BY path")]
+
+    def add_directory(self, path):
+        self._write("INSERT OR IGNORE INTO directories VALUES (?)", (os.path.abspath(path),))
+
+    def remove_directory(self, path):
+        """Stop watching a directory and forget the ROMs found under it."""
+        path = os.path.abspath(path)
+        self._write("DELETE FROM directories WHERE path = ?", (path,))
+        self._write("DELETE FROM roms WHERE path LIKE ? ESCAPE '\\'",
+                    (_like_prefix(path),))
+
+    def scan(self, workers=None, progress=None, listed=None):
+        """Bring the index up to date; returns (ROMs found, files hashed, entries removed).
+
+        New and changed files are listed (with their header metadata) before
+        any is hashed; listed() is called at that point. progress(done,
+        total) is called from the scanning thread as files are hashed.
+        """
+        known = {path: (size, mtime) for path, size, mtime in
+                 self._query("SELECT path, size, mtime FROM roms")}
+        seen = set()
+        changed = []
+        reachable = []
+        for directory in self.directories():
+            try:
+                os.scandir(directory).close()
+            except OSError:
+                continue  # Unmounted drive or share: keep its entries until it is back
+            reachable.append(directory)
+            for path, size, mtime in walk_roms(directory):
+                seen.add(path)
+                if known.get(path) != (size, mtime):
+                    changed.append((path, size, mtime))
+        # Unchanged rows missing a header (indexed by an older version) or
+        # a hash (an interrupted scan)
+        stale = {path for path, in self._query("SELECT path FROM roms LEFT JOIN headers "
+                                               "USING (path) WHERE headers.path IS NULL")}
+        changed_paths = {path for path, _, _ in changed}
+        stale_headers = [(path,) + known[path] for path in sorted(stale)
+                         if path in seen and path not in changed_paths]
+        unhashed = [(path,) + known[path] for path, in
+                    self._query("SELECT path FROM roms WHERE crc32 IS NULL")
+                    if path in seen]
+        hashed = 0
+        with ThreadPoolExecutor(max_workers=workers or min(8, (os.cpu_count() or 1) * 2),
+                                thread_name_prefix="rom-scan") as pool:
+            # Headers first: a few small reads per file, so the listing fills quickly
+            for items, reset in ((changed, True), (stale_headers, False)):
+                batch = []
+                for item, header in zip(items, pool.map(_try_header, items)):
+                    batch.append((item, header))
+                    if len(batch) >= BATCH_SIZE:
+                        self._store_headers(batch, reset)
+                        batch = []
+                self._store_headers(batch, reset)
+            if listed:
+                listed()
+            pending = changed + [item for item in unhashed if item[0] not in changed_paths]
+            batch = []
+            for (path, size, mtime), digest in zip(pending, pool.map(_try_hash, pending)):
+                if digest is not None:
+                    batch.append(digest + (path, size, mtime))
+                hashed += 1
+                if len(batch) >= BATCH_SIZE:
+                    self._store_hashes(batch)
+                    batch = []
+                if progress:
+                    progress(hashed, len(pending))
+            self._store_hashes(batch)
+        # Files that vanished from a reachable watched directory (ROMs outside
+        # them stay)
+        roots = [os.path.join(d, "") for d in reachable]
+        removed = [(path,) for path in known if path not in seen and path.startswith(tuple(roots))]
+        if removed:
+            self._write("DELETE FROM roms WHERE path = ?", removed, many=True)
+        return len(seen), hashed, len(removed)
+
+    def _store_headers(self, batch, reset=True):
+        """Store header metadata; with reset, (re)create the ROM rows without hashes."""
+        if not batch:
+            return
+        with self._lock:
+            if reset:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO roms (path, size, mtime) VALUES (?, ?, ?)",
+                    [row for row, _ in batch])
+            self.db.executemany(
+                "INSERT OR REPLACE INTO headers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(row[0],) + _header_row(header) for row, header in batch])
+            self.db.commit()
+
+    def _store_hashes(self, batch):
+        """Fill in hashes for rows whose file hasn't changed since it was hashed."""
+        if batch:
+            self._write("UPDATE roms SET crc32 = ?, sha1 = ? "
+                        "WHERE path = ? AND size = ? AND mtime = ?", batch, many=True)
+
+    def scan_async(self, done=None, progress=None, listed=None):
+        """Scan on a background thread unless one is running; done(result) when finished."""
+        if self._scan_thread is not None and self._scan_thread.is_alive():
+            return False
+
+        def run():
+            result = self.scan(progress=progress, listed=listed)
+            if done:
+                done(result)
+        self._scan_thread = threading.Thread(target=run, name="rom-scan", daemon=True)
+        self._scan_thread.start()
+        return True
+
+    def index_file(self, path):
+        """Add or refresh one ROM (e.g. opened by hand); returns its row or None."""
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        row = self.lookup(path)
+        if row is None or (row["size"], row["mtime"]) != (st.st_size, st.st_mtime) or \
+                row["crc32"] is None:
+            item = (path, st.st_size, st.st_mtime)
+            self._store_headers([(item, _try_header(item))])
+            self._store_hashes([hash_file(path) + item])
+            row = self.lookup(path)
+        return row
+
+    def lookup(self, path):
+        """Index row of a ROM (hashes plus header fields), or None."""
+        rows = self._query(f"SELECT {', '.join(_COLUMNS)} FROM roms LEFT JOIN headers "
+                           "USING (path) WHERE path = ?", (os.path.abspath(path),))
+        if not rows:
+            return None
+        return dict(zip(_COLUMNS, rows[0]))
+
+    def find_crc(self, crc):
+        """Paths of ROMs with a given CRC32 (e.g. to spot duplicates)."""
+        return [row[0] for row in self._query("SELECT path FROM roms WHERE crc32 = ?", (crc,))]
+
+    def roms(self, search=""):
+        """(path, header title) of indexed ROMs, filtered by a substring of either
+        the file name or the title."""
+        rows = self._query("SELECT path, title FROM roms LEFT JOIN headers USING (path)")
+        rows.sort(key=lambda row: (row[1] or os.path.basename(row[0])).lower())
+        if search:
+            search = search.lower()
+            rows = [row for row in rows if search in os.path.basename(row[0]).lower()
+                    or search in (row[1] or "").lower()]
+        return rows
+
+    def add_recent(self, path, limit=RECENT_LIMIT):
+        path = os.path.abspath(path)
+        with self._lock:
+            self.db.execute("INSERT OR REPLACE INTO recent VALUES (?, ?)", (path, time.time()))
+            self.db.execute("DELETE FROM recent WHERE path NOT IN "
+                            "(SELECT path FROM recent ORDER BY opened DESC LIMIT ?)", (limit,))
+            self.db.commit()
+
+    def recent(self, limit=RECENT_LIMIT):
+        """Most recently opened ROMs that still exist, newest first."""
+        rows = self._query("SELECT path FROM recent ORDER BY opened DESC LIMIT ?", (limit,))
+        return [row[0] for row in rows if os.path.isfile(row[0])]
+
+
+_COLUMNS = ("path", "size", "mtime", "crc32", "sha1", "title", "mapping", "region",
+            "rom_size", "sram_size", "checksum", "checksum_valid")
+
+
+def _header_row(header):
+    if header is None:
+        return (None,) * 7
+    return (header["title"], header["mapping"], header["region"], header["rom_size"],
+            header["sram_size"], header["checksum"], int(header["checksum_valid"]))
+
+
+def _try_header(item):
+    try:
+        return read_header(item[0])
+    except OSError:
+        return None
+
+
+def _try_hash(item):
+    try:
+        return hash_file(item[0])
+    except OSError:
+        return None  # Unreadable or gone since the walk
+
+
+def _like_prefix(path):
+    """LIKE pattern matching everything inside a directory."""
+    escaped = path.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + ("\\\\" if os.sep == "\\" else os.sep) + "%"
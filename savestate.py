@@ -0,0 +1,384 @@
+import json
+import lzma
+import os
+import queue
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+from memory import chunk_size
+
+# Versioned, chunked save-state format
+#
+#   header  magic "S9XS", format version, chunk count
+#   chunk   4-byte id, payload length, payload (repeated)
+#
+# Each subsystem contributes its own chunks (CPU registers, work RAM, ROM
+# identity, SPC700, DSP, APU RAM), so a chunk is exactly the size of the
+# state it holds. Readers skip chunk ids they do not know, which lets newer
+# versions add chunks without breaking older states. States are built in a
+# single preallocated buffer and parsed into memoryviews over the file data,
+# so RAM is copied once on save and once on load.
+
+STATE_MAGIC = b"S9XS"
+STATE_VERSION = 1
+STATE_EXTENSION = ".s9xs"
+
+_HEADER = struct.Struct("<4sHH")
+_CHUNK = struct.Struct("<4sI")
+
+# Compressed container written by SaveStateWriter: magic, codec, level,
+# uncompressed length, then the compressed state.
+COMPRESSED_MAGIC = b"S9XZ"
+CODECS = {"none": 0, "zlib": 1, "lzma": 2}
+_COMPRESSED = struct.Struct("<4sBBI")
+
+# Thumbnails are stored as the first chunk of a state so a slot browser can
+# pull one out by decompressing only the first few KB of the file.
+THUMB_ID = b"THMB"
+THUMB_SCALE = 4  # 256x224 frame -> 64x56 thumbnail
+_THUMB = struct.Struct("<HH")
+
+
+class SaveStateError(Exception):
+    pass
+
+
+def dumps(core):
+    """Serialize core.state_chunks() into a new bytearray."""
+    return dump_chunks(core.state_chunks())
+
+
+def dump_chunks(chunks):
+    """Serialize (id, payload) chunks; payloads may be page tuples from a snapshot."""
+    size = _HEADER.size + sum(_CHUNK.size + chunk_size(payload) for _, payload in chunks)
+    buf = bytearray(size)
+    _HEADER.pack_into(buf, 0, STATE_MAGIC, STATE_VERSION, len(chunks))
+    view = memoryview(buf)
+    offset = _HEADER.size
+    for chunk_id, payload in chunks:
+        _CHUNK.pack_into(buf, offset, chunk_id, chunk_size(payload))
+        offset += _CHUNK.size
+        for part in payload if isinstance(payload, tuple) else (payload,):
+            view[offset:offset + len(part)] = part
+            offset += len(part)
+    return buf
+
+
+def read_chunks(data):
+    """Parse a state into {chunk id: memoryview} without copying payloads."""
+    view = memoryview(data)
+    if len(view) < _HEADER.size:
+        raise SaveStateError("State is truncated")
+    magic, version, count = _HEADER.unpack_from(view, 0)
+    if magic != STATE_MAGIC:
+        raise SaveStateError("Not a save state")
+    if version > STATE_VERSION:
+        raise SaveStateError(f"State version {version} is newer than this emulator")
+    chunks = {}
+    offset = _HEADER.size
+    for _ in range(count):
+        if offset + _CHUNK.size > len(view):
+            raise SaveStateError("State is truncated")
+        chunk_id, length = _CHUNK.unpack_from(view, offset)
+        offset += _CHUNK.size
+        if offset + length > len(view):
+            raise SaveStateError("State is truncated")
+        chunks[chunk_id] = view[offset:offset + length]
+        offset += length
+    return chunks
+
+
+def compress_state(data, codec="zlib", level=6):
+    """Wrap a serialized state in the compressed container."""
+    if codec == "zlib":
+        payload = zlib.compress(data, level)
+    elif codec == "lzma":
+        payload = lzma.compress(data, preset=level)
+    elif codec == "none":
+        payload = data
+    else:
+        raise ValueError(f"Unknown codec {codec!r}")
+    return _COMPRESSED.pack(COMPRESSED_MAGIC, CODECS[codec], level, len(data)) + payload
+
+
+def decompress_state(data):
+    """Return the raw state from a compressed container, or data unchanged."""
+    view = memoryview(data)
+    if bytes(view[:4]) != COMPRESSED_MAGIC:
+        return data
+    _, codec, _, length = _COMPRESSED.unpack_from(view, 0)
+    payload = view[_COMPRESSED.size:]
+    try:
+        if codec == CODECS["zlib"]:
+            raw = zlib.decompress(payload)
+        elif codec == CODECS["lzma"]:
+            raw = lzma.decompress(payload)
+        elif codec == CODECS["none"]:
+            raw = payload
+        else:
+            raise SaveStateError(f"Unknown state codec {codec}")
+    except (zlib.error, lzma.LZMAError) as e:
+        raise SaveStateError(f"State is corrupt: {e}") from None
+    if len(raw) != length:
+        raise SaveStateError("State is truncated")
+    return raw
+
+
+def make_thumbnail(frame_buffer, width, height, scale=THUMB_SCALE):
+    """Downscale a 0xRRGGBB frame buffer by point sampling; returns THMB chunk bytes."""
+    thumb_w, thumb_h = width // scale, height // scale
+    out = bytearray(_THUMB.size + thumb_w * thumb_h * 3)
+    _THUMB.pack_into(out, 0, thumb_w, thumb_h)
+    offset = _THUMB.size
+    for y in range(0, thumb_h * scale, scale):
+        row = y * width
+        for x in range(row, row + thumb_w * scale, scale):
+            color = frame_buffer[x]
+            out[offset] = color >> 16 & 0xFF
+            out[offset + 1] = color >> 8 & 0xFF
+            out[offset + 2] = color & 0xFF
+            offset += 3
+    return bytes(out)
+
+
+def parse_thumbnail(chunk):
+    """Return (width, height, RGB bytes) from THMB chunk bytes."""
+    width, height = _THUMB.unpack_from(chunk, 0)
+    return width, height, bytes(chunk[_THUMB.size:_THUMB.size + width * height * 3])
+
+
+def read_thumbnail(path):
+    """Read a state's thumbnail without loading or decompressing the whole file.
+
+    Returns (width, height, RGB bytes), or None if the state has none.
+    """
+    with open(path, "rb") as f:
+        head = f.read(_COMPRESSED.size)
+        if head[:4] == COMPRESSED_MAGIC:
+            codec = head[4]
+            if codec == CODECS["zlib"]:
+                stream = zlib.decompressobj()
+            elif codec == CODECS["lzma"]:
+                stream = lzma.LZMADecompressor()
+            else:
+                stream = None
+            prefix = b""
+        else:
+            stream = None
+            prefix = head
+        data = bytearray(prefix)
+        needed = _HEADER.size + _CHUNK.size + _THUMB.size
+        while len(data) < needed:
+            block = f.read(4096)
+            if not block:
+                return None
+            data += stream.decompress(block) if stream else block
+            if len(data) >= _HEADER.size + _CHUNK.size:
+                magic, _, count = _HEADER.unpack_from(data, 0)
+                chunk_id, length = _CHUNK.unpack_from(data, _HEADER.size)
+                if magic != STATE_MAGIC or not count or chunk_id != THUMB_ID:
+                    return None
+                needed = _HEADER.size + _CHUNK.size + length
+    return parse_thumbnail(memoryview(data)[_HEADER.size + _CHUNK.size:needed])
+
+
+def write_atomic(path, data):
+    """Write data to a temp file beside path, then rename it into place."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def loads(core, data):
+    """Restore core from a state produced by dumps() (optionally compressed)."""
+    data = decompress_state(data)
+    try:
+        core.load_state_chunks(read_chunks(data))
+    except KeyError as e:
+        raise SaveStateError(f"State is missing chunk {e.args[0]!r}") from None
+
+
+class SlotIndex:
+    """Small JSON file listing the states of one ROM.
+
+    Slot pickers read it instead of opening every state; entries hold the
+    save time, file size and codec. Updates come from the writer thread and
+    the Tk thread, hence the lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def entries(self):
+        with self._lock:
+            return dict(self._load())
+
+    def update(self, slot, **info):
+        with self._lock:
+            self._load()[str(slot)] = info
+            write_atomic(self.path, json.dumps(self._entries, indent=1).encode("utf-8"))
+
+    def remove(self, slot):
+        with self._lock:
+            if self._load().pop(str(slot), None) is not None:
+                write_atomic(self.path, json.dumps(self._entries, indent=1).encode("utf-8"))
+
+
+class SaveSlots:
+    """Numbered save-state files for one ROM, kept in a states/ folder beside it."""
+
+    def __init__(self, rom_path, directory=None, slots=10):
+        self.rom_path = rom_path
+        self.directory = directory or os.path.join(os.path.dirname(os.path.abspath(rom_path)),
+                                                   "states")
+        self.slots = slots
+        self.name = os.path.splitext(os.path.basename(rom_path))[0]
+        self._buffer = bytearray()
+        self.index = SlotIndex(os.path.join(self.directory, f"{self.name}.index.json"))
+
+    def path(self, slot):
+        return os.path.join(self.directory, f"{self.name}.{slot}{STATE_EXTENSION}")
+
+    def exists(self, slot):
+        return os.path.isfile(self.path(slot))
+
+    def used_slots(self):
+        return [slot for slot in range(self.slots) if self.exists(slot)]
+
+    def list_slots(self):
+        """Return {slot: info} from the index, dropping entries whose file is gone."""
+        entries = self.index.entries()
+        try:
+            present = set(os.listdir(self.directory))
+        except OSError:
+            return {}
+        listed = {}
+        for slot, info in entries.items():
+            if os.path.basename(self.path(slot)) in present:
+                listed[int(slot) if slot.isdigit() else slot] = info
+        return listed
+
+    def thumbnail(self, slot):
+        """Read the slot's thumbnail as (width, height, RGB bytes), or None."""
+        try:
+            return read_thumbnail(self.path(slot))
+        except (OSError, EOFError, zlib.error, lzma.LZMAError, struct.error):
+            return None
+
+    def save_async(self, core, slot, writer, callback=None):
+        """Snapshot the core now and let writer compress and store it.
+
+        The thumbnail is built on the writer thread from the frame buffer as
+        it is now; render_frame() replaces the buffer rather than mutating it.
+        """
+        frame = getattr(core, "frame_buffer", None)
+        thumbnail = (frame, core.frame_width, core.frame_height) if frame else None
+        codec = writer.codec  # What submit() below compresses with
+
+        def written(path, size, seconds, error):
+            if not error:
+                try:
+                    self.index.update(slot, time=time.time(), size=size, codec=codec)
+                except OSError as e:
+                    error = e
+            if callback:
+                callback(path, size, seconds, error)
+
+        writer.submit(self.path(slot), core.snapshot(), written, thumbnail)
+
+    def save(self, core, slot):
+        """Write the core's state to a slot; returns the state size in bytes."""
+        chunks = core.state_chunks()
+        frame = getattr(core, "frame_buffer", None)
+        if frame:
+            chunks = [(THUMB_ID, make_thumbnail(frame, core.frame_width, core.frame_height))] + chunks
+        data = dump_chunks(chunks)
+        write_atomic(self.path(slot), data)
+        self.index.update(slot, time=time.time(), size=len(data), codec="none")
+        return len(data)
+
+    def load(self, core, slot):
+        """Read a slot into a reused buffer and restore the core from it."""
+        path = self.path(slot)
+        size = os.path.getsize(path)
+        if len(self._buffer) != size:
+            self._buffer = bytearray(size)
+        with open(path, "rb") as f:
+            if f.readinto(self._buffer) != size:
+                raise SaveStateError("State is truncated")
+        loads(core, self._buffer)
+
+
+class SaveStateWriter:
+    """Background thread that compresses snapshots and writes them atomically.
+
+    submit() only queues an immutable snapshot (see Snes9xCore.snapshot), so
+    the frame loop never waits on serialization, compression or disk I/O.
+    The callback runs on the writer thread as callback(path, size, seconds,
+    error); GUI callers must hand the result back to their own thread.
+    """
+
+    def __init__(self, codec="zlib", level=6):
+        self.codec = codec
+        self.level = level
+        self.jobs = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="savestate-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, path, snapshot, callback=None, thumbnail=None):
+        """Queue a snapshot; thumbnail is an optional (frame buffer, width, height).
+
+        The codec and level in effect now are the ones the job is written with.
+        """
+        self.jobs.put((path, snapshot, callback, thumbnail, self.codec, self.level))
+
+    def flush(self):
+        """Block until every queued state has been written."""
+        self.jobs.join()
+
+    def _run(self):
+        while True:
+            path, snapshot, callback, thumbnail, codec, level = self.jobs.get()
+            try:
+                start = time.perf_counter()
+                size, error = 0, None
+                try:
+                    if thumbnail:
+                        snapshot = [(THUMB_ID, make_thumbnail(*thumbnail))] + list(snapshot)
+                    data = compress_state(dump_chunks(snapshot), codec, level)
+                    write_atomic(path, data)
+                    size = len(data)
+                except Exception as e:  # Reported to the caller; the writer keeps going
+                    error = e
+                if callback:
+                    callback(path, size, time.perf_counter() - start, error)
+            except Exception:
+                pass  # A failing callback must not stop later jobs
+            finally:
+                self.jobs.task_done()
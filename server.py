@@ -0,0 +1,619 @@
+import argparse
+import itertools
+import mmap
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from collections import deque
+from multiprocessing.connection import Client, Listener
+
+from libretro import Core, LibretroError, frame_image
+from regress import load_core_class, scripted_input
+from stream import StreamError, StreamServer, publish_sessions
+
+# Headless multi-session emulation server
+#
+# Hosts many independent core instances (Snes9xCore, the fallback
+# CustomSNESCore or any libretro core) spread over a pool of worker
+# processes. Each worker maps a ROM file once and every session of that
+# ROM in the worker reads the same mapping; since the mapping is backed by
+# the page cache, workers share the physical pages too. Sessions never
+# touch the player's .srm files.
+#
+# Clients talk to the server over a local socket (a Unix socket, or a
+# named pipe on Windows) with multiprocessing.connection: requests are
+# tuples such as ("step", session, frames) and every reply is ("ok", value)
+# or ("error", message). SessionClient wraps the protocol. Workers time
+# every frame and record their resident memory around session creation,
+# so stats() reports per-step latency and per-instance memory overhead;
+# --bench prints both for N sessions. With --stream, viewers can watch
+# any session through stream.StreamServer (channel = session id).
+#
+# A libretro core keeps its state in library globals, so one process can
+# host only one instance of each core library; extra workers are started
+# when every worker already has the requested core loaded.
+#
+#   python server.py --workers 4              serve on the default address
+#   python server.py --stream 8765            ... and stream sessions to viewers
+#   python server.py --bench 32 --rom game.sfc
+
+CORE_KINDS = ("snes9x", "custom", "libretro")
+CUSTOM_CORE_MODULE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "emusnes5.15.5.v0.a.py")
+LATENCY_SAMPLES = 1024  # Recent frame times kept per session
+# Workers can be started while clients are connected; forked ones would
+# inherit the client sockets and keep them open after the client leaves
+_CONTEXT = multiprocessing.get_context("spawn")
+
+if sys.platform == "win32":
+    DEFAULT_ADDRESS = r"\\.\pipe\emusnes-server"
+else:
+    DEFAULT_ADDRESS = os.path.join(tempfile.gettempdir(), "emusnes-server.sock")
+
+
+class SessionError(Exception):
+    pass
+
+
+def process_rss():
+    """Resident set size of this process in bytes (0 where unknown)."""
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + \
+                [(name, ctypes.c_size_t) for name in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage",
+                    "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage",
+                    "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+
+        counters = PROCESS_MEMORY_COUNTERS(cb=ctypes.sizeof(PROCESS_MEMORY_COUNTERS))
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters),
+                                                    counters.cb):
+            return counters.WorkingSetSize
+        return 0
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * mmap.PAGESIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def rgb_from_pixels(pixels):
+    """Packed RGB24 bytes from a list of 0xRRGGBB ints (Snes9xCore.frame_buffer)."""
+    data = array("I", pixels).tobytes()  # Little-endian B, G, R, X
+    rgb = bytearray(len(pixels) * 3)
+    rgb[0::3] = data[2::4]
+    rgb[1::3] = data[1::4]
+    rgb[2::3] = data[0::4]
+    return bytes(rgb)
+
+
+class Session:
+    """One headless core instance inside a worker."""
+
+    def __init__(self, kind, core, rom_path, memory):
+        self.kind = kind
+        self.core = core
+        self.rom_path = rom_path
+        self.memory = memory  # Resident bytes added by creating the session
+        self.frames = 0
+        self.seconds = 0.0
+        self.step_times = deque(maxlen=LATENCY_SAMPLES)
+
+    def set_input_mask(self, mask):
+        for button in range(16):
+            self.core.set_input_state(button, mask >> button & 1)
+
+    def step(self, frames):
+        """Run frames; returns the seconds spent inside the core."""
+        run = self.core.run
+        times = self.step_times
+        clock = time.perf_counter
+        total = 0.0
+        for _ in range(frames):
+            start = clock()
+            run()
+            elapsed = clock() - start
+            times.append(elapsed)
+            total += elapsed
+        self.frames += frames
+        self.seconds += total
+        return total
+
+    def frame(self):
+        """(width, height, RGB24 bytes) of the current frame."""
+        core = self.core
+        if self.kind == "snes9x":
+            core.render_frame()
+            return core.frame_width, core.frame_height, rgb_from_pixels(core.frame_buffer)
+        frame = core.get_video_frame()
+        if frame is None:
+            return core.frame_width, core.frame_height, b""
+        if self.kind == "custom":
+            return core.frame_width, core.frame_height, bytes(frame)
+        return core.frame_width, core.frame_height, frame_image(core, frame).tobytes()
+
+    def stats(self):
+        times = sorted(self.step_times)
+        return {
+            "kind": self.kind,
+            "rom": os.path.basename(self.rom_path),
+            "frames": self.frames,
+            "memory": self.memory,
+            "mean_ms": self.seconds / self.frames * 1000 if self.frames else 0.0,
+            "p99_ms": times[int(len(times) * 0.99)] * 1000 if times else 0.0,
+            "max_ms": times[-1] * 1000 if times else 0.0,
+        }
+
+    def close(self):
+        if hasattr(self.core, "close"):
+            self.core.close()
+
+
+class _Worker:
+    """Worker process state: sessions plus one shared mapping per ROM."""
+
+    def __init__(self):
+        self.sessions = {}
+        self.roms = {}  # Path -> [mmap, sessions using it]
+        self.classes = {}
+
+    def map_rom(self, path):
+        entry = self.roms.get(path)
+        if entry is None:
+            with open(path, "rb") as f:
+                # Copy-on-write so libretro cores can take a pointer to it;
+                # pages stay shared unless a core writes to its ROM
+                entry = self.roms[path] = [mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY), 0]
+        entry[1] += 1
+        return entry[0]
+
+    def unmap_rom(self, path):
+        entry = self.roms[path]
+        entry[1] -= 1
+        if not entry[1]:
+            del self.roms[path]
+            try:
+                entry[0].close()
+            except BufferError:
+                pass  # Still referenced by a closed core; freed with it
+
+    def core_class(self, kind):
+        if kind not in self.classes:
+            if kind == "snes9x":
+                self.classes[kind] = load_core_class()
+            else:
+                self.classes[kind] = load_core_class(CUSTOM_CORE_MODULE, "CustomSNESCore")
+        return self.classes[kind]
+
+    def create(self, session_id, kind, rom_path, core_path):
+        before = process_rss()
+        rom = self.map_rom(rom_path)
+        try:
+            if kind == "libretro":
+                core = Core(core_path)
+                core.load_game(rom_path, rom, battery=False)  # Leave the player's .srm alone
+            elif kind == "snes9x":
+                core = self.core_class(kind)()
+                core.load_game(rom_path, rom, battery=False)
+                core.power_on()
+                core.running = True
+            else:
+                core = self.core_class(kind)()
+                core.load_game(rom_path)  # The fallback core doesn't read ROMs
+        except BaseException:
+            self.unmap_rom(rom_path)
+            raise
+        session = self.sessions[session_id] = Session(kind, core, rom_path, 0)
+        session.memory = process_rss() - before
+        return session.memory
+
+    def destroy(self, session_id):
+        session = self.sessions.pop(session_id)
+        session.close()
+        self.unmap_rom(session.rom_path)
+
+    def handle(self, message):
+        command = message[0]
+        if command == "create":
+            return self.create(*message[1:])
+        if command == "input":
+            self.sessions[message[1]].set_input_mask(message[2])
+        elif command == "step":
+            return self.sessions[message[1]].step(message[2])
+        elif command == "step_many":
+            _, inputs, frames = message
+            for session_id, mask in inputs:
+                session = self.sessions[session_id]
+                if mask is not None:
+                    session.set_input_mask(mask)
+                session.step(frames)
+        elif command == "frame":
+            return self.sessions[message[1]].frame()
+        elif command == "destroy":
+            self.destroy(message[1])
+        elif command == "stats":
+            return process_rss(), {sid: s.stats() for sid, s in self.sessions.items()}
+        else:
+            raise SessionError(f"Unknown command {command!r}")
+        return None
+
+
+def _worker_main(conn):
+    """Child process: serve requests from the server until told to close."""
+    worker = _Worker()
+    try:
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                return
+            if message[0] == "close":
+                conn.send(("ok", None))
+                return
+            try:
+                conn.send(("ok", worker.handle(message)))
+            except KeyError as e:
+                conn.send(("error", f"No session {e.args[0]}"))
+            except (SessionError, LibretroError, OSError, ValueError) as e:
+                conn.send(("error", str(e)))
+            except Exception as e:  # A core bug must not take the other sessions down
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        for session_id in list(worker.sessions):
+            worker.destroy(session_id)
+
+
+class WorkerProcess:
+    """Server-side handle on a worker; one request at a time."""
+
+    def __init__(self):
+        self.conn, child_conn = _CONTEXT.Pipe()
+        self.process = _CONTEXT.Process(target=_worker_main, args=(child_conn,),
+                                        name="emusnes-worker", daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.lock = threading.Lock()
+        self.sessions = set()
+        self.libretro_cores = {}  # Session id -> core library it has loaded
+
+    def send(self, message):
+        try:
+            self.conn.send(message)
+        except OSError:
+            raise SessionError(f"Worker exited (code {self.process.exitcode})") from None
+
+    def reply(self):
+        try:
+            status, value = self.conn.recv()
+        except (EOFError, OSError):
+            raise SessionError(f"Worker exited (code {self.process.exitcode})") from None
+        if status == "error":
+            raise SessionError(value)
+        return value
+
+    def request(self, message):
+        with self.lock:
+            self.send(message)
+            return self.reply()
+
+    def close(self):
+        if self.process.is_alive():
+            try:
+                self.request(("close",))
+            except SessionError:
+                pass
+            self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+
+
+class SessionServer:
+    """Pool of worker processes hosting numbered sessions."""
+
+    def __init__(self, workers=None):
+        self.workers = [WorkerProcess() for _ in range(workers or os.cpu_count() or 1)]
+        self.sessions = {}  # Session id -> WorkerProcess
+        self.lost = {}  # Session id -> why, for sessions whose worker died
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _prune(self):
+        """Replace dead workers and fail their sessions (call with the lock held)."""
+        for index, worker in enumerate(self.workers):
+            if worker.process.is_alive():
+                continue
+            for session_id in worker.sessions:
+                self.sessions.pop(session_id, None)
+                self.lost[session_id] = f"worker exited (code {worker.process.exitcode})"
+            worker.conn.close()
+            self.workers[index] = WorkerProcess()
+
+    def _place(self, kind, core_path):
+        """Least loaded worker that can take the session, starting one if needed."""
+        with self._lock:
+            self._prune()
+            candidates = self.workers
+            if kind == "libretro":
+                candidates = [w for w in self.workers
+                              if core_path not in w.libretro_cores.values()]
+                if not candidates:
+                    candidates = [WorkerProcess()]
+                    self.workers.append(candidates[0])
+            worker = min(candidates, key=lambda w: len(w.sessions))
+            session_id = next(self._ids)
+            worker.sessions.add(session_id)
+            if kind == "libretro":
+                worker.libretro_cores[session_id] = core_path
+            self.sessions[session_id] = worker
+        return session_id, worker
+
+    def _worker(self, session_id):
+        with self._lock:
+            worker = self.sessions.get(session_id)
+            if worker is not None and not worker.process.is_alive():
+                self._prune()
+                worker = None
+            if worker is None:
+                if session_id in self.lost:
+                    raise SessionError(f"Session {session_id} lost: {self.lost[session_id]}")
+                raise SessionError(f"No session {session_id}")
+            return worker
+
+    def create(self, kind, rom_path, core_path=None):
+        """Start a session; returns its id."""
+        if kind not in CORE_KINDS:
+            raise SessionError(f"Unknown core kind {kind!r} (expected one of {', '.join(CORE_KINDS)})")
+        if kind == "libretro" and not core_path:
+            raise SessionError("libretro sessions need a core path")
+        rom_path = os.path.abspath(rom_path)
+        if core_path:
+            core_path = os.path.abspath(core_path)
+        session_id, worker = self._place(kind, core_path)
+        try:
+            worker.request(("create", session_id, kind, rom_path, core_path))
+        except SessionError:
+            self._forget(session_id)
+            raise
+        return session_id
+
+    def _forget(self, session_id):
+        with self._lock:
+            worker = self.sessions.pop(session_id)
+            worker.sessions.discard(session_id)
+            worker.libretro_cores.pop(session_id, None)
+
+    def set_input(self, session_id, mask):
+        self._worker(session_id).request(("input", session_id, mask))
+
+    def step(self, session_id, frames=1):
+        """Run frames; returns the seconds the core spent emulating."""
+        return self._worker(session_id).request(("step", session_id, frames))
+
+    def step_many(self, inputs, frames=1):
+        """Step several sessions in parallel across workers.
+
+        inputs maps session id -> button mask (or None to keep the current
+        input). Returns once every session has run its frames.
+        """
+        groups = {}
+        for session_id, mask in inputs.items():
+            groups.setdefault(self._worker(session_id), []).append((session_id, mask))
+        with self._lock:  # _prune() may replace workers while we group
+            order = {worker: index for index, worker in enumerate(self.workers)}
+        for worker, items in groups.items():
+            if worker not in order:
+                session_id = items[0][0]
+                raise SessionError(f"Session {session_id} lost: "
+                                   f"{self.lost.get(session_id, 'worker exited')}")
+        workers = sorted(groups, key=order.get)  # Fixed lock order
+        for worker in workers:
+            worker.lock.acquire()
+        try:
+            for worker in workers:
+                worker.send(("step_many", groups[worker], frames))
+            errors = []
+            for worker in workers:
+                try:
+                    worker.reply()
+                except SessionError as e:
+                    errors.append(str(e))
+        finally:
+            for worker in workers:
+                worker.lock.release()
+        if errors:
+            raise SessionError("; ".join(errors))
+
+    def frame(self, session_id):
+        """(width, height, RGB24 bytes) of a session's current frame."""
+        return self._worker(session_id).request(("frame", session_id))
+
+    def destroy(self, session_id):
+        with self._lock:
+            if self.lost.pop(session_id, None) is not None:
+                return  # Went with its worker
+        self._worker(session_id).request(("destroy", session_id))
+        self._forget(session_id)
+
+    def stats(self):
+        """Per-worker resident memory and per-session latency and memory."""
+        workers = []
+        with self._lock:
+            self._prune()
+        for worker in list(self.workers):
+            rss, sessions = worker.request(("stats",))
+            workers.append({"pid": worker.process.pid, "rss": rss, "sessions": sessions})
+        return workers
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+
+    def handle_client(self, conn):
+        """Serve one client connection; its sessions end when it disconnects."""
+        owned = set()
+        commands = {
+            "create": self.create, "input": self.set_input, "step": self.step,
+            "step_many": self.step_many, "frame": self.frame, "destroy": self.destroy,
+            "stats": self.stats,
+        }
+        try:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    handler = commands.get(message[0])
+                    if handler is None:
+                        raise SessionError(f"Unknown command {message[0]!r}")
+                    value = handler(*message[1:])
+                    if message[0] == "create":
+                        owned.add(value)
+                    elif message[0] == "destroy":
+                        owned.discard(message[1])
+                    conn.send(("ok", value))
+                except (SessionError, TypeError) as e:
+                    conn.send(("error", str(e)))
+        finally:
+            for session_id in owned:
+                try:
+                    self.destroy(session_id)
+                except SessionError:
+                    pass
+            conn.close()
+
+    def serve(self, address=DEFAULT_ADDRESS, authkey=None):
+        """Accept clients until interrupted."""
+        if not address.startswith("\\\\") and os.path.exists(address):
+            os.unlink(address)  # Stale socket from an earlier run
+        with Listener(address, authkey=authkey) as listener:
+            print(f"Serving {len(self.workers)} workers on {address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except OSError:
+                    continue  # Failed handshake
+                threading.Thread(target=self.handle_client, args=(conn,),
+                                 name="emusnes-client", daemon=True).start()
+
+
+class SessionClient:
+    """Client for a running SessionServer."""
+
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None):
+        self.conn = Client(address, authkey=authkey)
+
+    def _request(self, *message):
+        try:
+            self.conn.send(message)
+            status, value = self.conn.recv()
+        except (EOFError, OSError):
+            raise SessionError("Server connection closed") from None
+        if status == "error":
+            raise SessionError(value)
+        return value
+
+    def create(self, kind, rom_path, core_path=None):
+        return self._request("create", kind, rom_path, core_path)
+
+    def set_input(self, session_id, mask):
+        self._request("input", session_id, mask)
+
+    def step(self, session_id, frames=1):
+        return self._request("step", session_id, frames)
+
+    def step_many(self, inputs, frames=1):
+        self._request("step_many", inputs, frames)
+
+    def frame(self, session_id):
+        return self._request("frame", session_id)
+
+    def destroy(self, session_id):
+        self._request("destroy", session_id)
+
+    def stats(self):
+        return self._request("stats")
+
+    def close(self):
+        self.conn.close()
+
+
+def benchmark(server, kind, rom_path, sessions, frames, core_path=None):
+    """Create sessions, step them together and print memory and latency."""
+    ids = [server.create(kind, rom_path, core_path) for _ in range(sessions)]
+    round_trips = []
+    for frame in range(frames):
+        mask = scripted_input(frame)
+        start = time.perf_counter()
+        server.step_many({session_id: mask for session_id in ids})
+        round_trips.append(time.perf_counter() - start)
+    total = sum(round_trips)
+    round_trips.sort()
+    stats = server.stats()
+    print(f"{'session':>7} {'pid':>7} {'memory':>10} {'mean':>9} {'p99':>9} {'max':>9}")
+    memory = []
+    for worker in stats:
+        for session_id, info in sorted(worker["sessions"].items()):
+            memory.append(info["memory"])
+            print(f"{session_id:>7} {worker['pid']:>7} {info['memory'] / 1024:>8.0f}KB "
+                  f"{info['mean_ms']:>7.3f}ms {info['p99_ms']:>7.3f}ms {info['max_ms']:>7.3f}ms")
+    print(f"{len(ids)} {kind} sessions on {len(stats)} workers, {frames} frames")
+    print(f"  memory per session: {sum(memory) / len(memory) / 1024:.0f} KB mean, "
+          f"{max(memory) / 1024:.0f} KB max; workers resident "
+          f"{sum(w['rss'] for w in stats) / 1024 / 1024:.1f} MB")
+    print(f"  step_many round trip: {total / frames * 1000:.3f} ms mean, "
+          f"{round_trips[int(len(round_trips) * 0.99)] * 1000:.3f} ms p99; "
+          f"{len(ids) * frames / total:.0f} session-frames/s")
+    for session_id in ids:
+        server.destroy(session_id)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless multi-session emulation server")
+    parser.add_argument("--address", default=DEFAULT_ADDRESS, help="socket path or pipe name")
+    parser.add_argument("--authkey", help="shared secret clients must present")
+    parser.add_argument("--workers", type=int, help="worker processes (default: CPU count)")
+    parser.add_argument("--stream", type=int, metavar="PORT", help="stream frames to viewers on PORT")
+    parser.add_argument("--stream-host", default="127.0.0.1",
+                        help="interface for --stream (0.0.0.0 for remote viewers)")
+    parser.add_argument("--stream-fps", type=int, default=30, help="frames per second streamed")
+    parser.add_argument("--bench", type=int, metavar="N", help="benchmark N sessions and exit")
+    parser.add_argument("--kind", choices=CORE_KINDS, default="snes9x", help="core for --bench")
+    parser.add_argument("--rom", help="ROM for --bench")
+    parser.add_argument("--core", help="libretro core library for --bench")
+    parser.add_argument("--frames", type=int, default=300, help="frames to run in --bench")
+    args = parser.parse_args(argv)
+    if args.bench and not args.rom:
+        parser.error("--bench needs --rom")
+    server = SessionServer(args.workers)
+    try:
+        if args.bench:
+            benchmark(server, args.kind, args.rom, args.bench, args.frames, args.core)
+        else:
+            if args.stream is not None:
+                stream = StreamServer(args.stream_host, args.stream)
+                stream.start()
+                threading.Thread(target=publish_sessions, args=(server, stream, args.stream_fps),
+                                 name="stream-publisher", daemon=True).start()
+                print(f"Streaming sessions on {args.stream_host}:{stream.port}")
+            server.serve(args.address, args.authkey.encode() if args.authkey else None)
+    except (SessionError, StreamError) as e:
+        print(f"Error: {e}")
+        return 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,35 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
 import os
+import queue
+import struct
+import threading
 import time
-import winsound  # For basic audio (Windows)
+import zlib
+from array import array
+from apu import APU, MASTER_CLOCK
+from audio import AudioOutput, SAMPLE_RATE, CHANNELS
+from movie import MoviePlayer, MovieRecorder, MovieError
+import savestate
+from savestate import SaveSlots, SaveStateError, SaveStateWriter
+from rewind import RewindBuffer
+from memory import PagedMemory, PAGE_SHIFT
+from sram import BatteryRAM, sram_path
+from capture import FrameCapture
+from romheader import parse_header
+from thumbcache import ThumbnailCache
 
 # Simplified SNES Emulation Core
 class Snes9xCore:
+    CYCLES_PER_FRAME = 1000  # Simplified cycle count
+    MASTER_CYCLES_PER_CYCLE = MASTER_CLOCK // 60 // CYCLES_PER_FRAME
+    SRAM_START, SRAM_END = 0x6000, 0x7FFF  # Cartridge SRAM window (mirrored)
+
     def __init__(self):
         self.frame_width = 256
         self.frame_height = 224
         self.memory = bytearray(0x10000)  # 64KB RAM
+        self.wram = PagedMemory(self.memory)  # Dirty 4KB pages since the last snapshot
         self.rom = bytearray()  # ROM data
         self.pc = 0x8000  # Program counter
         self.reg_a = 0  # Accumulator
@@ -18,10 +38,22 @@ class Snes9xCore:
         self.input_state = [0] * 16  # SNES controller buttons
         self.frame_buffer = [0] * (self.frame_width * self.frame_height)  # RGB pixels
         self.cycle_count = 0
+        self.audio_samples = array("h")  # Interleaved stereo output of the last frame
+        self.tone_phase = 0.0
+        self.apu = APU()  # SPC700 + S-DSP, synced on port access and at frame end
+        self.rom_crc = 0
+        self.sram = None  # BatteryRAM when the cartridge header declares save RAM
+
+    def load_game(self, rom_path, rom_data=None, battery=True):
+        """Load a ROM file or use a hardcoded demo.
 
-    def load_game(self, rom_path):
-        """Load a ROM file or use a hardcoded demo."""
-        if rom_path and os.path.exists(rom_path):
+        rom_data may be a read-only buffer already holding the ROM (e.g. a
+        mapping shared between server sessions); it is used without a copy.
+        With battery False the .srm is left alone and save RAM is memory only.
+        """
+        if rom_data is not None:
+            self.rom = rom_data
+        elif rom_path and os.path.exists(rom_path):
             with open(rom_path, 'rb') as f:
                 self.rom = bytearray(f.read())
         else:
@@ -31,11 +63,30 @@ class Snes9xCore:
                 0x85, 0x10,  # STA $10 (store direction)
                 0x4C, 0x00, 0x80  # JMP $8000 (loop)
             ])
+        self.rom_crc = zlib.crc32(self.rom)
+        self.close_sram()
+        size = self.sram_size()
+        if size and rom_path:
+            self.sram = BatteryRAM(sram_path(rom_path) if battery else None, size)
         self.pc = 0x8000
+        self.wram.touch_all()
         self.memory[0x10] = 0  # Direction variable
         self.memory[0x20] = 128  # X position
         self.memory[0x21] = 112  # Y position
 
+    def sram_size(self):
+        """Save RAM size declared in the ROM header (0 for none)."""
+        header = parse_header(self.rom)  # LoROM or HiROM, with or without a copier header
+        if header is None:
+            return 0
+        return min(header["sram_size"], self.SRAM_END - self.SRAM_START + 1)
+
+    def close_sram(self):
+        """Flush pending save RAM changes (on ROM change and exit)."""
+        if self.sram:
+            self.sram.flush()
+            self.sram = None
+
     def reset(self):
         """Reset the emulator state."""
         self.pc = 0x8000
@@ -43,18 +94,119 @@ class Snes9xCore:
         self.memory[0x10] = 0
         self.memory[0x20] = 128
         self.memory[0x21] = 112
+        self.wram.touch(0x10)
         self.frame_buffer = [0] * (self.frame_width * self.frame_height)
+        self.apu.reset()
+
+    def master_clock(self):
+        """Current main-CPU time in master-clock cycles (the APU's sync timestamp)."""
+        return self.cycle_count * self.MASTER_CYCLES_PER_CYCLE
+
+    def bus_read(self, addr):
+        """Read a byte from the main CPU's address space."""
+        if 0x2140 <= addr <= 0x217F:  # APU I/O ports (mirrored every 4 bytes)
+            return self.apu.read_port(addr, self.master_clock())
+        if self.sram and self.SRAM_START <= addr <= self.SRAM_END:
+            return self.sram.data[(addr - self.SRAM_START) % len(self.sram)]
+        return self.memory[addr]
+
+    def bus_write(self, addr, value):
+        """Write a byte to the main CPU's address space."""
+        if 0x2140 <= addr <= 0x217F:
+            self.apu.write_port(addr, value, self.master_clock())
+        elif self.sram and self.SRAM_START <= addr <= self.SRAM_END:
+            self.sram.write((addr - self.SRAM_START) % len(self.sram), value)
+        else:
+            self.memory[addr] = value
+            self.wram.dirty[addr >> PAGE_SHIFT] = 1
+
+    def power_on(self):
+        """Cold start: clear RAM and counters so runs are reproducible."""
+        self.memory[:] = bytes(len(self.memory))
+        self.wram.touch_all()
+        self.cycle_count = 0
+        self.input_state = [0] * 16
+        self.apu.power_on()
+        self.reset()
 
     def set_input_state(self, button, state):
         """Update controller input state."""
         self.input_state[button] = state
 
+    def get_input_mask(self):
+        """Pack the 16 controller buttons into a bitmask (bit n = button n)."""
+        mask = 0
+        for button, state in enumerate(self.input_state):
+            if state:
+                mask |= 1 << button
+        return mask
+
+    def set_input_mask(self, mask):
+        """Unpack a controller bitmask into input_state."""
+        self.input_state = [(mask >> button) & 1 for button in range(16)]
+
+    _CPU_STATE = struct.Struct("<HBQ")
+    _ROM_ID = struct.Struct("<II")
+
+    def state_chunks(self):
+        """Savestate chunks for the CPU, work RAM, ROM identity and APU."""
+        return [
+            (b"CPU ", self._CPU_STATE.pack(self.pc, self.reg_a, self.cycle_count)),
+            (b"WRAM", memoryview(self.memory)),
+            (b"ROMI", self._ROM_ID.pack(self.rom_crc, len(self.rom))),
+        ] + self.sram_chunks() + self.apu.state_chunks()
+
+    def load_state_chunks(self, chunks):
+        """Restore from chunk payloads; the frame is re-rendered from RAM."""
+        crc, size = self._ROM_ID.unpack(chunks[b"ROMI"])
+        if (crc, size) != (self.rom_crc, len(self.rom)):
+            raise SaveStateError("State was saved with a different ROM")
+        self.pc, self.reg_a, self.cycle_count = self._CPU_STATE.unpack(chunks[b"CPU "])
+        wram = chunks[b"WRAM"]
+        if isinstance(wram, tuple):
+            self.wram.restore(wram)
+        else:
+            self.memory[:] = wram
+            self.wram.touch_all()
+        sram = chunks.get(b"SRAM")
+        if self.sram and sram is not None and bytes(sram) != self.sram.data:
+            self.sram.load(sram)
+        self.apu.load_state_chunks(chunks)
+
+    def sram_chunks(self):
+        return [(b"SRAM", bytes(self.sram.data))] if self.sram else []
+
+    def snapshot(self):
+        """Copy-on-write snapshot of the machine as (id, payload) chunks.
+
+        Small register chunks are copied; work RAM and APU RAM are tuples of
+        4KB pages, of which only pages written since the previous snapshot
+        are new objects. Restore with restore(); write to disk with
+        savestate.dump_chunks().
+        """
+        return [
+            (b"CPU ", self._CPU_STATE.pack(self.pc, self.reg_a, self.cycle_count)),
+            (b"WRAM", self.wram.snapshot()),
+            (b"ROMI", self._ROM_ID.pack(self.rom_crc, len(self.rom))),
+        ] + self.sram_chunks() + self.apu.snapshot_chunks()
+
+    def restore(self, snapshot):
+        """Restore a snapshot() result, copying only pages that differ."""
+        self.load_state_chunks(dict(snapshot))
+
+    def serialize(self):
+        """Pack the full machine state into bytes (used by movies and states)."""
+        return savestate.dumps(self)
+
+    def unserialize(self, data):
+        """Restore state produced by serialize()."""
+        savestate.loads(self, data)
+
     def run(self):
         """Execute one frame’s worth of instructions (simplified)."""
         if not self.running or not self.rom:
             return
-        cycles_per_frame = 1000  # Simplified cycle count
-        for _ in range(cycles_per_frame):
+        for _ in range(self.CYCLES_PER_FRAME):
             if self.pc >= len(self.rom):
                 self.pc = 0x8000
             opcode = self.rom[self.pc]
@@ -65,7 +217,15 @@ class Snes9xCore:
             elif opcode == 0x85:  # STA absolute
                 addr = self.rom[self.pc]
                 self.pc += 1
-                self.memory[addr] = self.reg_a
+                self.bus_write(addr, self.reg_a)
+            elif opcode == 0x8D:  # STA absolute (16-bit; reaches the APU ports)
+                addr = (self.rom[self.pc + 1] << 8) | self.rom[self.pc]
+                self.pc += 2
+                self.bus_write(addr, self.reg_a)
+            elif opcode == 0xAD:  # LDA absolute (16-bit)
+                addr = (self.rom[self.pc + 1] << 8) | self.rom[self.pc]
+                self.pc += 2
+                self.reg_a = self.bus_read(addr)
             elif opcode == 0x4C:  # JMP absolute
                 self.pc = (self.rom[self.pc + 1] << 8) | self.rom[self.pc]
             self.cycle_count += 1
@@ -84,10 +244,27 @@ class Snes9xCore:
         x = max(0, min(x, self.frame_width - 20))
         y = max(0, min(y, self.frame_height - 20))
         self.memory[0x20], self.memory[0x21] = x, y
+        self.wram.dirty[0] = 1
+
+        # Catch the APU up to the end of the frame and collect its samples
+        self.audio_samples = self.apu.end_frame(self.master_clock())
+        self.generate_audio()
+        if self.sram:
+            self.sram.tick()  # Debounced write to the .srm file
 
-        # Generate audio (beep on A button)
-        if self.input_state[0]:
-            winsound.Beep(440, 10)  # 440 Hz for 10 ms
+    def generate_audio(self, tone_hz=440, volume=6000):
+        """Mix the demo tone (a square wave while A is held) into audio_samples."""
+        if not self.input_state[0]:
+            return
+        samples = self.audio_samples
+        step = tone_hz / SAMPLE_RATE
+        phase = self.tone_phase
+        for i in range(0, len(samples), CHANNELS):
+            value = volume if phase < 0.5 else -volume
+            for ch in range(CHANNELS):
+                samples[i + ch] = max(-32768, min(32767, samples[i + ch] + value))
+            phase = (phase + step) % 1.0
+        self.tone_phase = phase
 
     def render_frame(self):
         """Render the frame buffer (software PPU)."""
@@ -114,10 +291,24 @@ class Snes9xEmulator:
         self.core = Snes9xCore()
         self.current_rom = None
         self.is_running = False
-        self.save_state = None
+        self.save_slots = None
+        self.state_slot = tk.IntVar(value=0)
+        self.movie_recorder = None
+        self.movie_player = None
+        self.capture = None  # FrameCapture while recording video
+        self.rewind = RewindBuffer(max_bytes=64 * 1024 * 1024)
+        self.rewinding = False
+        self.audio = AudioOutput()
+        self.state_writer = SaveStateWriter()
+        self.autosave_interval = 60.0  # Seconds between autosaves while running
+        self.last_autosave = time.time()
+        self.ui_events = queue.Queue()  # Status updates posted by worker threads
+        self.thumbnails = ThumbnailCache()  # Last frame of each game, for the library view
+        self.preview_pending = False  # Frames have run since the preview was saved
 
         self.create_gui()
         self.bind_inputs()
+        self.poll_ui_events()
 
     def create_gui(self):
         """Set up the Tkinter GUI."""
@@ -128,9 +319,33 @@ class Snes9xEmulator:
         file_menu.add_command(label="Open ROM...", command=self.open_rom)
         file_menu.add_command(label="Save State", command=self.save_state_func)
         file_menu.add_command(label="Load State", command=self.load_state_func)
+        slot_menu = tk.Menu(file_menu, tearoff=0)
+        for slot in range(10):
+            slot_menu.add_radiobutton(label=f"Slot {slot}", variable=self.state_slot, value=slot)
+        file_menu.add_cascade(label="State Slot", menu=slot_menu)
+        file_menu.add_command(label="Browse States...", command=self.browse_states)
+        file_menu.add_separator()
+        file_menu.add_command(label="Record Movie...", command=self.record_movie)
+        file_menu.add_command(label="Play Movie...", command=self.play_movie)
+        file_menu.add_command(label="Stop Movie", command=self.stop_movie)
+        file_menu.add_command(label="Record Video...", command=self.record_video)
+        file_menu.add_command(label="Stop Video", command=self.stop_video)
         file_menu.add_separator()
         file_menu.add_command(label="Exit", command=self.root.quit)
         menubar.add_cascade(label="File", menu=file_menu)
+        options_menu = tk.Menu(menubar, tearoff=0)
+        self.sync_to_audio = tk.BooleanVar(value=False)
+        options_menu.add_checkbutton(label="Sync to Audio", variable=self.sync_to_audio,
+                                     command=self.toggle_audio_sync)
+        self.autosave = tk.BooleanVar(value=False)
+        options_menu.add_checkbutton(label="Autosave", variable=self.autosave)
+        self.state_codec = tk.StringVar(value=self.state_writer.codec)
+        codec_menu = tk.Menu(options_menu, tearoff=0)
+        for label, codec in (("None", "none"), ("zlib", "zlib"), ("lzma", "lzma")):
+            codec_menu.add_radiobutton(label=label, variable=self.state_codec, value=codec,
+                                       command=self.set_state_codec)
+        options_menu.add_cascade(label="State Compression", menu=codec_menu)
+        menubar.add_cascade(label="Options", menu=options_menu)
 
         # Main frame
         self.main_frame = tk.Frame(self.root, bg=self.bg_color)
@@ -163,6 +378,8 @@ class Snes9xEmulator:
         """Bind keyboard inputs to SNES controls."""
         self.root.bind("<space>", self.toggle_emulation)
         self.root.bind("r", self.reset_emulation)
+        self.root.bind("<KeyPress-BackSpace>", lambda e: self.set_rewinding(True))
+        self.root.bind("<KeyRelease-BackSpace>", lambda e: self.set_rewinding(False))
         key_map = {"Up": 12, "Down": 13, "Left": 14, "Right": 15, "z": 0, "x": 1, "Return": 8}
         for key, button in key_map.items():
             self.root.bind(f"<KeyPress-{key}>", lambda e, b=button: self.core.set_input_state(b, 1))
@@ -181,11 +398,13 @@ class Snes9xEmulator:
         filetypes = [("SNES ROM files", "*.sfc *.smc"), ("All files", "*.*")]
         filename = filedialog.askopenfilename(title="Select SNES ROM", filetypes=filetypes)
         if filename and os.path.isfile(filename) and filename.lower().endswith(('.sfc', '.smc')):
+            self.save_preview()  # Of the game being left
             self.current_rom = filename
             rom_name = os.path.basename(filename)
             self.rom_label.config(text=f"ROM: {rom_name}")
             self.status_bar.config(text=f"Loaded: {rom_name}")
             self.core.load_game(filename)
+            self.save_slots = SaveSlots(filename)
             self.reset_emulation()
         else:
             messagebox.showerror("Invalid File", "Please select a valid .sfc or .smc file.")
@@ -198,6 +417,7 @@ class Snes9xEmulator:
         self.is_running = True
         self.core.running = True
         self.status_bar.config(text=f"Running: {os.path.basename(self.current_rom)}")
+        self.audio.start()
         self.emulation_loop()
 
     def emulation_loop(self):
@@ -205,10 +425,40 @@ class Snes9xEmulator:
         if not self.is_running:
             return
         current_time = time.time()
-        if current_time - self.core.last_frame >= 0.016:  # 60 FPS
+        if self.audio.rate_control:
+            due = self.audio.wants_frame()  # Paced by the audio buffer fill level
+        else:
+            due = current_time - self.core.last_frame >= 0.016  # 60 FPS
+        if due:
             self.core.last_frame = current_time
-            self.core.run()
+            audio = None
+            if self.rewinding:
+                # Step back one recorded frame per tick (playback speed)
+                state = self.rewind.pop()
+                if state is None:
+                    self.status_bar.config(text="Rewind: start of history")
+                else:
+                    self.core.restore(state)
+            else:
+                if self.movie_player:
+                    if not self.movie_player.feed(self.core):
+                        self.stop_movie()
+                elif self.movie_recorder:
+                    self.movie_recorder.record_frame(self.core)
+                self.core.run()
+                audio = self.core.audio_samples
+                self.audio.push(audio)
+                if not (self.movie_player or self.movie_recorder):
+                    self.rewind.push(self.core.snapshot())
+                if self.autosave.get() and current_time - self.last_autosave >= self.autosave_interval:
+                    self.last_autosave = current_time
+                    self.save_slots.save_async(self.core, "auto", self.state_writer,
+                                               self.state_written)
             self.core.render_frame()
+            self.preview_pending = True
+            if self.capture:
+                self.capture.add_pixels(self.core.frame_width, self.core.frame_height,
+                                        self.core.frame_buffer, audio)
             self.update_canvas()
         self.root.after(1, self.emulation_loop)  # Fine-grained scheduling
 
@@ -226,18 +476,50 @@ class Snes9xEmulator:
                         fill=hex_color, outline=hex_color
                     )
 
+    def toggle_audio_sync(self):
+        """Switch between wall-clock and audio-buffer frame pacing."""
+        requested = self.sync_to_audio.get()
+        if self.audio.pace_from_audio(requested):
+            self.status_bar.config(text="Pacing frames from audio")
+        elif requested:
+            self.sync_to_audio.set(False)
+            self.status_bar.config(text="Audio sync needs a realtime audio device")
+        else:
+            self.status_bar.config(text="Pacing frames from timer")
+
+    def set_rewinding(self, active):
+        """Hold Backspace to run the game backwards through the rewind buffer."""
+        if active and (self.movie_player or self.movie_recorder):
+            return  # Rewinding would desync the movie
+        if active != self.rewinding:
+            self.rewinding = active
+            if active:
+                self.status_bar.config(text="Rewinding...")
+            elif self.current_rom:
+                self.status_bar.config(text=f"Running: {os.path.basename(self.current_rom)}")
+
     def pause_emulation(self):
         """Pause the emulation."""
         if self.is_running:
             self.is_running = False
             self.core.running = False
+            self.save_preview()
             self.status_bar.config(text=f"Paused: {os.path.basename(self.current_rom)}")
 
+    def save_preview(self):
+        """Save the frame on screen as the ROM's library preview."""
+        if self.preview_pending and self.current_rom:
+            self.thumbnails.store_pixels(self.current_rom, self.core.frame_width,
+                                         self.core.frame_height, self.core.frame_buffer)
+        self.preview_pending = False
+
     def reset_emulation(self, event=None):
         """Reset the emulator."""
+        self.save_preview()
         self.is_running = False
         self.core.running = False
         self.core.reset()
+        self.rewind.clear()
         self.draw_message(f"ROM loaded: {os.path.basename(self.current_rom) if self.current_rom else 'None'}\nPress Start")
         self.status_bar.config(text="Ready")
 
@@ -248,29 +530,190 @@ class Snes9xEmulator:
         else:
             self.start_emulation()
 
+    def poll_ui_events(self):
+        """Apply status updates queued by background threads on the Tk thread."""
+        try:
+            while True:
+                self.ui_events.get_nowait()()
+        except queue.Empty:
+            pass
+        self.root.after(50, self.poll_ui_events)
+
+    def set_state_codec(self):
+        self.state_writer.codec = self.state_codec.get()
+        self.state_writer.level = 6 if self.state_writer.codec != "lzma" else 1
+
     def save_state_func(self):
-        """Save the current emulator state."""
-        if self.current_rom and self.is_running:
-            self.save_state = {
-                'memory': self.core.memory[:],
-                'pc': self.core.pc,
-                'reg_a': self.core.reg_a,
-                'x': self.core.memory[0x20],
-                'y': self.core.memory[0x21]
-            }
-            self.status_bar.config(text="State saved")
+        """Queue the current emulator state for the writer thread."""
+        if not self.save_slots:
+            return
+        slot = self.state_slot.get()
+        self.save_slots.save_async(self.core, slot, self.state_writer, self.state_written)
+        self.status_bar.config(text=f"Saving state to slot {slot}...")
+
+    def state_written(self, path, size, seconds, error):
+        """Writer thread callback; hands the result to the Tk thread."""
+        name = os.path.basename(path)
+        if error:
+            text = f"Failed to save {name}: {error}"
+        else:
+            text = f"State saved: {name} ({size // 1024} KB, {seconds * 1000:.0f} ms)"
+        self.ui_events.put(lambda: self.status_bar.config(text=text))
 
     def load_state_func(self):
-        """Load a previously saved state."""
-        if self.save_state:
-            self.core.memory = bytearray(self.save_state['memory'])
-            self.core.pc = self.save_state['pc']
-            self.core.reg_a = self.save_state['reg_a']
-            self.core.memory[0x20] = self.save_state['x']
-            self.core.memory[0x21] = self.save_state['y']
-            self.status_bar.config(text="State loaded")
+        """Load the state in the selected slot."""
+        if not self.save_slots:
+            return
+        slot = self.state_slot.get()
+        if not self.save_slots.exists(slot):
+            self.status_bar.config(text=f"Slot {slot} is empty")
+            return
+        start = time.perf_counter()
+        try:
+            self.save_slots.load(self.core, slot)
+        except (OSError, SaveStateError) as e:
+            messagebox.showerror("Load State", f"Failed to load state: {e}")
+            return
+        elapsed = (time.perf_counter() - start) * 1e6
+        self.rewind.clear()
+        self.core.render_frame()
+        self.update_canvas()
+        self.status_bar.config(text=f"State loaded from slot {slot} ({elapsed:.0f} µs)")
+
+    def browse_states(self):
+        """List saved states from the slot index; thumbnails fill in as they load."""
+        if not self.save_slots:
+            messagebox.showinfo("No ROM", "Load a ROM first!")
+            return
+        slots = self.save_slots.list_slots()
+        window = tk.Toplevel(self.root, bg=self.bg_color)
+        window.title(f"States: {self.save_slots.name}")
+        if not slots:
+            tk.Label(window, text="No saved states", fg=self.text_color,
+                     bg=self.bg_color).pack(padx=20, pady=20)
+            return
+        window.images = {}  # Keep PhotoImages alive while the window is open
+        labels = {}
+        order = sorted(slots, key=lambda slot: slots[slot].get("time", 0), reverse=True)
+        for row, slot in enumerate(order):
+            info = slots[slot]
+            saved = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(info.get("time", 0)))
+            thumb = tk.Label(window, width=8, height=3, bg="black")
+            thumb.grid(row=row, column=0, padx=5, pady=2)
+            labels[slot] = thumb
+            tk.Button(window, text=f"Slot {slot}   {saved}   {info.get('size', 0) // 1024} KB",
+                      bg=self.button_color, fg=self.text_color, anchor=tk.W,
+                      command=lambda s=slot: self.load_browsed_state(window, s)
+                      ).grid(row=row, column=1, sticky=tk.EW, padx=5)
+
+        def show(slot, thumbnail):
+            if not thumbnail or not window.winfo_exists():
+                return
+            width, height, rgb = thumbnail
+            image = tk.PhotoImage(data=b"P6 %d %d 255\n" % (width, height) + rgb, format="PPM")
+            window.images[slot] = image
+            labels[slot].config(image=image, width=width, height=height)
+
+        def load_thumbnails():
+            for slot in order:
+                thumbnail = self.save_slots.thumbnail(slot)
+                self.ui_events.put(lambda s=slot, t=thumbnail: show(s, t))
+
+        threading.Thread(target=load_thumbnails, name="thumbnails", daemon=True).start()
+
+    def load_browsed_state(self, window, slot):
+        window.destroy()
+        if isinstance(slot, int):
+            self.state_slot.set(slot)
+            self.load_state_func()
+            return
+        try:
+            self.save_slots.load(self.core, slot)
+        except (OSError, SaveStateError) as e:
+            messagebox.showerror("Load State", f"Failed to load state: {e}")
+            return
+        self.rewind.clear()
+        self.core.render_frame()
+        self.update_canvas()
+        self.status_bar.config(text=f"State loaded from {slot} slot")
+
+    def record_movie(self):
+        """Start recording input from power-on (or from the current state while running)."""
+        if not self.current_rom:
+            messagebox.showinfo("No ROM", "Load a ROM first!")
+            return
+        filename = filedialog.asksaveasfilename(title="Record Movie", defaultextension=".s9xm",
+                                                filetypes=[("Input movies", "*.s9xm")])
+        if not filename:
+            return
+        self.stop_movie()
+        self.movie_recorder = MovieRecorder(filename)
+        self.movie_recorder.start(self.core, from_power_on=not self.is_running)
+        self.status_bar.config(text=f"Recording: {os.path.basename(filename)}")
+
+    def play_movie(self):
+        """Replay a recorded movie through the core."""
+        if not self.current_rom:
+            messagebox.showinfo("No ROM", "Load a ROM first!")
+            return
+        filename = filedialog.askopenfilename(title="Play Movie",
+                                              filetypes=[("Input movies", "*.s9xm")])
+        if not filename:
+            return
+        self.stop_movie()
+        try:
+            self.movie_player = MoviePlayer(filename)
+        except (OSError, MovieError) as e:
+            messagebox.showerror("Movie Error", f"Failed to open movie: {e}")
+            return
+        self.movie_player.start(self.core)
+        self.status_bar.config(text=f"Playing: {os.path.basename(filename)}")
+        if not self.is_running:
+            self.start_emulation()
+
+    def stop_movie(self):
+        """Finish recording (writing the file) or stop playback."""
+        if self.movie_recorder:
+            recorder, self.movie_recorder = self.movie_recorder, None
+            try:
+                recorder.stop()
+            except OSError as e:
+                self.status_bar.config(text=f"Failed to save movie: {e}")
+            else:
+                self.status_bar.config(text=f"Movie saved: {recorder.frame_count} frames")
+        if self.movie_player:
+            self.status_bar.config(text=f"Movie finished at frame {self.movie_player.frame}")
+            self.movie_player = None
+
+    def record_video(self):
+        """Capture presented frames and audio in the background."""
+        filetypes = [("Y4M video", "*.y4m"), ("Raw RGB24 video", "*.rgb"),
+                     ("PNG sequence (folder)", "*")]
+        filename = filedialog.asksaveasfilename(title="Record Video", defaultextension=".y4m",
+                                                filetypes=filetypes)
+        if not filename:
+            return
+        self.stop_video()
+        try:
+            self.capture = FrameCapture(filename, fps=60)
+        except OSError as e:
+            messagebox.showerror("Record Video", f"Failed to start recording: {e}")
+            return
+        self.status_bar.config(text=f"Recording video: {os.path.basename(filename)}")
+
+    def stop_video(self):
+        if self.capture:
+            frames, dropped = self.capture.close()
+            self.capture = None
+            self.status_bar.config(text=f"Video saved: {frames + dropped} frames "
+                                        f"({dropped} repeated because the writer fell behind)")
 
 if __name__ == "__main__":
     root = tk.Tk()
     app = Snes9xEmulator(root)
     root.mainloop()
+    app.stop_video()
+    app.save_preview()
+    app.thumbnails.flush()
+    app.state_writer.flush()  # Don't lose a state still being written
+    app.core.close_sram()
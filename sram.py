@@ -0,0 +1,105 @@
+import os
+import time
+import zlib
+
+from savestate import write_atomic
+
+# Battery-backed cartridge RAM
+#
+# Save RAM lives in an in-memory buffer and is written to the .srm file
+# beside the ROM with a temp file plus rename, so a crash mid-write never
+# leaves a torn save. Writes are debounced: the file is only rewritten once
+# the game has stopped writing for `flush_delay` seconds (or at the latest
+# every `max_delay` seconds while it keeps writing), and only if the
+# contents differ from what is already on disk. Games that rewrite the same
+# bytes every frame therefore cost nothing.
+
+SRAM_EXTENSION = ".srm"
+
+
+def sram_path(rom_path):
+    """The .srm file that goes with a ROM."""
+    return os.path.splitext(rom_path)[0] + SRAM_EXTENSION
+
+
+class BatteryRAM:
+    """Cartridge save RAM backed by a .srm file with debounced flushing.
+
+    The emulation loop calls tick() once per frame. Cores that own their own
+    save RAM buffer (libretro) call poll() instead, which picks up changes by
+    checksum rather than per-write tracking. With path None the RAM is
+    never persisted (headless and regression runs).
+    """
+
+    def __init__(self, path, size=None, flush_delay=2.0, max_delay=30.0):
+        self.path = path
+        self.flush_delay = flush_delay
+        self.max_delay = max_delay
+        saved = b""
+        if path:
+            try:
+                with open(path, "rb") as f:
+                    saved = f.read()
+            except OSError:
+                pass
+        self.data = bytearray(size if size is not None else len(saved))
+        self.data[:len(saved)] = saved[:len(self.data)]
+        self.dirty = False  # Written since the last tick()
+        self.first_write = None  # When the unflushed changes started
+        self.last_write = None
+        self._flushed_crc = zlib.crc32(saved[:len(self.data)]) if saved else None
+        self._polled_crc = zlib.crc32(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def read(self, offset):
+        return self.data[offset]
+
+    def write(self, offset, value):
+        if self.data[offset] != value:
+            self.data[offset] = value
+            self.dirty = True
+
+    def load(self, data):
+        """Replace the contents (e.g. from a save state); flushed like a game write."""
+        self.data[:] = data
+        self.dirty = True
+
+    def poll(self, buffer):
+        """Copy in an externally owned save RAM buffer if it changed since the last poll."""
+        crc = zlib.crc32(buffer)
+        if crc != self._polled_crc:
+            self._polled_crc = crc
+            if len(self.data) != len(buffer):
+                self.data = bytearray(len(buffer))
+            self.data[:] = buffer
+            self.dirty = True
+
+    def tick(self, now=None):
+        """Flush if writes have gone idle long enough; returns True if the file was written."""
+        now = time.monotonic() if now is None else now
+        if self.dirty:
+            self.dirty = False
+            self.last_write = now
+            if self.first_write is None:
+                self.first_write = now
+        if self.first_write is None:
+            return False
+        if (now - self.last_write >= self.flush_delay or
+                now - self.first_write >= self.max_delay):
+            return self.flush()
+        return False
+
+    def flush(self):
+        """Write the file now if its contents changed; returns True if written."""
+        self.first_write = self.last_write = None
+        self.dirty = False
+        if not self.data or not self.path:
+            return False
+        crc = zlib.crc32(self.data)
+        if crc == self._flushed_crc:
+            return False
+        write_atomic(self.path, bytes(self.data))
+        self._flushed_crc = crc
+        return True
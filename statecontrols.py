@@ -0,0 +1,157 @@
+import os
+import queue
+import tkinter as tk
+from tkinter import messagebox
+
+from libretro import LibretroError
+from rewind import RewindBuffer
+from savestate import SaveSlots, SaveStateError, SaveStateWriter
+from thumbcache import ThumbnailCache
+
+REWIND_INTERVAL = 4  # Frames between rewind snapshots (serializing costs a full state)
+
+
+class StateControls:
+    """Save slots, background state writes, rewind and library previews for the
+    libretro front ends.
+
+    Mixed into a front end that has root, core, current_rom and status_label.
+    Works with any core that provides state_chunks(), snapshot() and
+    restore() (libretro.Core, corehost.RemoteCore); fallback cores without
+    them just report that states are unsupported.
+
+    Rewind records every REWIND_INTERVAL frames and can be switched off
+    from the menu. A RemoteCore serializes in its child right after the
+    frame it is running and hands the state back with that frame, so
+    recording never adds a round trip to the frame pipeline.
+    """
+
+    def init_state_controls(self):
+        self.save_slots = None
+        self.state_slot = tk.IntVar(value=0)
+        self.state_writer = SaveStateWriter()
+        self.rewind = RewindBuffer(max_bytes=64 * 1024 * 1024)
+        self.rewinding = False
+        self._rewind_core = None
+        self._rewind_supported = False
+        self._rewind_frames = 0
+        self.rewind_enabled = tk.BooleanVar(value=True)
+        self.ui_events = queue.Queue()  # Status updates posted by the writer thread
+        self.thumbnails = ThumbnailCache()
+        self._preview = None  # (ROM, last presented frame) not yet saved as its preview
+        self.root.bind("<KeyPress-BackSpace>", lambda e: self.set_rewinding(True))
+        self.root.bind("<KeyRelease-BackSpace>", lambda e: self.set_rewinding(False))
+        self.poll_ui_events()
+
+    def add_state_menu(self, menu):
+        menu.add_command(label="Save State", command=self.save_state)
+        menu.add_command(label="Load State", command=self.load_state)
+        slot_menu = tk.Menu(menu, tearoff=0)
+        for slot in range(10):
+            slot_menu.add_radiobutton(label=f"Slot {slot}", variable=self.state_slot, value=slot)
+        menu.add_cascade(label="State Slot", menu=slot_menu)
+        menu.add_checkbutton(label="Record Rewind", variable=self.rewind_enabled,
+                             command=self.rewind.clear)
+
+    def poll_ui_events(self):
+        try:
+            while True:
+                self.ui_events.get_nowait()()
+        except queue.Empty:
+            pass
+        self.root.after(50, self.poll_ui_events)
+
+    def states_supported(self):
+        if self.core is None or not hasattr(self.core, "snapshot"):
+            self.status_label.config(text="Save states need a running libretro core")
+            return False
+        if self.save_slots is None or self.save_slots.rom_path != self.current_rom:
+            self.save_slots = SaveSlots(self.current_rom)
+        return True
+
+    def save_state(self):
+        if not self.states_supported():
+            return
+        slot = self.state_slot.get()
+        try:
+            self.save_slots.save_async(self.core, slot, self.state_writer, self.state_written)
+        except LibretroError as e:
+            messagebox.showerror("Save State", f"Failed to save state: {e}")
+            return
+        self.status_label.config(text=f"Saving state to slot {slot}...")
+
+    def state_written(self, path, size, seconds, error):
+        """Writer thread callback; hands the result to the Tk thread."""
+        name = os.path.basename(path)
+        if error:
+            text = f"Failed to save {name}: {error}"
+        else:
+            text = f"State saved: {name} ({size // 1024} KB, {seconds * 1000:.0f} ms)"
+        self.ui_events.put(lambda: self.status_label.config(text=text))
+
+    def load_state(self):
+        if not self.states_supported():
+            return
+        slot = self.state_slot.get()
+        if not self.save_slots.exists(slot):
+            self.status_label.config(text=f"Slot {slot} is empty")
+            return
+        try:
+            self.save_slots.load(self.core, slot)
+        except (OSError, SaveStateError) as e:
+            messagebox.showerror("Load State", f"Failed to load state: {e}")
+            return
+        self.rewind.clear()
+        self.status_label.config(text=f"State loaded from slot {slot}")
+
+    def set_rewinding(self, active):
+        """Hold Backspace to step back through recorded frames."""
+        if active != self.rewinding:
+            self.rewinding = active
+            self.status_label.config(text="Rewinding..." if active else "Running")
+
+    def rewind_step(self):
+        """Before running a frame: restore the previous frame's state while rewinding."""
+        if self.rewinding and self.core is self._rewind_core:
+            state = self.rewind.pop()
+            if state is None:
+                self.status_label.config(text="Rewind: start of history")
+            else:
+                self.core.restore(state)
+
+    def keep_preview(self, image):
+        """Remember the frame just presented.
+
+        A copy: without NumPy, frame_image() can be a view of memory the
+        core owns and frees on close().
+        """
+        self._preview = (self.current_rom, image.copy())
+
+    def save_preview(self):
+        """Save the last presented frame as the ROM's library preview (on pause or exit)."""
+        if self._preview and self._preview[0]:
+            self.thumbnails.store_image(*self._preview)
+        self._preview = None
+
+    def record_rewind(self):
+        """After running a frame: add a state to the rewind history every few frames."""
+        if self.core is not self._rewind_core:
+            self.rewind.clear()  # New core or game
+            self._rewind_core = self.core
+            self._rewind_supported = hasattr(self.core, "snapshot")
+            self._rewind_frames = 0
+        if not self._rewind_supported or not self.rewind_enabled.get():
+            return
+        self._rewind_frames += 1
+        due = self._rewind_frames % REWIND_INTERVAL == 0 and not self.rewinding
+        try:
+            if hasattr(self.core, "request_snapshot"):  # RemoteCore: taken in the child
+                state = self.core.take_snapshot()
+                if state is not None and not self.rewinding:
+                    self.rewind.push(state)
+                if due:
+                    self.core.request_snapshot()
+            elif due:
+                self.rewind.push(self.core.snapshot())
+        except LibretroError:
+            self._rewind_supported = False  # Core can't serialize
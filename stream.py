@@ -0,0 +1,386 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+
+from pixels import np
+
+# Frame streaming to remote viewers
+#
+# StreamServer is an asyncio server that sends a session's frames to any
+# number of viewers, over plain TCP or WebSocket on the same port. The
+# emulation side calls publish() from its own thread; that only swaps in
+# the channel's latest frame and never waits on a viewer. Each viewer
+# coroutine sends the newest frame, then waits for the socket to drain;
+# frames published meanwhile are replaced by later ones, so a slow viewer
+# just gets a lower frame rate.
+#
+# Frames are XORed against the last frame that viewer received and
+# compressed with zlib. Unchanged pixels become zero bytes, so a mostly
+# static frame compresses to a few hundred bytes. Viewers sharing a base
+# frame share one encoding. Every message is
+#
+#   "S9XF", u32 sequence, u16 width, u16 height, u8 flags, u32 length,
+#   then `length` bytes of zlib data
+#
+# where flags bit 0 marks a key frame (raw RGB24, not a delta). A TCP
+# viewer sends "WATCH <channel>\n" and then reads messages. A WebSocket
+# viewer connects to ws://host:port/<channel> and receives one binary
+# message per frame.
+#
+#   python stream.py localhost:8765 3     watch session 3 in a Tk window
+
+FRAME_MAGIC = b"S9XF"
+_FRAME = struct.Struct("<4sIHHBI")
+FLAG_KEYFRAME = 1
+DEFAULT_PORT = 8765
+COMPRESS_LEVEL = 1  # Deltas are mostly zeros; higher levels buy little
+MAX_BUFFERED = 1024 * 1024  # Bytes queued per viewer before it counts as slow
+_WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class StreamError(Exception):
+    pass
+
+
+def xor_frames(a, b):
+    """Byte-wise XOR of two equally sized frames."""
+    if np is not None:
+        return np.bitwise_xor(np.frombuffer(a, np.uint8), np.frombuffer(b, np.uint8)).tobytes()
+    n = len(a)
+    return (int.from_bytes(a, "little") ^ int.from_bytes(b, "little")).to_bytes(n, "little")
+
+
+def encode_frame(seq, width, height, rgb, base=None):
+    """One stream message: a delta against base, or a key frame when base is None."""
+    if base is None:
+        flags, data = FLAG_KEYFRAME, rgb
+    else:
+        flags, data = 0, xor_frames(rgb, base)
+    payload = zlib.compress(data, COMPRESS_LEVEL)
+    return _FRAME.pack(FRAME_MAGIC, seq, width, height, flags, len(payload)) + payload
+
+
+class FrameDecoder:
+    """Viewer side: rebuild RGB24 frames from stream messages."""
+
+    def __init__(self):
+        self.frame = None
+        self.width = self.height = 0
+
+    def decode(self, header, payload):
+        """Apply one message; returns (width, height, rgb)."""
+        magic, seq, width, height, flags, length = _FRAME.unpack(header)
+        if magic != FRAME_MAGIC:
+            raise StreamError("Not a frame stream")
+        data = zlib.decompress(payload)
+        if flags & FLAG_KEYFRAME:
+            self.frame = data
+        elif self.frame is None or (width, height) != (self.width, self.height):
+            raise StreamError("Delta frame without a matching key frame")
+        else:
+            self.frame = xor_frames(self.frame, data)
+        self.width, self.height = width, height
+        return width, height, self.frame
+
+
+class _Channel:
+    def __init__(self):
+        self.seq = 0
+        self.frame = None  # (width, height, rgb)
+        self.encoded = {}  # Base sequence (None for key frame) -> future of the message
+        self.viewers = set()  # asyncio.Event per viewer, set on each new frame
+
+
+class StreamServer:
+    """Serve published frames to TCP and WebSocket viewers from a background loop."""
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT):
+        self.host, self.port = host, port
+        self.channels = {}
+        self.loop = None
+        self._server = None
+        self._thread = None
+        self._stopping = None
+        self._tasks = set()  # Viewer tasks, cancelled on stop()
+        self._watched = set()
+        self._watched_lock = threading.Lock()
+        self.sent = self.dropped = 0
+
+    def start(self):
+        """Run the server on its own thread; returns once it is listening."""
+        ready = threading.Event()
+        errors = []
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            try:
+                self.loop.run_until_complete(self._serve(ready, errors))
+            finally:
+                self.loop.close()
+
+        self._thread = threading.Thread(target=run, name="frame-stream", daemon=True)
+        self._thread.start()
+        ready.wait()
+        if errors:
+            raise StreamError(f"Cannot listen on {self.host}:{self.port}: {errors[0]}")
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def _serve(self, ready, errors):
+        try:
+            self._server = await asyncio.start_server(self._client, self.host, self.port)
+        except OSError as e:
+            errors.append(e)
+            ready.set()
+            return
+        self._stopping = asyncio.Event()
+        ready.set()
+        async with self._server:
+            await self._stopping.wait()
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stop(self):
+        """Disconnect all viewers and stop listening."""
+        if self._stopping is not None and self._thread.is_alive():
+            self.loop.call_soon_threadsafe(self._stopping.set)
+            self._thread.join(5)
+
+    def watched(self):
+        """Channels that currently have at least one viewer."""
+        with self._watched_lock:
+            return set(self._watched)
+
+    def publish(self, channel, width, height, rgb):
+        """Offer a new frame for a channel; safe to call from any thread."""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._store, str(channel), width, height, bytes(rgb))
+
+    def _store(self, name, width, height, rgb):
+        channel = self.channels.get(name)
+        if channel is None or not channel.viewers:
+            return
+        if channel.frame == (width, height, rgb):
+            return  # Session hasn't moved; nothing to send
+        channel.seq += 1
+        channel.frame = (width, height, rgb)
+        channel.encoded = {}
+        for event in channel.viewers:
+            event.set()
+
+    def _message(self, channel, base):
+        """Future of the current frame encoded against base (seq, frame) or None."""
+        width, height, rgb = channel.frame
+        if base is not None and base[1][:2] != (width, height):
+            base = None  # Resized; start over with a key frame
+        key = base[0] if base is not None else None
+        future = channel.encoded.get(key)
+        if future is None:
+            future = channel.encoded[key] = self.loop.run_in_executor(
+                None, encode_frame, channel.seq, width, height, rgb,
+                base[1][2] if base is not None else None)
+        return future
+
+    async def _client(self, reader, writer):
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            request = await reader.readline()
+            if request.startswith(b"GET "):
+                name = await self._websocket_handshake(reader, writer, request)
+                send = self._websocket_send
+                drain = asyncio.ensure_future(self._websocket_drain(reader, writer))
+                self._tasks.add(drain)
+                drain.add_done_callback(self._tasks.discard)
+            elif request.startswith(b"WATCH "):
+                name = request[6:].strip().decode("utf-8", "replace")
+                send = self._tcp_send
+            else:
+                return
+            writer.transport.set_write_buffer_limits(high=MAX_BUFFERED)
+            await self._stream(name, writer, send)
+        except (ConnectionError, asyncio.IncompleteReadError, StreamError):
+            pass
+        except asyncio.CancelledError:
+            pass  # Server stopping
+        finally:
+            self._tasks.discard(task)
+            writer.close()
+
+    async def _stream(self, name, writer, send):
+        channel = self.channels.setdefault(name, _Channel())
+        event = asyncio.Event()
+        channel.viewers.add(event)
+        if channel.frame is not None:
+            event.set()  # Send what is on screen now; a static picture isn't republished
+        with self._watched_lock:
+            self._watched.add(name)
+        base = None  # (seq, frame) this viewer has
+        try:
+            while not writer.is_closing():
+                await event.wait()
+                event.clear()
+                if base is not None:
+                    self.dropped += channel.seq - base[0] - 1  # Replaced while we drained
+                seq, frame = channel.seq, channel.frame
+                message = await self._message(channel, base)
+                send(writer, message)
+                self.sent += 1
+                base = (seq, frame)
+                await writer.drain()  # Slow viewers wait here, not the emulator
+        finally:
+            channel.viewers.discard(event)
+            if not channel.viewers:
+                del self.channels[name]
+                with self._watched_lock:
+                    self._watched.discard(name)
+
+    @staticmethod
+    def _tcp_send(writer, message):
+        writer.write(message)
+
+    async def _websocket_handshake(self, reader, writer, request):
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        key = headers.get("sec-websocket-key")
+        if key is None:
+            writer.write(b"HTTP/1.1 400 Bad Request\r\n\r\n")
+            raise StreamError("Not a WebSocket request")
+        accept = base64.b64encode(hashlib.sha1(key.encode() + _WS_GUID).digest())
+        writer.write(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                     b"Connection: Upgrade\r\nSec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+        path = request.split()[1].decode("utf-8", "replace")
+        return path.strip("/")
+
+    @staticmethod
+    def _websocket_send(writer, message, opcode=0x2):
+        length = len(message)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        writer.write(header + message)
+
+    async def _websocket_drain(self, reader, writer):
+        """Read (and discard) viewer messages, answering pings and closes."""
+        try:
+            while True:
+                first, second = await reader.readexactly(2)
+                length = second & 0x7F
+                if length == 126:
+                    length, = struct.unpack("!H", await reader.readexactly(2))
+                elif length == 127:
+                    length, = struct.unpack("!Q", await reader.readexactly(8))
+                mask = await reader.readexactly(4) if second & 0x80 else b""
+                payload = await reader.readexactly(length)
+                opcode = first & 0x0F
+                if mask:
+                    payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+                if opcode == 0x8:  # Close
+                    self._websocket_send(writer, payload[:2], 0x8)
+                    break
+                if opcode == 0x9:  # Ping
+                    self._websocket_send(writer, payload, 0xA)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        writer.close()
+
+
+def publish_sessions(server, stream, fps=30, stop=None):
+    """Feed StreamServer from a SessionServer: grab watched sessions' frames at fps.
+
+    Channels are session ids. Only sessions with viewers are rendered, and
+    each grab waits for at most the frame being stepped on that worker.
+    """
+    from server import SessionError
+    interval = 1.0 / fps
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        start = time.perf_counter()
+        for channel in stream.watched():
+            try:
+                stream.publish(channel, *server.frame(int(channel)))
+            except (ValueError, SessionError):
+                pass  # Not a live session (yet)
+        stop.wait(max(0.0, interval - (time.perf_counter() - start)))
+
+
+def read_frames(address, channel, frames):
+    """Viewer thread: connect over TCP and put decoded frames on a queue."""
+    host, _, port = address.rpartition(":")
+    decoder = FrameDecoder()
+    with socket.create_connection((host or "127.0.0.1", int(port or DEFAULT_PORT))) as sock:
+        sock.sendall(f"WATCH {channel}\n".encode())
+        stream = sock.makefile("rb")
+        while True:
+            header = stream.read(_FRAME.size)
+            if len(header) < _FRAME.size:
+                break
+            payload = stream.read(_FRAME.unpack(header)[5])
+            frame = decoder.decode(header, payload)
+            try:
+                frames.get_nowait()  # Keep only the newest frame for the UI
+            except queue.Empty:
+                pass
+            frames.put(frame)
+    frames.put(None)
+
+
+def view(address, channel, scale=2):
+    """Show a stream in a Tk window."""
+    import tkinter as tk
+    from PIL import Image, ImageTk
+    root = tk.Tk()
+    root.title(f"Session {channel} - {address}")
+    label = tk.Label(root, bg="black")
+    label.pack()
+    frames = queue.Queue()
+    threading.Thread(target=read_frames, args=(address, channel, frames), daemon=True).start()
+
+    def poll():
+        try:
+            frame = frames.get_nowait()
+        except queue.Empty:
+            frame = False
+        if frame is None:
+            root.title(f"Session {channel} - stream ended")
+            return
+        if frame:
+            width, height, rgb = frame
+            image = Image.frombuffer("RGB", (width, height), rgb, "raw", "RGB", 0, 1)
+            label.image = ImageTk.PhotoImage(image.resize((width * scale, height * scale),
+                                                          Image.NEAREST))
+            label.config(image=label.image)
+        root.after(15, poll)
+
+    poll()
+    root.mainloop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Watch a streamed emulation session")
+    parser.add_argument("address", help="host:port of the stream server")
+    parser.add_argument("channel", help="session id to watch")
+    parser.add_argument("--scale", type=int, default=2, help="window scale factor")
+    args = parser.parse_args(argv)
+    view(args.address, args.channel, args.scale)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+import hashlib
+import io
+import os
+import queue
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+
+from savestate import write_atomic
+
+# Per-ROM preview images for the library view
+#
+# Each ROM can have one preview: the last frame presented before the game
+# was paused or closed, stored as a PNG under ~/.emusnes/previews (named by
+# a hash of the ROM path, so every front end and launcher shares it). In
+# front of the disk sits a bounded LRU of decoded thumbnails. get() answers
+# from the LRU or returns None and queues a load; PNG decoding, resizing
+# and encoding all run on one worker thread, whose results reach the UI
+# thread through notify(). Loads are served newest first, so rows that
+# just scrolled into view come before ones already scrolled past, and ROMs
+# without a preview are remembered too so scrolling doesn't keep probing
+# the disk.
+#
+# Thumbnails are (width, height, RGB bytes), the same shape as save-state
+# thumbnails, so Tk can show them as PPM PhotoImages without ImageTk.
+
+DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".emusnes", "previews")
+DEFAULT_CAPACITY = 256  # Thumbnails kept decoded (about 43 KB each at 128x112)
+THUMB_SIZE = (128, 112)  # Half of a 256x224 frame
+_NATIVE_XRGB = "BGRX" if sys.byteorder == "little" else "XRGB"  # array("I") of 0xRRGGBB
+_MISSING = object()  # LRU entry for a ROM known to have no preview
+
+
+class ThumbnailCache:
+    """Bounded in-memory LRU of preview thumbnails over an on-disk PNG cache.
+
+    notify(callback) must run callback() on the UI thread (see
+    procwatch.tk_notifier); by default callbacks run on the worker thread.
+    """
+
+    def __init__(self, directory=DEFAULT_DIR, capacity=DEFAULT_CAPACITY, size=THUMB_SIZE,
+                 notify=None):
+        self.directory = directory
+        self.capacity = capacity
+        self.size = size
+        self.notify = notify or (lambda callback: callback())
+        self.hits = 0
+        self.misses = 0
+        self._thumbs = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}  # path -> callbacks waiting for its load
+        self._jobs = queue.LifoQueue()
+        self._stores = queue.Queue()  # Written before any load, in order
+        self._worker = threading.Thread(target=self._run, name="thumbnails", daemon=True)
+        self._worker.start()
+
+    def path(self, rom_path):
+        """Preview file for a ROM."""
+        key = hashlib.sha1(os.path.abspath(rom_path).encode("utf-8", "surrogateescape"))
+        return os.path.join(self.directory, key.hexdigest() + ".png")
+
+    def get(self, rom_path, callback=None):
+        """Thumbnail of a ROM's preview if it is in memory, else None.
+
+        On a miss the preview is loaded in the background and
+        callback(rom_path, thumbnail) follows through notify(); thumbnail
+        is None if the ROM has no preview.
+        """
+        rom_path = os.path.abspath(rom_path)
+        with self._lock:
+            thumb = self._thumbs.get(rom_path)
+            if thumb is not None:
+                self._thumbs.move_to_end(rom_path)
+                self.hits += 1
+                return None if thumb is _MISSING else thumb
+            self.misses += 1
+            waiting = self._loading.get(rom_path)
+            if waiting is None:
+                waiting = self._loading[rom_path] = []
+                self._jobs.put(rom_path)
+            if callback:
+                waiting.append(callback)
+        return None
+
+    def prefetch(self, rom_paths):
+        """Queue loads for ROMs about to be shown (e.g. the rows in view)."""
+        for rom_path in reversed(list(rom_paths)):  # LIFO: the first one loads first
+            self.get(rom_path)
+
+    def store(self, rom_path, width, height, data, mode="RGB"):
+        """Save a frame (bytes in a PIL raw mode) as the ROM's preview."""
+        self._queue_store(rom_path, (width, height, mode, bytes(data)))
+
+    def store_pixels(self, rom_path, width, height, pixels):
+        """Save a frame given as 0xRRGGBB ints (Snes9xCore.frame_buffer)."""
+        self.store(rom_path, width, height, array("I", pixels).tobytes(), _NATIVE_XRGB)
+
+    def store_image(self, rom_path, image):
+        """Save a PIL image (e.g. libretro.frame_image()) as the ROM's preview.
+
+        The image is converted on the worker thread, so it must not be
+        changed afterwards.
+        """
+        self._queue_store(rom_path, image)
+
+    def _queue_store(self, rom_path, frame):
+        self._stores.put((os.path.abspath(rom_path), frame))
+        self._jobs.put(None)  # Wake the worker
+
+    def forget(self, rom_path):
+        """Drop a ROM's preview from memory and disk."""
+        rom_path = os.path.abspath(rom_path)
+        with self._lock:
+            self._thumbs.pop(rom_path, None)
+        try:
+            os.remove(self.path(rom_path))
+        except OSError:
+            pass
+
+    def recheck_missing(self):
+        """Forget which ROMs had no preview (another front end may have saved one)."""
+        with self._lock:
+            for rom_path in [path for path, thumb in self._thumbs.items() if thumb is _MISSING]:
+                del self._thumbs[rom_path]
+
+    def flush(self):
+        """Wait until every stored preview has been written."""
+        self._stores.join()
+
+    def _remember(self, rom_path, thumb):
+        with self._lock:
+            self._thumbs[rom_path] = _MISSING if thumb is None else thumb
+            self._thumbs.move_to_end(rom_path)
+            while len(self._thumbs) > self.capacity:
+                self._thumbs.popitem(last=False)
+
+    def _thumbnail(self, image):
+        from PIL import Image
+        image = image.convert("RGB")
+        image.thumbnail(self.size, Image.BILINEAR)
+        return image.width, image.height, image.tobytes()
+
+    def _write(self, rom_path, frame):
+        from PIL import Image
+        if isinstance(frame, tuple):
+            width, height, mode, data = frame
+            image = Image.frombuffer("RGB", (width, height), data, "raw", mode, 0, 1)
+        else:
+            image = frame.convert("RGB")
+        png = io.BytesIO()
+        image.save(png, "PNG", compress_level=1)
+        try:
+            write_atomic(self.path(rom_path), png.getvalue())
+        except OSError:
+            pass  # Unwritable home: the preview lives in memory only
+        self._remember(rom_path, self._thumbnail(image))
+
+    def _load(self, rom_path):
+        thumb = None
+        try:
+            from PIL import Image
+            with Image.open(self.path(rom_path)) as image:
+                thumb = self._thumbnail(image)
+        except Exception:
+            pass  # No preview yet, or an unreadable one: a miss
+        finally:
+            # Always settle the load, or get() would never queue it again
+            with self._lock:
+                callbacks = self._loading.pop(rom_path, [])
+            self._remember(rom_path, thumb)
+        for callback in callbacks:
+            self.notify(lambda callback=callback: callback(rom_path, thumb))
+
+    def _run(self):
+        while True:
+            rom_path = self._jobs.get()
+            while True:
+                try:
+                    job = self._stores.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    self._write(*job)
+                except Exception:
+                    pass  # Bad frame (e.g. short data): skip it, keep serving
+                finally:
+                    self._stores.task_done()
+            if rom_path is not None:
+                try:
+                    self._load(rom_path)
+                except Exception:
+                    pass  # e.g. a failing notify(); later jobs still run